@@ -1,14 +1,63 @@
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.filters import FilterEqual, FilterInList, IntEqualFilter, IntInListFilter, \
+    DateTimeGreaterFilter
 from json_validator import ClientSchema, DistributionSchema
 from marshmallow.exceptions import ValidationError as MMValidationError
 from flask import flash
 from flask_admin.helpers import is_form_submitted
+from contextvars import ContextVar
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+import os
+# CURRENT PROJECT MODULES
+from db_api import Client, Message
+from db_api import parse_client_filter, ClientFilterError
 
 client_schema = ClientSchema()
 distribution_schema = DistributionSchema()
 
+# UNFILTERED LIST PAGES OF TABLES BIGGER THAN THIS SHOW ESTIMATED ROWS COUNT INSTEAD OF EXACT COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000))
+# PLANNER STATISTICS, UPDATED BY (AUTO)VACUUM AND ANALYZE. -1 (PG 14+) OR 0 IF TABLE WAS NEVER ANALYZED
+ESTIMATED_COUNT = text('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)')
 
-class DistributionView(ModelView):
+# ESTIMATE OF THE CURRENT get_list CALL, CONTEXT LOCAL SINCE VIEW INSTANCES ARE SHARED BY ALL REQUESTS
+_list_estimated_count = ContextVar('list_estimated_count', default=None)
+
+
+class EstimatedCount:
+    """ Stands for the count query of unfiltered list pages, get_list only calls scalar() on it """
+
+    def __init__(self, value: int):
+        self.value = value
+
+    def scalar(self) -> int:
+        return self.value
+
+
+class EstimatedCountView(ModelView):
+    """ ModelView counting rows of big tables by planner statistics (pg_class.reltuples) when list isn't filtered """
+    estimated_count_threshold = ADMIN_ESTIMATED_COUNT_THRESHOLD
+
+    def estimated_count(self):
+        return self.session.execute(ESTIMATED_COUNT, {"table": self.model.__tablename__}).scalar()
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        estimate = None if search or filters else self.estimated_count()
+        if estimate is not None and estimate < self.estimated_count_threshold:
+            estimate = None
+        token = _list_estimated_count.set(estimate)
+        try:
+            return super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        finally:
+            _list_estimated_count.reset(token)
+
+    def get_count_query(self):
+        estimate = _list_estimated_count.get()
+        return super().get_count_query() if estimate is None else EstimatedCount(estimate)
+
+
+class DistributionView(EstimatedCountView):
     can_edit = True
     can_create = True
     can_delete = False
@@ -28,18 +77,34 @@ class DistributionView(ModelView):
             if form.client_filter.data is None:
                 flash('Client filter cannot be null')
                 return
+            try:
+                parse_client_filter(form.client_filter.data)
+            except ClientFilterError as err:
+                flash(f'Invalid client filter: {err}')
+                return
             return super().validate_form(form)
 
 
-class ClientView(ModelView):
+class ClientView(EstimatedCountView):
     can_edit = True
     can_create = True
     can_delete = False
     can_view_details = True
 
     form_create_rules = ['mobile_number', 'mobile_operator_code', 'tag', 'timezone']
-    column_filters = form_edit_rules = ['mobile_number', 'mobile_operator_code', 'tag', 'timezone', 'was_deleted']
-    column_sortable_list = ['id', 'mobile_operator_code', 'tag', 'was_deleted']
+    form_edit_rules = ['mobile_number', 'mobile_operator_code', 'tag', 'timezone', 'was_deleted']
+    # ONLY FILTERS AND SORTS SERVED BY INDEXES (SEE Client.__table_args__), CLIENTS TABLE MAY BE HUGE
+    column_filters = [
+        FilterEqual(Client.mobile_number, 'Mobile Number'),
+        FilterInList(Client.mobile_number, 'Mobile Number'),
+        FilterEqual(Client.mobile_operator_code, 'Mobile Operator Code'),
+        FilterInList(Client.mobile_operator_code, 'Mobile Operator Code'),
+        FilterEqual(Client.tag, 'Tag'),
+        FilterInList(Client.tag, 'Tag'),
+        FilterEqual(Client.timezone, 'Timezone'),
+        DateTimeGreaterFilter(Client.updated_at, 'Updated At'),
+    ]
+    column_sortable_list = ['id', 'mobile_number', 'mobile_operator_code', 'tag', 'updated_at']
     column_display_pk = 'id'
     column_default_sort = 'id'
 
@@ -47,6 +112,13 @@ class ClientView(ModelView):
         'mobile_operator_code': 'Mobile Operator Code (unrequired)',
     }
 
+    def handle_view_exception(self, exc):
+        # UNIQUE ix_clients_mobile_number REJECTED CREATE OR EDIT
+        if isinstance(exc, IntegrityError) and 'ix_clients_mobile_number' in str(exc.orig):
+            flash('Client with this mobile number already exists', 'error')
+            return True
+        return super().handle_view_exception(exc)
+
     def validate_form(self, form):
         if is_form_submitted():
             if form.mobile_number.data is None:
@@ -66,17 +138,23 @@ class ClientView(ModelView):
             return super().validate_form(form)
 
 
-class MessageView(ModelView):
+class MessageView(EstimatedCountView):
     can_edit = False
     can_create = False
     can_delete = False
     can_view_details = True
 
-    column_filters = ['distribution_id', 'client_id', 'send_status', 'send_status']
+    # ONLY FILTERS AND SORTS SERVED BY INDEXES (SEE Message.__table_args__), MESSAGES TABLE IS THE BIGGEST ONE
+    column_filters = [
+        IntEqualFilter(Message.distribution_id, 'Distribution Id'),
+        IntInListFilter(Message.distribution_id, 'Distribution Id'),
+    ]
     column_list = ['id', 'distribution', 'client', 'send_date', 'send_status']
-    column_sortable_list = ['id', 'send_date', 'send_status']
+    # ONE JOINED QUERY PER PAGE INSTEAD OF LAZY LOADS OF DISTRIBUTION AND CLIENT FOR EVERY ROW
+    column_select_related_list = ['distribution', 'client']
+    column_sortable_list = ['id']
     column_display_pk = 'id'
     column_default_sort = 'id'
 
 
-__all__ = ['DistributionView', 'ClientView', 'MessageView', 'is_form_submitted']
+__all__ = ['DistributionView', 'ClientView', 'MessageView', 'EstimatedCountView', 'is_form_submitted']
@@ -0,0 +1,84 @@
+"""
+Shared parts of the benchmarks: throwaway database guard, schema reset and a local stub of the send API.
+
+Benchmarks drop and recreate all tables, so they refuse to run against a database whose name doesn't end with _bench:
+
+    createdb fabrique_bench && python -m benchmarks.statistic_bench --database fabrique_bench
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import Counter
+from threading import Thread, Lock
+import sys
+import time
+import os
+
+
+BENCH_DATABASE_SUFFIX = '_bench'
+
+
+def add_database_argument(parser):
+    parser.add_argument('--database', default=os.getenv('POSTGRES_DB'),
+                        help=f'throwaway database named *{BENCH_DATABASE_SUFFIX}, POSTGRES_DB by default')
+
+
+def use_bench_database(database):
+    """ Point POSTGRES_DB (this process, workers and servers it starts) at a throwaway database, exit on any other """
+    if not database or not database.endswith(BENCH_DATABASE_SUFFIX):
+        sys.exit(f'database {database} is not a throwaway database: benchmarks drop all its tables, '
+                 f'pass --database <name>{BENCH_DATABASE_SUFFIX}')
+    if 'db_api' in sys.modules:
+        sys.exit('use_bench_database must be called before db_api is imported')
+    os.environ['POSTGRES_DB'] = database
+
+
+def reset_database():
+    """ Empty tables of the current schema, made by create_all """
+    from db_api import Base, engine
+    # SECOND CHECK ON THE ENGINE ITSELF, IN CASE A BENCHMARK FORGOT use_bench_database
+    if not engine.url.database.endswith(BENCH_DATABASE_SUFFIX):
+        sys.exit(f'refusing to drop tables of {engine.url.database}, it is not a *{BENCH_DATABASE_SUFFIX} database')
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+class StubSendAPI:
+    """ Local send API answering 200 after latency seconds, counts requests per message id """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = Counter()
+        self.lock = Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), make_stub_handler(self))
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/v1/send/'
+
+    def start(self):
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+def make_stub_handler(api: StubSendAPI):
+    class StubSendHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if api.latency:
+                time.sleep(api.latency)
+            with api.lock:
+                api.sent[int(self.path.rsplit('/', 1)[-1])] += 1
+            body = b'{"code": 0, "message": "OK"}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return StubSendHandler
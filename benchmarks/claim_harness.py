@@ -0,0 +1,89 @@
+"""
+Runs N distribution maker workers against the configured Postgres (POSTGRES_* env) and a local stub of the send API,
+then checks that every message was successfully sent exactly once.
+
+    python -m benchmarks.claim_harness --database fabrique_bench [--workers 4] [--clients 5000] [--kill-one]
+
+Drops and recreates all tables of the database, so it must be a throwaway one named *_bench (benchmarks._common).
+--kill-one SIGKILLs a worker mid-run, its leases expire (--lease seconds) and are taken over by the others.
+Killed workers may have sent messages whose statuses were never written back, those are reported as resent.
+"""
+from datetime import datetime, timedelta
+from multiprocessing import Process
+import argparse
+import signal
+import sys
+import time
+import os
+# CURRENT PROJECT MODULES
+from benchmarks._common import StubSendAPI, add_database_argument, reset_database, use_bench_database
+
+
+def run_worker(url, worker_id, lease):
+    os.environ.update(SEND_API_URL=url, WORKER_ID=worker_id, SEND_LEASE_SECONDS=str(lease), SEND_TICK_SECONDS='1')
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    import distribution_maker_app
+    distribution_maker_app.main()
+
+
+def seed(clients):
+    engine = reset_database()
+    from db_api import SessionLocal, Distribution, Client
+    session = SessionLocal()
+    session.add(Distribution(start_date=datetime.now(), text='harness', client_filter='harness',
+                             end_date=datetime.now() + timedelta(hours=1)))
+    session.bulk_insert_mappings(Client, [
+        dict(mobile_number=f'7917{i:07d}', mobile_operator_code='917', tag='harness') for i in range(clients)
+    ])
+    session.commit()
+    session.close()
+    engine.dispose()
+
+
+def sent_in_db():
+    from db_api import SessionLocal, Message
+    session = SessionLocal()
+    try:
+        return session.query(Message).filter(Message.send_status == 'SENT').count()
+    finally:
+        session.close()
+
+
+def main(workers, clients, kill_one, lease, timeout):
+    seed(clients)
+    api = StubSendAPI().start()
+    procs = [Process(target=run_worker, args=(api.url, f'harness-{i}', lease)) for i in range(workers)]
+    started = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    if kill_one:
+        time.sleep(1)
+        os.kill(procs[0].pid, signal.SIGKILL)
+    while sent_in_db() < clients and time.perf_counter() - started < timeout:
+        time.sleep(0.5)
+    elapsed = time.perf_counter() - started
+    for proc in procs:
+        proc.terminate()
+        proc.join()
+    api.shutdown()
+    in_db = sent_in_db()
+    sent = api.sent
+    resent = sum(1 for count in sent.values() if count > 1)
+    print(f'workers={workers} clients={clients} seconds={elapsed:.1f} msg/s={in_db / elapsed:.0f}')
+    print(f'SENT in db: {in_db}, sent by API: {len(sent)}, sent more than once: {resent}')
+    ok = in_db == clients and len(sent) == clients and (resent == 0 or kill_one)
+    print('OK' if ok else 'FAILED')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=5000)
+    parser.add_argument('--kill-one', action='store_true')
+    parser.add_argument('--lease', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=300)
+    add_database_argument(parser)
+    args = parser.parse_args()
+    use_bench_database(args.database)
+    sys.exit(0 if main(args.workers, args.clients, args.kill_one, args.lease, args.timeout) else 1)
@@ -0,0 +1,35 @@
+"""
+Dispatcher throughput against a local stub of the send API.
+
+    python -m benchmarks.dispatch_bench [--messages 2000] [--latency-ms 20] [--levels 1,4,16,64]
+
+The stub answers 200 after the given latency, which stands in for the remote API round trip.
+"""
+import argparse
+import time
+# CURRENT PROJECT MODULES
+from benchmarks._common import StubSendAPI
+from sender import Dispatcher, SendJob
+
+
+def run(messages, latency, levels):
+    api = StubSendAPI(latency).start()
+    print(f'{"concurrency":>12} {"sent":>8} {"seconds":>9} {"msg/s":>9}')
+    for level in levels:
+        dispatcher = Dispatcher(token='bench', url=api.url, concurrency=level)
+        jobs = (SendJob(msg_id=i, phone='79170000000', text='bench') for i in range(messages))
+        started = time.perf_counter()
+        sent = sum(1 for result in dispatcher.send(jobs) if result.ok)
+        elapsed = time.perf_counter() - started
+        dispatcher.close()
+        print(f'{level:>12} {sent:>8} {elapsed:>9.2f} {messages / elapsed:>9.0f}')
+    api.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--levels', default='1,4,16,64')
+    args = parser.parse_args()
+    run(args.messages, args.latency_ms / 1000, [int(x) for x in args.levels.split(',')])
@@ -0,0 +1,92 @@
+"""
+Per-row overhead of extension.funcs object_as_dict and dynamic_update, before and after caching and bulk UPDATE.
+
+    python -m benchmarks.funcs_bench --database fabrique_bench [--rows 10000] [--repeat 5]
+
+Drops and recreates all tables of --database, a throwaway one named *_bench (benchmarks._common).
+"before" is the previous implementation: inspect() of every row and one UPDATE per ORM object on flush,
+"after" of query + object_as_dict fetches column tuples instead of entities.
+"""
+from sqlalchemy import inspect, text
+import argparse
+import statistics
+import time
+# CURRENT PROJECT MODULES
+from benchmarks._common import add_database_argument, reset_database, use_bench_database
+
+
+def seed(rows):
+    engine = reset_database()
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO clients (mobile_number, mobile_operator_code, tag, timezone, was_deleted) "
+            "SELECT '79' || lpad(i::text, 9, '0'), '917', 'bench', 'Europe/Moscow', false FROM generate_series(1, :n) i"
+        ), dict(n=rows))
+        conn.execute(text('ANALYZE'))
+
+
+def legacy_object_as_dict(query_object):
+    return [{c.key: getattr(item, c.key) for c in inspect(item).mapper.column_attrs} for item in query_object]
+
+
+def legacy_dynamic_update(query_object, attrs):
+    for obj in query_object:
+        for k, v in attrs.items():
+            if hasattr(obj, k):
+                setattr(obj, k, v)
+    return query_object
+
+
+def measure(func, repeat, setup=None):
+    timings = []
+    for attempt in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func(attempt)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main(rows, repeat, skip_seed):
+    if not skip_seed:
+        seed(rows)
+    from db_api import SessionLocal, Client
+    from extension import object_as_dict, dynamic_update, column_keys
+    session = SessionLocal()
+    clients = session.query(Client).all()
+    columns = [getattr(Client, key) for key in column_keys(Client)]
+
+    def update(func):
+        def run(attempt):
+            func(clients, {'tag': f'bench{attempt}'})
+            session.commit()
+        return run
+
+    def reload():
+        # COMMIT EXPIRES OBJECTS, LOAD THEM BACK OUTSIDE OF THE MEASURED CALL
+        clients[:] = session.query(Client).all()
+
+    cases = [
+        ('object_as_dict entities', lambda _: legacy_object_as_dict(clients), lambda _: object_as_dict(clients), None),
+        ('query + object_as_dict', lambda _: legacy_object_as_dict(session.query(Client).all()),
+         lambda _: object_as_dict(session.query(*columns).all()), session.expunge_all),
+        ('dynamic_update + commit', update(legacy_dynamic_update), update(dynamic_update), reload),
+    ]
+    print(f'{len(clients)} clients')
+    print(f'{"operation":<28} {"before ms":>10} {"after ms":>10} {"before us/row":>14} {"after us/row":>13}')
+    for name, before, after, setup in cases:
+        before_ms, after_ms = measure(before, repeat, setup), measure(after, repeat, setup)
+        print(f'{name:<28} {before_ms:>10.1f} {after_ms:>10.1f} '
+              f'{before_ms * 1000 / len(clients):>14.2f} {after_ms * 1000 / len(clients):>13.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse data seeded by previous run')
+    add_database_argument(parser)
+    args = parser.parse_args()
+    use_bench_database(args.database)
+    main(args.rows, args.repeat, args.skip_seed)
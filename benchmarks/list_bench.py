@@ -0,0 +1,78 @@
+"""
+Latency and payload size of the client and distribution list endpoints on a seeded database.
+
+    python -m benchmarks.list_bench --database fabrique_bench [--clients 100000] [--distributions 100000] [--repeat 5]
+
+Drops and recreates all tables of --database, a throwaway one named *_bench (benchmarks._common).
+Measures the first page, a deep page (after_id near the end), a projected page and a page with total count.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import argparse
+import statistics
+import time
+# CURRENT PROJECT MODULES
+from benchmarks._common import add_database_argument, reset_database, use_bench_database
+
+
+def seed(clients, distributions):
+    engine = reset_database()
+    now = datetime.now()
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO distributions (start_date, text, client_filter, end_date, was_deleted) "
+            "SELECT :start, 'bench', 'bench', :end, false FROM generate_series(1, :n)"
+        ), dict(start=now, end=now + timedelta(hours=1), n=distributions))
+        conn.execute(text(
+            "INSERT INTO clients (mobile_number, mobile_operator_code, tag, timezone, was_deleted) "
+            "SELECT '79' || lpad(i::text, 9, '0'), '9' || lpad((i % 100)::text, 2, '0'), 'bench', "
+            "'Europe/Moscow', false FROM generate_series(1, :n) i"
+        ), dict(n=clients))
+        conn.execute(text('ANALYZE'))
+
+
+def endpoints(clients, distributions):
+    deep_client = max(clients - 1000, 0)
+    deep_distr = max(distributions - 1000, 0)
+    return [
+        '/api/v1/client/',
+        f'/api/v1/client/?after_id={deep_client}',
+        '/api/v1/client/?fields=id,mobile_number',
+        '/api/v1/client/?with_total=true',
+        '/api/v1/client/all',
+        '/api/v1/distribution/',
+        f'/api/v1/distribution/?after_id={deep_distr}',
+        '/api/v1/distribution/?fields=id,start_date,end_date',
+        '/api/v1/distribution/all?with_total=true',
+    ]
+
+
+def main(clients, distributions, repeat, skip_seed):
+    if not skip_seed:
+        seed(clients, distributions)
+    from distribution_manage_app import create_app
+    app = create_app()
+    client = app.test_client()
+    print(f'{clients} clients, {distributions} distributions')
+    print(f'{"endpoint":<55} {"median ms":>10} {"max ms":>10} {"KiB":>8}')
+    for endpoint in endpoints(clients, distributions):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(endpoint)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.data
+        size = len(response.data) / 1024
+        print(f'{endpoint:<55} {statistics.median(timings):>10.1f} {max(timings):>10.1f} {size:>8.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=100000)
+    parser.add_argument('--distributions', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse data seeded by previous run')
+    add_database_argument(parser)
+    args = parser.parse_args()
+    use_bench_database(args.database)
+    main(args.clients, args.distributions, args.repeat, args.skip_seed)
@@ -0,0 +1,149 @@
+"""
+Throughput and latency of the main read endpoints served by gunicorn with 1 vs N workers.
+
+    python -m benchmarks.load_test --database fabrique_bench [--workers 1 4] [--threads 4] [--duration 10]
+
+Drops and recreates all tables of --database, a throwaway one named *_bench (benchmarks._common) unless --skip-seed.
+For every worker count starts gunicorn -c gunicorn.conf.py wsgi:app on a local port, then for every endpoint
+keeps --concurrency requests in flight for --duration seconds from --client-processes processes
+and reports req/s, p50 and p99 latency and errors (non 200 responses).
+Load generator shares the machine with the server, give it spare cores or run it on another host with --url.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from sqlalchemy import text
+import requests as req
+import subprocess
+import argparse
+import statistics
+import time
+import os
+import sys
+# CURRENT PROJECT MODULES
+from benchmarks._common import add_database_argument, reset_database, use_bench_database
+
+
+ENDPOINTS = [
+    '/api/v1/client/',
+    '/api/v1/client/1',
+    '/api/v1/distribution/',
+    '/api/v1/distribution/1',
+    '/api/v1/statistic/',
+    '/api/v1/statistic/1?limit=100',
+    '/api/v1/statistic/timeseries',
+]
+
+
+def seed(clients, distributions, messages):
+    engine = reset_database()
+    now = datetime.now()
+    with engine.begin() as conn:
+        # SERVER MIGRATES ON START: TABLES MADE BY create_all ARE STAMPED AS THE LATEST REVISION (db_api.migrate)
+        conn.execute(text('DROP TABLE IF EXISTS alembic_version'))
+        conn.execute(text(
+            "INSERT INTO distributions (start_date, text, client_filter, end_date, was_deleted) "
+            "SELECT :start, 'bench', 'bench', :end, false FROM generate_series(1, :n)"
+        ), dict(start=now, end=now + timedelta(hours=1), n=distributions))
+        conn.execute(text(
+            "INSERT INTO clients (mobile_number, mobile_operator_code, tag, timezone, was_deleted) "
+            "SELECT '79' || lpad(i::text, 9, '0'), '917', 'bench', 'Europe/Moscow', false FROM generate_series(1, :n) i"
+        ), dict(n=clients))
+        conn.execute(text(
+            "INSERT INTO messages (distribution_id, client_id, send_status, send_date) "
+            "SELECT 1 + i % :d, 1 + i / :d, (ARRAY['SENT', 'FAIL'])[1 + i % 2], :now - (i % 1440) * interval '1 minute' "
+            "FROM generate_series(0, :n - 1) i"
+        ), dict(d=distributions, n=min(messages, clients * distributions), now=now))
+        conn.execute(text('ANALYZE'))
+
+
+def start_server(workers, threads, port):
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers), '--threads', str(threads),
+         '-b', f'127.0.0.1:{port}', 'wsgi:app'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            # EVERY WORKER IMPORTS THE APP ON ITS OWN, GIVE ALL OF THEM TIME TO BOOT
+            if req.get(f'http://127.0.0.1:{port}/api/v1/metrics/cache', timeout=1).status_code == 200:
+                time.sleep(workers)
+                return server
+        except req.RequestException:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError('gunicorn did not start in 60 seconds')
+
+
+def client_process(args):
+    """ Keep `concurrency` requests in flight until `until` (time.time()), return latencies in ms and errors """
+    url, concurrency, until = args
+
+    def loop(_):
+        latencies, errors = [], 0
+        with req.Session() as session:
+            while time.time() < until:
+                started = time.perf_counter()
+                try:
+                    ok = session.get(url, timeout=30).status_code == 200
+                except req.RequestException:
+                    ok = False
+                latencies.append((time.perf_counter() - started) * 1000)
+                errors += not ok
+        return latencies, errors
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(loop, range(concurrency)))
+    return [latency for latencies, _ in results for latency in latencies], sum(errors for _, errors in results)
+
+
+def load(pool, url, concurrency, processes, duration):
+    until = time.time() + duration
+    shares = [concurrency // processes + (i < concurrency % processes) for i in range(processes)]
+    results = pool.map(client_process, [(url, share, until) for share in shares if share])
+    latencies = sorted(latency for latencies, _ in results for latency in latencies)
+    errors = sum(errors for _, errors in results)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0
+    return len(latencies) / duration, statistics.median(latencies) if latencies else 0, p99, errors
+
+
+def main(args):
+    if not args.skip_seed and not args.url:
+        seed(args.clients, args.distributions, args.messages)
+    print(f'{args.concurrency} concurrent requests from {args.client_processes} processes, {args.duration}s per endpoint')
+    print(f'{"workers":>7} {"endpoint":<36} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    with Pool(args.client_processes) as pool:
+        for workers in args.workers:
+            server = None if args.url else start_server(workers, args.threads, args.port)
+            base_url = args.url or f'http://127.0.0.1:{args.port}'
+            try:
+                for endpoint in ENDPOINTS:
+                    rps, p50, p99, errors = load(pool, base_url + endpoint, args.concurrency, args.client_processes,
+                                                 args.duration)
+                    print(f'{workers if server else "-":>7} {endpoint:<36} {rps:>8.0f} {p50:>8.1f} {p99:>8.1f} '
+                          f'{errors:>7}', flush=True)
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait()
+            if args.url:
+                break
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--client-processes', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--url', help='load an already running server instead of starting gunicorn')
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--distributions', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse data seeded by previous run')
+    add_database_argument(parser)
+    args = parser.parse_args()
+    use_bench_database(args.database)
+    main(args)
@@ -0,0 +1,94 @@
+"""
+Marshmallow dump of ORM entities vs column-only query with json_validator.fast dump, for list responses.
+
+    python -m benchmarks.serialize_bench --database fabrique_bench [--rows 10000 100000] [--repeat 3]
+
+Drops and recreates all tables of --database, a throwaway one named *_bench (benchmarks._common).
+Seeds max(--rows) clients, distributions and messages, then for every size times fetch, dump and JSON encoding
+of both paths and checks that their JSON is byte-identical.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import argparse
+import json
+import statistics
+import time
+# CURRENT PROJECT MODULES
+from benchmarks._common import add_database_argument, reset_database, use_bench_database
+
+
+def seed(rows):
+    engine = reset_database()
+    now = datetime.now()
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO distributions (start_date, text, client_filter, end_date, was_deleted) "
+            "SELECT :start + i * interval '1 minute', 'bench ' || i, 'tag:bench', :end, i % 10 = 0 "
+            "FROM generate_series(1, :n) i"
+        ), dict(start=now, end=now + timedelta(hours=1), n=rows))
+        conn.execute(text(
+            "INSERT INTO clients (mobile_number, mobile_operator_code, tag, timezone, was_deleted) "
+            "SELECT '79' || lpad(i::text, 9, '0'), '9' || lpad((i % 100)::text, 2, '0'), "
+            "CASE WHEN i % 7 = 0 THEN NULL ELSE 'bench' END, 'Europe/Moscow', false FROM generate_series(1, :n) i"
+        ), dict(n=rows))
+        # EVERY THIRD MESSAGE IS NOT SENT YET, SO send_date IS NULL
+        conn.execute(text(
+            "INSERT INTO messages (distribution_id, client_id, send_status, send_date) "
+            "SELECT 1, i, (ARRAY['SENT', 'NOT_SENT', 'FAIL'])[1 + i % 3], "
+            "CASE WHEN i % 3 = 1 THEN NULL ELSE :now - i * interval '1 second' END FROM generate_series(1, :n) i"
+        ), dict(n=rows, now=now))
+        conn.execute(text('ANALYZE'))
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def run_path(session, query, dump):
+    rows, fetch_ms = timed(lambda: query.all())
+    dumped, dump_ms = timed(lambda: dump(rows))
+    encoded, encode_ms = timed(lambda: json.dumps(dumped))
+    session.close()
+    return encoded, (fetch_ms, dump_ms, encode_ms)
+
+
+def main(sizes, repeat, skip_seed):
+    if not skip_seed:
+        seed(max(sizes))
+    from db_api import SessionLocal, Client, Distribution, Message
+    from json_validator import ClientSchema, DistributionSchema, MessageSchema, fast_dump
+    cases = [('clients', Client, ClientSchema(many=True)), ('distributions', Distribution, DistributionSchema(many=True)),
+             ('messages', Message, MessageSchema(many=True))]
+    session = SessionLocal()
+    print(f'{"rows":>7} {"entity":<14} {"path":<12} {"fetch ms":>9} {"dump ms":>9} {"encode ms":>10} {"total ms":>9}')
+    for size in sizes:
+        for name, model, schema in cases:
+            dumper = fast_dump(schema)
+            paths = {
+                'marshmallow': (lambda: session.query(model).filter(model.id <= size).order_by(model.id), schema.dump),
+                'fast': (lambda: session.query(*dumper.columns(model)).filter(model.id <= size).order_by(model.id),
+                         dumper.dump),
+            }
+            encoded = {}
+            for path, (query, dump) in paths.items():
+                runs = []
+                for _ in range(repeat):
+                    encoded[path], timings = run_path(session, query(), dump)
+                    runs.append(timings)
+                fetch_ms, dump_ms, encode_ms = (statistics.median(run[i] for run in runs) for i in range(3))
+                print(f'{size:>7} {name:<14} {path:<12} {fetch_ms:>9.1f} {dump_ms:>9.1f} {encode_ms:>10.1f} '
+                      f'{fetch_ms + dump_ms + encode_ms:>9.1f}')
+            assert encoded['marshmallow'] == encoded['fast'], f'{name}: fast dump output differs'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse data seeded by previous run')
+    add_database_argument(parser)
+    args = parser.parse_args()
+    use_bench_database(args.database)
+    main(args.rows, args.repeat, args.skip_seed)
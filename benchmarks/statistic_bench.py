@@ -0,0 +1,69 @@
+"""
+Latency of the statistic endpoints on a seeded database.
+
+    python -m benchmarks.statistic_bench --database fabrique_bench [--distributions 1000] [--messages 100] [--repeat 5]
+
+Drops and recreates all tables of --database, a throwaway one named *_bench (benchmarks._common).
+Seeds N distributions with M messages each, statuses spread over SENT/NOT_SENT/FAIL.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import argparse
+import statistics
+import time
+# CURRENT PROJECT MODULES
+from benchmarks._common import add_database_argument, reset_database, use_bench_database
+
+
+ENDPOINTS = ['/api/v1/statistic/all', '/api/v1/statistic/?was_deleted=false']
+
+
+def seed(distributions, messages):
+    engine = reset_database()
+    now = datetime.now()
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO distributions (start_date, text, client_filter, end_date, was_deleted) "
+            "SELECT :start, 'bench', 'bench', :end, false FROM generate_series(1, :n)"
+        ), dict(start=now, end=now + timedelta(hours=1), n=distributions))
+        conn.execute(text(
+            "INSERT INTO clients (mobile_number, mobile_operator_code, tag, timezone, was_deleted) "
+            "SELECT '7917' || lpad(i::text, 7, '0'), '917', 'bench', 'Europe/Moscow', false "
+            "FROM generate_series(1, :n) i"
+        ), dict(n=messages))
+        conn.execute(text(
+            "INSERT INTO messages (distribution_id, client_id, send_status, send_date) "
+            "SELECT d, c, (ARRAY['SENT', 'NOT_SENT', 'FAIL'])[1 + (d + c) % 3], :now "
+            "FROM generate_series(1, :d) d, generate_series(1, :m) c"
+        ), dict(d=distributions, m=messages, now=now))
+        conn.execute(text('ANALYZE'))
+
+
+def main(distributions, messages, repeat, skip_seed):
+    if not skip_seed:
+        seed(distributions, messages)
+    from distribution_manage_app import create_app
+    app = create_app()
+    client = app.test_client()
+    print(f'{distributions} distributions x {messages} messages')
+    print(f'{"endpoint":<45} {"median ms":>10} {"max ms":>10}')
+    for endpoint in ENDPOINTS:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(endpoint)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.data
+        print(f'{endpoint:<45} {statistics.median(timings):>10.1f} {max(timings):>10.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--distributions', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-seed', action='store_true', help='reuse data seeded by previous run')
+    add_database_argument(parser)
+    args = parser.parse_args()
+    use_bench_database(args.database)
+    main(args.distributions, args.messages, args.repeat, args.skip_seed)
@@ -4,6 +4,7 @@ from class_based_views.client import ns as client_ns
 from class_based_views.distribution import ns as distribution_ns
 from class_based_views.statistic import ns as statistic_ns
 from class_based_views.message import ns as message_ns
+from class_based_views.metrics import ns as metrics_ns
 
 doc_blueprint = Blueprint('documented_api', __name__)
 
@@ -15,6 +16,7 @@ api_extension.add_namespace(client_ns, '/api/v1')
 api_extension.add_namespace(distribution_ns, '/api/v1')
 # api_extension.add_namespace(message_ns, '/api/v1')  # почему то message_ns и statistic_ns перетирают друг друга
 api_extension.add_namespace(statistic_ns, '/api/v1')
+api_extension.add_namespace(metrics_ns, '/api/v1')
 
 
 
@@ -1,23 +1,39 @@
-from flask import request, Blueprint, _app_ctx_stack
+from flask import request, Blueprint
+from werkzeug.datastructures import FileStorage
 from flask_restx import Resource, Api, fields
-from sqlalchemy.exc import InvalidRequestError
-from sqlalchemy.orm import scoped_session
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
 from marshmallow import ValidationError
 from flask_loguru import logger
 # CURRENT PROJECT MODULES
 from db_api import Client
-from db_api import SessionLocal
-from extension import dynamic_update
+from db_api import db_session
+from db_api import ClientImport, CLIENT_IMPORT_ON_CONFLICT, create_client
+from extension import dynamic_update, bulk_update
+from extension import parse_bulk_args, load_bulk_values
 from extension import data_provided_validator
+from extension import parse_list_args, paginate
+from extension import entity_cache
+from extension import make_etag, collection_version, conditional_response, conditional_entity
 from json_validator import ClientSchema
+from operator import attrgetter
+import json
+import csv
+import io
 
 # CREATE MARSHMALLOW SCHEMAS INSTANCES
 client_schema = ClientSchema()
-clients_schema = ClientSchema(many=True)
+
+# BULK IMPORT
+CLIENT_IMPORT_BATCH_SIZE = 5000
+CLIENT_IMPORT_MAX_ERRORS = 1000
+CLIENT_IMPORT_FORMATS = {'application/json': 'json', 'application/x-ndjson': 'ndjson', 'text/csv': 'csv'}
+
+# BULK UPDATE
+CLIENT_BULK_UPDATABLE = ('mobile_operator_code', 'tag', 'timezone')
 
 
 app_client = Blueprint('app_client', __name__)
-app_client.session = scoped_session(SessionLocal, scopefunc=_app_ctx_stack)
+app_client.session = db_session
 api = Api(app_client)
 
 
@@ -37,6 +53,28 @@ parser_client.add_argument('tag', type=str)
 parser_client.add_argument('timezone', type=str)
 parser_client.add_argument('was_deleted', type=bool)
 
+# LIST PAGINATION PARSER
+parser_list = api.parser()
+parser_list.add_argument('limit', type=int, help='Page size, 1000 by default')
+parser_list.add_argument('after_id', type=int, help='Return rows with id greater than this one (next_after_id of previous page)')
+parser_list.add_argument('fields', type=str, help='Comma separated fields to return, e.g. id,mobile_number')
+parser_list.add_argument('with_total', type=bool, help='Count all matched rows (slow on big tables)')
+
+parser_client_list = parser_client.copy()
+for arg in parser_list.args:
+    parser_client_list.add_argument(arg)
+
+# BULK PARSER: MODEL FILTERS AS IN LIST ENDPOINT, IDS AND DRY RUN
+parser_bulk = parser_client.copy()
+parser_bulk.add_argument('ids', type=str, help='Comma separated client ids, or "ids" list in JSON body')
+parser_bulk.add_argument('dry_run', type=bool, help='Only count clients which would change')
+
+parser_import = api.parser()
+parser_import.add_argument('on_conflict', type=str, choices=CLIENT_IMPORT_ON_CONFLICT, default='skip',
+                           help='skip keeps existing clients, update overwrites them with uploaded data')
+parser_import.add_argument('file', type=FileStorage, location='files',
+                           help='.json, .ndjson or .csv file, instead of raw request body')
+
 
 # CLIENT MODELS
 client_model = ns.model('Client', {
@@ -59,6 +97,8 @@ client_model_for_update = ns.model('Client Update', {
 clients_model_response = ns.model('Clients Response', {
     'clients': fields.List(fields.Nested(client_model), attribute='clients'),
     'message': fields.String(attribute='message'),
+    'next_after_id': fields.Integer(description='after_id of the next page, null on the last page'),
+    'total': fields.Integer(description='Matched clients count, only if with_total is set'),
 })
 
 client_model_response = ns.model('Client Response', {
@@ -66,24 +106,106 @@ client_model_response = ns.model('Client Response', {
     'message': fields.String(attribute='message'),
 })
 
+client_bulk_update_model = ns.model('Client Bulk Update', {
+    'ids': fields.List(fields.Integer, description='Clients to update, instead of or together with filter query args'),
+    'values': fields.Nested(client_model_for_update, required=True,
+                            description=f'Attributes to set, one of: {", ".join(CLIENT_BULK_UPDATABLE)}'),
+})
+
+client_bulk_delete_model = ns.model('Client Bulk Delete', {
+    'ids': fields.List(fields.Integer, description='Clients to delete, instead of or together with filter query args'),
+})
+
+client_bulk_response = ns.model('Client Bulk Response', {
+    'message': fields.String(attribute='message'),
+    'affected': fields.Integer(description='Clients changed, or which would change for dry_run'),
+    'dry_run': fields.Boolean(),
+})
+
+client_import_error_model = ns.model('Client Import Error', {
+    'row': fields.Integer(description='1-based row number in the upload, header excluded'),
+    'errors': fields.Raw(description='Field errors, as for POST /client/'),
+})
+
+client_import_response = ns.model('Client Import Response', {
+    'message': fields.String(attribute='message'),
+    'received': fields.Integer(description='Rows in the upload'),
+    'created': fields.Integer(description='New clients'),
+    'existing': fields.Integer(description='Numbers already present in database'),
+    'updated': fields.Integer(description='Existing clients changed, only for on_conflict=update'),
+    'duplicates': fields.Integer(description='Repeated numbers inside the upload, first one is used'),
+    'invalid': fields.Integer(description='Rows rejected by validation'),
+    'errors': fields.List(fields.Nested(client_import_error_model),
+                          description=f'First {CLIENT_IMPORT_MAX_ERRORS} rejected rows'),
+})
+
+
+def import_rows(stream, fmt):
+    """ Yield (row_no, row or None, parse error or None) from uploaded JSON array, NDJSON or CSV """
+    if fmt == 'json':
+        rows = json.load(stream)
+        if not isinstance(rows, list):
+            raise ValueError('JSON upload must be an array of clients')
+        for row_no, row in enumerate(rows, 1):
+            yield row_no, row, None
+        return
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'ndjson':
+        row_no = 0
+        for line in text_stream:
+            if not line.strip():
+                continue
+            row_no += 1
+            try:
+                yield row_no, json.loads(line), None
+            except ValueError as err:
+                yield row_no, None, {'_schema': [f'Invalid JSON: {err}']}
+    else:
+        for row_no, row in enumerate(csv.DictReader(text_stream), 1):
+            # EMPTY CELLS MEAN "NOT PROVIDED", SO SCHEMA DEFAULTS APPLY
+            yield row_no, {k: v for k, v in row.items() if k is not None and v not in ('', None)}, None
+
+
+def load_import_batch(batch):
+    """ Validate every row of a batch with ClientSchema. Returns valid (row_no, data) and errors """
+    valid, errors = [], []
+    for row_no, row in batch:
+        if not isinstance(row, dict):
+            errors.append({'row': row_no, 'errors': {'_schema': ['Client must be an object']}})
+            continue
+        # ROW BY ROW: A many=True LOAD SKIPS SCHEMA VALIDATORS OF ALL ROWS ONCE ANY ROW HAS A FIELD ERROR
+        try:
+            valid.append((row_no, client_schema.load(row)))
+        except ValidationError as err:
+            errors.append({'row': row_no, 'errors': err.messages})
+    return valid, errors
+
 
 @ns.route('/client/')
 class ClientView(Resource):
     @ns.doc('get_clients')
-    @ns.expect(parser_client, validate=False)
+    @ns.expect(parser_client_list, validate=False)
     @ns.response(200, model=clients_model_response, description='Matched clients')
+    @ns.response(304, 'Not Modified, response ETag is in If-None-Match')
     @ns.response(422, 'Error message')
     def get(self):
-        """ Get clients filtered by query params """
-        http_args = request.args
+        """ Get clients filtered by query params, paginated by id. Supports If-None-Match """
+        try:
+            http_args, list_args = parse_list_args(request.args, ClientSchema)
+        except ValueError as err:
+            return {"message": str(err)}, 422
+        dumper = list_args.dumper(ClientSchema)
         try:
-            clients = app_client.session.query(Client).filter_by(**http_args).all()
+            query = app_client.session.query(*dumper.columns(Client, 'id', 'version')) \
+                .select_from(Client).filter_by(**http_args)
+            clients, page_info = paginate(query, Client, list_args)
         except InvalidRequestError as err:
             return {"message": err.args[0]}, 422
         except Exception:
             return {"message": "External Error"}
-        result = clients_schema.dump(clients)
-        return {"message": "Matched clients", "clients": result}
+        etag = make_etag(collection_version(clients, page_info.get('total')))
+        return conditional_response(etag, lambda: {"message": "Matched clients",
+                                                   "clients": dumper.dump(clients), **page_info})
 
     @ns.doc('create_client')
     @ns.expect(client_model, validate=False)
@@ -99,37 +221,35 @@ class ClientView(Resource):
         except ValidationError as err:
             return err.messages, 422
         try:
-            client = app_client.session.query(Client).filter_by(mobile_number=data['mobile_number']).first()
+            client, created = create_client(app_client.session, data)
         except Exception:
+            app_client.session.rollback()
             return {"message": 'External Error'}, 422
+        if created:
+            logger.info(f'CLIENT was CREATED: {client}')
+            result = client_schema.dump(client)
+            return {"message": "Created new client", "client": result}
         else:
-            if client is None:
-                # Create a new client
-                client = Client(**data)
-                app_client.session.add(client)
-                app_client.session.commit()
-                logger.info(f'CLIENT was CREATED: {client}')
-                result = client_schema.dump(client)
-                return {"message": "Created new client", "client": result}
-            else:
-                # return existed client
-                result = client_schema.dump(client)
-                return {"message": "Client already exists", "client": result}
+            # return existed client
+            result = client_schema.dump(client)
+            return {"message": "Client already exists", "client": result}
 
 
 @ns.route('/client/<int:pk>')
 class ClientIdView(Resource):
     @ns.doc('get_client')
     @ns.response(200, model=client_model_response, description='Requested client')
+    @ns.response(304, 'Not Modified, response ETag is in If-None-Match')
     @ns.response(422, 'Error message')
     @ns.response(404, 'Not Found')
     def get(self, pk):
-        """ Get client via id """
-        client = app_client.session.query(Client).filter_by(id=pk).first()
-        if client is None:
+        """ Get client via id. Supports If-None-Match """
+        response = conditional_entity('client', pk, lambda: app_client.session.query(Client).filter_by(id=pk).first(),
+                                      version=attrgetter('version'), dump=client_schema.dump,
+                                      wrap=lambda result: {"message": "Requested client", "client": result})
+        if response is None:
             return {"message": "Not found"}, 404
-        result = client_schema.dump(client)
-        return {"message": "Requested client", "client": result}
+        return response
 
     @ns.doc('update_client')
     @ns.expect(client_model_for_update)
@@ -147,8 +267,13 @@ class ClientIdView(Resource):
         logger.info(f'CLIENT was UPDATED: {client}')
         try:
             app_client.session.commit()
+        except IntegrityError:
+            # UNIQUE ix_clients_mobile_number
+            app_client.session.rollback()
+            return {"message": "Client with this mobile number already exists"}, 422
         except Exception:
             return {"message": 'External Error'}, 422
+        entity_cache.invalidate('client', pk)
         result = client_schema.dump(updated_client)
         return {"message": "Successful update", "client": result}
 
@@ -164,6 +289,7 @@ class ClientIdView(Resource):
         updated_client = dynamic_update(client, dict(was_deleted=True))
         logger.info(f'CLIENT was DELETED: {client}')
         app_client.session.commit()
+        entity_cache.invalidate('client', pk)
         result = client_schema.dump(updated_client)
         return {"message": "Successful delete", "client": result}
 
@@ -171,9 +297,129 @@ class ClientIdView(Resource):
 @ns.route('/client/all')
 class ClientAllView(Resource):
     @ns.doc('get_client_list_include_deleted')
+    @ns.expect(parser_list, validate=False)
     @ns.response(200, model=clients_model_response, description='All clients, include deleted')
+    @ns.response(304, 'Not Modified, response ETag is in If-None-Match')
+    @ns.response(422, 'Error message')
     def get(self):
-        """ Get all clients, include deleted """
-        clients = app_client.session.query(Client).all()
-        result = clients_schema.dump(clients)
-        return {"message": "All clients, include deleted", "clients": result}
+        """ Get all clients, include deleted, paginated by id. Supports If-None-Match """
+        try:
+            _, list_args = parse_list_args(request.args, ClientSchema)
+        except ValueError as err:
+            return {"message": str(err)}, 422
+        dumper = list_args.dumper(ClientSchema)
+        query = app_client.session.query(*dumper.columns(Client, 'id', 'version'))
+        clients, page_info = paginate(query, Client, list_args)
+        etag = make_etag(collection_version(clients, page_info.get('total')))
+        return conditional_response(etag, lambda: {"message": "All clients, include deleted",
+                                                   "clients": dumper.dump(clients), **page_info})
+
+
+@ns.route('/client/bulk')
+class ClientBulkView(Resource):
+    def change(self, values, action):
+        try:
+            bulk_args = parse_bulk_args(request.args, request.get_json(silent=True))
+        except ValueError as err:
+            return {"message": str(err)}, 422
+        try:
+            query = bulk_args.apply(app_client.session.query(Client), Client)
+            affected = bulk_update(query, values, synchronize_session=False, dry_run=bulk_args.dry_run)
+            app_client.session.commit()
+        except InvalidRequestError as err:
+            app_client.session.rollback()
+            return {"message": err.args[0]}, 422
+        except Exception:
+            app_client.session.rollback()
+            return {"message": "External Error"}, 422
+        if affected and not bulk_args.dry_run:
+            entity_cache.invalidate('client')
+            logger.info(f'CLIENTS were BULK {action}: {affected}, filters: {bulk_args.filters}, '
+                        f'ids: {len(bulk_args.ids) if bulk_args.ids is not None else "any"}, values: {values}')
+        return {"message": f"Clients {'to be ' if bulk_args.dry_run else ''}{action.lower()}",
+                "affected": affected, "dry_run": bulk_args.dry_run}
+
+    @ns.doc('bulk_update_clients')
+    @ns.expect(parser_bulk, client_bulk_update_model, validate=False)
+    @ns.response(200, model=client_bulk_response, description='Clients updated')
+    @ns.response(422, 'Error message')
+    @data_provided_validator
+    def put(self):
+        """ Set attributes of all clients matched by filter query args and/or ids with one UPDATE """
+        json_data = request.get_json()
+        try:
+            values = load_bulk_values(json_data.get('values') if isinstance(json_data, dict) else None,
+                                      client_schema, CLIENT_BULK_UPDATABLE)
+        except ValidationError as err:
+            return err.messages, 422
+        return self.change(values, 'UPDATED')
+
+    @ns.doc('bulk_delete_clients')
+    @ns.expect(parser_bulk, client_bulk_delete_model, validate=False)
+    @ns.response(200, model=client_bulk_response, description='Clients deleted')
+    @ns.response(422, 'Error message')
+    def delete(self):
+        """ Change 'was_deleted' status on True for all clients matched by filter query args and/or ids """
+        return self.change({'was_deleted': True}, 'DELETED')
+
+
+@ns.route('/client/import')
+class ClientImportView(Resource):
+    @ns.doc('import_clients')
+    @ns.expect(parser_import, validate=False)
+    @ns.response(200, model=client_import_response, description='Import report')
+    @ns.response(422, 'Error message')
+    def post(self):
+        """ Bulk create clients from JSON array, NDJSON or CSV (with header) body or uploaded file """
+        on_conflict = request.args.get('on_conflict', 'skip')
+        upload = request.files.get('file')
+        if upload is not None:
+            fmt = upload.filename.rsplit('.', 1)[-1].lower()
+            stream = upload.stream
+        else:
+            fmt = CLIENT_IMPORT_FORMATS.get(request.mimetype)
+            stream = request.stream
+        if fmt not in CLIENT_IMPORT_FORMATS.values():
+            return {"message": f"Unsupported format, use one of: {', '.join(CLIENT_IMPORT_FORMATS)}"}, 422
+        try:
+            importer = ClientImport(app_client.session, on_conflict)
+        except ValueError as err:
+            return {"message": str(err)}, 422
+        received, invalid, errors, batch = 0, 0, [], []
+
+        def reject(row_errors):
+            nonlocal invalid, errors
+            invalid += len(row_errors)
+            errors.extend(row_errors)
+            # KEEP ONLY THE FIRST ROWS, BIG BROKEN UPLOADS MUST NOT BLOW UP MEMORY
+            if len(errors) > 2 * CLIENT_IMPORT_MAX_ERRORS:
+                errors = sorted(errors, key=lambda error: error['row'])[:CLIENT_IMPORT_MAX_ERRORS]
+
+        try:
+            for row_no, row, parse_error in import_rows(stream, fmt):
+                received += 1
+                if parse_error is not None:
+                    reject([{'row': row_no, 'errors': parse_error}])
+                    continue
+                batch.append((row_no, row))
+                if len(batch) >= CLIENT_IMPORT_BATCH_SIZE:
+                    valid, batch_errors = load_import_batch(batch)
+                    importer.stage(valid)
+                    reject(batch_errors)
+                    batch = []
+            valid, batch_errors = load_import_batch(batch)
+            importer.stage(valid)
+            reject(batch_errors)
+            counters = importer.merge()
+        except (ValueError, UnicodeDecodeError) as err:
+            app_client.session.rollback()
+            return {"message": f"Malformed upload: {err}"}, 422
+        except Exception:
+            app_client.session.rollback()
+            return {"message": "External Error"}, 422
+        if counters['updated']:
+            entity_cache.invalidate('client')
+        logger.info(f'CLIENTS were IMPORTED: {counters}, invalid rows: {invalid}')
+        errors = sorted(errors, key=lambda error: error['row'])
+        return {"message": "Clients imported", "received": received, **counters, "invalid": invalid,
+                "errors": errors[:CLIENT_IMPORT_MAX_ERRORS]}
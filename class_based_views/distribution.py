@@ -1,23 +1,30 @@
-from flask import request, Blueprint, _app_ctx_stack
+from flask import request, Blueprint
 from flask_restx import Resource, Api, fields
 from sqlalchemy.exc import InvalidRequestError
-from sqlalchemy.orm import scoped_session
 from marshmallow import ValidationError
 from flask_loguru import logger
 # CURRENT PROJECT MODULES
 from db_api import Distribution
-from db_api import SessionLocal
-from extension import dynamic_update
+from db_api import db_session
+from db_api import audience_size, parse_client_filter, ClientFilterError
+from extension import dynamic_update, bulk_update
+from extension import parse_bulk_args, load_bulk_values
 from extension import data_provided_validator
+from extension import parse_list_args, paginate
+from extension import entity_cache
+from extension import make_etag, collection_version, conditional_response, conditional_entity
 from json_validator import DistributionSchema
 from datetime import datetime, timedelta
+from operator import attrgetter
 
 # CREATE MARSHMALLOW SCHEMAS INSTANCES
 distr_schema = DistributionSchema()
-distrs_schema = DistributionSchema(many=True)
+
+# BULK UPDATE
+DISTRIBUTION_BULK_UPDATABLE = ('start_date', 'text', 'client_filter', 'end_date')
 
 app_distribution = Blueprint('app_distribution', __name__)
-app_distribution.session = scoped_session(SessionLocal, scopefunc=_app_ctx_stack)
+app_distribution.session = db_session
 api = Api(app_distribution)
 
 
@@ -37,6 +44,22 @@ parser_distr.add_argument('client_filter', type=str)
 parser_distr.add_argument('end_date', type=datetime)
 parser_distr.add_argument('was_deleted', type=bool)
 
+# LIST PAGINATION PARSER
+parser_list = api.parser()
+parser_list.add_argument('limit', type=int, help='Page size, 1000 by default')
+parser_list.add_argument('after_id', type=int, help='Return rows with id greater than this one (next_after_id of previous page)')
+parser_list.add_argument('fields', type=str, help='Comma separated fields to return, e.g. id,start_date')
+parser_list.add_argument('with_total', type=bool, help='Count all matched rows (slow on big tables)')
+
+# BULK PARSER: MODEL FILTERS AS IN LIST ENDPOINT, IDS AND DRY RUN
+parser_bulk = parser_distr.copy()
+parser_bulk.add_argument('ids', type=str, help='Comma separated distribution ids, or "ids" list in JSON body')
+parser_bulk.add_argument('dry_run', type=bool, help='Only count distributions which would change')
+
+parser_distr_list = parser_distr.copy()
+for arg in parser_list.args:
+    parser_distr_list.add_argument(arg)
+
 
 # DISTRIBUTION MODELS
 distr_model = ns.model('Distribution', {
@@ -44,7 +67,8 @@ distr_model = ns.model('Distribution', {
     'start_date': fields.String(required=True, description='Distribution start date',
                                 example=datetime.now().strftime('%Y-%m-%d %H:%M')),
     'text': fields.String(required=True, description='Distribution text', example=''),
-    'client_filter': fields.String(required=True, description='Distribution mark to specify client group', example=''),
+    'client_filter': fields.String(required=True, example='tag:vip AND operator:917',
+                                   description='Client tag or filter expression over tag, operator, tz, number'),
     'end_date': fields.String(required=True, description='Distribution end date',
                               example=(datetime.now() + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M')),
     'was_deleted': fields.Boolean(readonly=True, description='Shows distribution deleted status', example=False)
@@ -65,6 +89,8 @@ distr_model_for_update = ns.model('Distribution Update', {
 distrs_model_response = ns.model('Distributions Response', {
     'distributions': fields.List(fields.Nested(distr_model), attribute='distributions'),
     'message': fields.String(attribute='message'),
+    'next_after_id': fields.Integer(description='after_id of the next page, null on the last page'),
+    'total': fields.Integer(description='Matched distributions count, only if with_total is set'),
 })
 
 distr_model_response = ns.model('Distribution Response', {
@@ -72,23 +98,58 @@ distr_model_response = ns.model('Distribution Response', {
     'message': fields.String(attribute='message'),
 })
 
+distr_bulk_update_model = ns.model('Distribution Bulk Update', {
+    'ids': fields.List(fields.Integer, description='Distributions to update, instead of or together with filter query args'),
+    'values': fields.Nested(distr_model_for_update, required=True,
+                            description=f'Attributes to set, one of: {", ".join(DISTRIBUTION_BULK_UPDATABLE)}'),
+})
+
+distr_bulk_delete_model = ns.model('Distribution Bulk Delete', {
+    'ids': fields.List(fields.Integer, description='Distributions to delete, instead of or together with filter query args'),
+})
+
+distr_bulk_response = ns.model('Distribution Bulk Response', {
+    'message': fields.String(attribute='message'),
+    'affected': fields.Integer(description='Distributions changed, or which would change for dry_run'),
+    'dry_run': fields.Boolean(),
+})
+
+audience_model_response = ns.model('Audience Response', {
+    'message': fields.String(attribute='message'),
+    'client_filter': fields.String(description='Checked client filter'),
+    'audience_size': fields.Integer(description='Clients matched by client filter'),
+})
+
+parser_audience = api.parser()
+parser_audience.add_argument('client_filter', type=str, required=True,
+                             help='e.g. tag:vip AND operator:917,926 AND tz:Europe/*, a plain word is a tag')
+
 
 @ns.route('/distribution/')
 class DistrView(Resource):
-    @ns.expect(parser_distr, validate=False)
+    @ns.expect(parser_distr_list, validate=False)
     @ns.response(200, model=distrs_model_response, description='Matched distributions')
+    @ns.response(304, 'Not Modified, response ETag is in If-None-Match')
     @ns.response(422, 'Error message')
     def get(self):
-        """ Get distributions filtered by query params """
-        http_args = request.args
+        """ Get distributions filtered by query params, paginated by id. Supports If-None-Match """
         try:
-            distrs = app_distribution.session.query(Distribution).filter_by(**http_args, was_deleted=False).all()
+            http_args, list_args = parse_list_args(request.args, DistributionSchema)
+        except ValueError as err:
+            return {"message": str(err)}, 422
+        dumper = list_args.dumper(DistributionSchema)
+        try:
+            query = app_distribution.session.query(*dumper.columns(Distribution, 'id', 'version')) \
+                .select_from(Distribution).filter_by(**http_args, was_deleted=False)
+            distrs, page_info = paginate(query, Distribution, list_args)
         except InvalidRequestError as err:
             return {"message": err.args[0]}, 422
         except Exception:
             return {"message": "External Error"}
-        result = distrs_schema.dump(distrs)
-        return {"message": "Matched distributions", "distributions": result}
+        etag = make_etag(collection_version(distrs, page_info.get('total')))
+        return conditional_response(etag, lambda: {"message": "Matched distributions",
+                                                   "distributions": dumper.dump(distrs),
+                                                   **page_info})
 
     @ns.expect(distr_model, validate=False)
     @ns.response(200, model=distr_model_response, description='Created new distribution')
@@ -114,19 +175,98 @@ class DistrView(Resource):
         return {"message": "Created new distribution", "distribution": result}
 
 
+def invalidate_distribution(pk):
+    # DETAILED STATISTIC EMBEDS DISTRIBUTION ATTRIBUTES
+    entity_cache.invalidate('distribution', pk)
+    entity_cache.invalidate('statistic', pk)
+
+
+@ns.route('/distribution/audience')
+class DistributionAudienceView(Resource):
+    @ns.doc('get_distribution_audience')
+    @ns.expect(parser_audience, validate=False)
+    @ns.response(200, model=audience_model_response, description='Audience size')
+    @ns.response(422, 'Error message')
+    def get(self):
+        """ Check client filter and count clients it matches, before creating a distribution """
+        client_filter = request.args.get('client_filter')
+        try:
+            size = audience_size(app_distribution.session, client_filter)
+        except ClientFilterError as err:
+            return {"client_filter": [f'invalid client_filter: {err}']}, 422
+        return {"message": "Audience size", "client_filter": client_filter, "audience_size": size}
+
+
+@ns.route('/distribution/bulk')
+class DistributionBulkView(Resource):
+    def change(self, values, action):
+        try:
+            bulk_args = parse_bulk_args(request.args, request.get_json(silent=True))
+        except ValueError as err:
+            return {"message": str(err)}, 422
+        try:
+            query = bulk_args.apply(app_distribution.session.query(Distribution), Distribution)
+            affected = bulk_update(query, values, synchronize_session=False, dry_run=bulk_args.dry_run)
+            app_distribution.session.commit()
+        except InvalidRequestError as err:
+            app_distribution.session.rollback()
+            return {"message": err.args[0]}, 422
+        except Exception:
+            app_distribution.session.rollback()
+            return {"message": "External Error"}, 422
+        if affected and not bulk_args.dry_run:
+            entity_cache.invalidate('distribution')
+            entity_cache.invalidate('statistic')
+            logger.info(f'DISTRIBUTIONS were BULK {action}: {affected}, filters: {bulk_args.filters}, '
+                        f'ids: {len(bulk_args.ids) if bulk_args.ids is not None else "any"}, values: {values}')
+        return {"message": f"Distributions {'to be ' if bulk_args.dry_run else ''}{action.lower()}",
+                "affected": affected, "dry_run": bulk_args.dry_run}
+
+    @ns.doc('bulk_update_distributions')
+    @ns.expect(parser_bulk, distr_bulk_update_model, validate=False)
+    @ns.response(200, model=distr_bulk_response, description='Distributions updated')
+    @ns.response(422, 'Error message')
+    @data_provided_validator
+    def put(self):
+        """ Set attributes of all distributions matched by filter query args and/or ids with one UPDATE """
+        json_data = request.get_json()
+        try:
+            values = load_bulk_values(json_data.get('values') if isinstance(json_data, dict) else None,
+                                      distr_schema, DISTRIBUTION_BULK_UPDATABLE)
+        except ValidationError as err:
+            return err.messages, 422
+        if 'client_filter' in values:
+            try:
+                parse_client_filter(values['client_filter'])
+            except ClientFilterError as err:
+                return {"client_filter": [f'invalid client_filter: {err}']}, 422
+        return self.change(values, 'UPDATED')
+
+    @ns.doc('bulk_delete_distributions')
+    @ns.expect(parser_bulk, distr_bulk_delete_model, validate=False)
+    @ns.response(200, model=distr_bulk_response, description='Distributions deleted')
+    @ns.response(422, 'Error message')
+    def delete(self):
+        """ Change 'was_deleted' status on True for all distributions matched by filter query args and/or ids """
+        return self.change({'was_deleted': True}, 'DELETED')
+
+
 @ns.route('/distribution/<int:pk>')
 class DistributionIdView(Resource):
     @ns.doc('get_distribution')
     @ns.response(200, model=distr_model_response, description='Requested distribution')
+    @ns.response(304, 'Not Modified, response ETag is in If-None-Match')
     @ns.response(422, 'Error message')
     @ns.response(404, 'Not Found')
     def get(self, pk):
-        """ Get distribution via id """
-        distr = app_distribution.session.query(Distribution).filter_by(id=pk).first()
-        if distr is None:
+        """ Get distribution via id. Supports If-None-Match """
+        response = conditional_entity('distribution', pk,
+                                      lambda: app_distribution.session.query(Distribution).filter_by(id=pk).first(),
+                                      version=attrgetter('version'), dump=distr_schema.dump,
+                                      wrap=lambda result: {"message": "Requested distribution", "distribution": result})
+        if response is None:
             return {"message": "Not found"}, 404
-        result = distr_schema.dump(distr)
-        return {"message": "Requested distribution", "distribution": result}
+        return response
 
     @ns.doc('update_distribution')
     @ns.expect(distr_model_for_update)
@@ -140,11 +280,17 @@ class DistributionIdView(Resource):
         distr = app_distribution.session.query(Distribution).filter_by(id=pk).first()
         if distr is None:
             return {"message": "Not found"}, 404
+        if 'client_filter' in json_data:
+            try:
+                parse_client_filter(json_data['client_filter'])
+            except ClientFilterError as err:
+                return {"client_filter": [f'invalid client_filter: {err}']}, 422
         updated_distr = dynamic_update(distr, json_data)
         try:
             app_distribution.session.commit()
         except Exception:
             return {"message": 'External Error'}, 422
+        invalidate_distribution(pk)
         logger.info(f'DISTRIBUTION was UPDATED: {distr}')
         result = distr_schema.dump(updated_distr)
         return {"message": "Successful update", "distribution": result}
@@ -160,6 +306,7 @@ class DistributionIdView(Resource):
             return {"message": "Not Found"}
         updated_distr = dynamic_update(distr, dict(was_deleted=True))
         app_distribution.session.commit()
+        invalidate_distribution(pk)
         logger.info(f'DISTRIBUTION was DELETED: {distr}')
         result = distr_schema.dump(updated_distr)
         return {"message": "Successful delete", "distribution": result}
@@ -168,9 +315,20 @@ class DistributionIdView(Resource):
 @ns.route('/distribution/all')
 class DistributionAllView(Resource):
     @ns.doc('get_distribution_list_include_deleted')
+    @ns.expect(parser_list, validate=False)
     @ns.response(200, model=distrs_model_response, description='All distributions, include deleted')
+    @ns.response(304, 'Not Modified, response ETag is in If-None-Match')
+    @ns.response(422, 'Error message')
     def get(self):
-        """ Get all distributions, include deleted """
-        distrs = app_distribution.session.query(Distribution).all()
-        result = distrs_schema.dump(distrs)
-        return {"message": "All distributions, include deleted", "distributions": result}
+        """ Get all distributions, include deleted, paginated by id. Supports If-None-Match """
+        try:
+            _, list_args = parse_list_args(request.args, DistributionSchema)
+        except ValueError as err:
+            return {"message": str(err)}, 422
+        dumper = list_args.dumper(DistributionSchema)
+        query = app_distribution.session.query(*dumper.columns(Distribution, 'id', 'version'))
+        distrs, page_info = paginate(query, Distribution, list_args)
+        etag = make_etag(collection_version(distrs, page_info.get('total')))
+        return conditional_response(etag, lambda: {"message": "All distributions, include deleted",
+                                                   "distributions": dumper.dump(distrs),
+                                                   **page_info})
@@ -1,9 +1,8 @@
-from flask import Blueprint, _app_ctx_stack
+from flask import Blueprint
 from flask_restx import Resource, Api, fields
-from sqlalchemy.orm import scoped_session
 # CURRENT PROJECT MODULES
 from db_api import Message
-from db_api import SessionLocal
+from db_api import db_session
 from json_validator import MessageSchema
 from datetime import datetime
 
@@ -11,7 +10,7 @@ from datetime import datetime
 messages_schema = MessageSchema(many=True)
 
 app_message = Blueprint('app_message', __name__)
-app_message.session = scoped_session(SessionLocal, scopefunc=_app_ctx_stack)
+app_message.session = db_session
 api = Api(app_message)
 
 ns = api.namespace('Message Endpoint', description='Message related endpoints')
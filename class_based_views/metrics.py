@@ -0,0 +1,95 @@
+from flask import Blueprint
+from flask_restx import Resource, Api, fields
+# CURRENT PROJECT MODULES
+from db_api import engine
+from db_api.pool import pool_metrics
+from extension import entity_cache
+from mailing import mail_outbox
+
+app_metrics = Blueprint('app_metrics', __name__)
+api = Api(app_metrics)
+
+ns = api.namespace('Metrics', description='Service metrics')
+
+
+cache_metrics_model = ns.model('Cache Metrics', {
+    'backend': fields.String(description='LRUCache, RedisCache or NullCache'),
+    'entries': fields.Integer(description='Cached entity ids'),
+    'hits': fields.Integer(),
+    'misses': fields.Integer(),
+    'hit_ratio': fields.Float(),
+    'evictions': fields.Integer(description='Entries dropped because cache was full'),
+    'expirations': fields.Integer(description='Entries dropped because TTL passed'),
+    'invalidations': fields.Integer(description='Entries dropped because entity changed'),
+})
+
+cache_metrics_response = ns.model('Cache Metrics Response', {
+    'message': fields.String(attribute='message'),
+    'cache': fields.Nested(cache_metrics_model, attribute='cache'),
+})
+
+
+@ns.route('/metrics/cache')
+class CacheMetricsView(Resource):
+    @ns.doc('get_cache_metrics')
+    @ns.response(200, model=cache_metrics_response, description='Read-through cache counters of this process')
+    def get(self):
+        """ Cache hit/miss/eviction counters since process start """
+        return {"message": "Cache metrics", "cache": entity_cache.metrics()}
+
+
+mail_metrics_model = ns.model('Mail Outbox Metrics', {
+    'pending': fields.Integer(description='Jobs waiting in the queue'),
+    'queued': fields.Integer(description='Jobs submitted since process start'),
+    'sent': fields.Integer(),
+    'retries': fields.Integer(description='Failed attempts which were retried'),
+    'failed': fields.Integer(description='Jobs given up on'),
+    'last_error': fields.String(description='Job name and error of the last failed attempt'),
+})
+
+mail_metrics_response = ns.model('Mail Outbox Metrics Response', {
+    'message': fields.String(attribute='message'),
+    'mail': fields.Nested(mail_metrics_model, attribute='mail'),
+})
+
+
+@ns.route('/metrics/mail')
+class MailMetricsView(Resource):
+    @ns.doc('get_mail_metrics')
+    @ns.response(200, model=mail_metrics_response, description='Mail outbox counters of this process')
+    def get(self):
+        """ Mail outbox queue and delivery counters since process start """
+        return {"message": "Mail outbox metrics", "mail": mail_outbox.metrics()}
+
+
+pool_metrics_model = ns.model('Pool Metrics', {
+    'pool': fields.String(description='TimedQueuePool or TimedNullPool (DB_POOL_MODE)'),
+    'checkouts': fields.Integer(description='Connections handed out to sessions'),
+    'waits': fields.Integer(description='Checkouts which found no idle connection'),
+    'timeouts': fields.Integer(description='Checkouts given up after DB_POOL_TIMEOUT_SECONDS'),
+    'wait_ms_avg': fields.Float(),
+    'wait_ms_p50': fields.Float(description='Of the last 1000 checkouts'),
+    'wait_ms_p99': fields.Float(description='Of the last 1000 checkouts'),
+    'wait_ms_max': fields.Float(),
+    'peak_checked_out': fields.Integer(description='Most connections in use at once'),
+    'size': fields.Integer(description='DB_POOL_SIZE'),
+    'max_overflow': fields.Integer(description='DB_MAX_OVERFLOW'),
+    'checked_out': fields.Integer(description='Connections in use now'),
+    'idle': fields.Integer(description='Open connections waiting in the pool'),
+    'saturation': fields.Float(description='checked_out / (size + max_overflow)'),
+    'peak_saturation': fields.Float(description='peak_checked_out / (size + max_overflow)'),
+})
+
+pool_metrics_response = ns.model('Pool Metrics Response', {
+    'message': fields.String(attribute='message'),
+    'pool': fields.Nested(pool_metrics_model, attribute='pool'),
+})
+
+
+@ns.route('/metrics/pool')
+class PoolMetricsView(Resource):
+    @ns.doc('get_pool_metrics')
+    @ns.response(200, model=pool_metrics_response, description='Database connection pool counters of this process')
+    def get(self):
+        """ Connection checkout wait times and pool saturation since process start """
+        return {"message": "Pool metrics", "pool": pool_metrics(engine)}
@@ -1,22 +1,41 @@
-from flask import request, Blueprint, _app_ctx_stack
+from flask import request, Blueprint, Response, stream_with_context
 from flask_restx import Resource, Api, fields
 from sqlalchemy.exc import InvalidRequestError
-from sqlalchemy.orm import scoped_session
 # CURRENT PROJECT MODULES
 from db_api import Distribution, Message
-from db_api import SessionLocal
+from db_api import db_session
+from db_api import distribution_statistic, SEND_STATUS_CASES
+from db_api import message_timeseries, bucket_floor, TIMESERIES_BUCKETS, TIMESERIES_STATUSES
+from extension import make_etag, collection_version, conditional_response, conditional_entity
 from json_validator import DistributionSchema, MessageSchema
+from json_validator import fast_dump
 from datetime import datetime, timedelta
+from operator import itemgetter
+import json
+import csv
+import io
 
 # CREATE MARSHMALLOW SCHEMAS INSTANCES
 distribution_schema = DistributionSchema()
 distributions_schema = DistributionSchema(many=True)
 distribution_statistic_schema = DistributionSchema()
 distributions_statistic_schema = DistributionSchema(many=True)
-messages_schema = MessageSchema(many=True)
+message_schema = MessageSchema()
+# READ PATHS QUERY MESSAGE COLUMNS AND DUMP ROWS WITHOUT MARSHMALLOW, SEE json_validator.fast
+message_dump = fast_dump(message_schema)
+
+# DETAILED STATISTIC PAGINATION
+DETAILED_STATISTIC_PAGE_SIZE = 1000
+DETAILED_STATISTIC_MAX_PAGE_SIZE = 10000
+EXPORT_FETCH_SIZE = 1000
+EXPORT_FIELDS = ['id', 'send_date', 'send_status', 'distribution_id', 'client_id']
+
+# TIMESERIES WINDOW: POINTS RETURNED WITHOUT start ARG AND THE LIMIT OF ONE RESPONSE
+TIMESERIES_DEFAULT_POINTS = {'minute': 60, 'hour': 24, 'day': 30}
+TIMESERIES_MAX_POINTS = 1440
 
 app_statistic = Blueprint('app_statistic', __name__)
-app_statistic.session = scoped_session(SessionLocal, scopefunc=_app_ctx_stack)
+app_statistic.session = db_session
 api = Api(app_statistic)
 
 ns = api.namespace('Statistic', description='Statistic related endpoints')
@@ -36,6 +55,19 @@ parser_statistic.add_argument('client_filter', type=str)
 parser_statistic.add_argument('end_date', type=datetime)
 parser_statistic.add_argument('was_deleted', type=bool)
 
+parser_detailed_statistic = api.parser()
+parser_detailed_statistic.add_argument('limit', type=int, help=f'Messages per page, up to {DETAILED_STATISTIC_MAX_PAGE_SIZE}')
+parser_detailed_statistic.add_argument('after_id', type=int, help='Return messages with id greater than this one')
+parser_detailed_statistic.add_argument('format', type=str, choices=['json', 'ndjson', 'csv'],
+                                       help='ndjson and csv stream all messages after after_id, ignoring limit')
+
+parser_timeseries = api.parser()
+parser_timeseries.add_argument('bucket', type=str, choices=list(TIMESERIES_BUCKETS), help='Point width, hour by default')
+parser_timeseries.add_argument('distribution_id', type=int, help='Series of one distribution, all of them by default')
+parser_timeseries.add_argument('start', type=str, help='First bucket date like "2026-10-18 08:00", '
+                                                       'default is end minus 60 minutes, 24 hours or 30 days')
+parser_timeseries.add_argument('end', type=str, help='Date the series ends before, default is the end of current bucket')
+
 # MESSAGE MODEL
 statistic_message_model = ns.model('Statistic Message Model', {
     'id': fields.Integer(readonly=True, description='Message unique identifier'),
@@ -56,6 +88,7 @@ detailed_statistic_model = ns.model('Detailed Statistic', {
                               example=(datetime.now() + timedelta(hours=2)).strftime('%Y-%m-%d %H:%M')),
     'sent_msgs': fields.List(fields.Nested(statistic_message_model), discription='Sent messages within distribution'),
     'not_sent_msgs': fields.List(fields.Nested(statistic_message_model), discription='Not sent messages within distribution'),
+    'next_after_id': fields.Integer(description='after_id of the next page, null on the last page'),
     'was_deleted': fields.Boolean(readonly=True, description='Shows distribution deleted status', example=False)
 
 })
@@ -65,6 +98,12 @@ detailed_statistic_model_response = ns.model('Detailed Statistic Response', {
     'message': fields.String(attribute='message'),
 })
 
+status_counts_model = ns.model('Message Status Counts', {
+    'SENT': fields.Integer(description='Sent messages count'),
+    'NOT_SENT': fields.Integer(description='Not yet sent messages count'),
+    'FAIL': fields.Integer(description='Failed messages count'),
+})
+
 general_statistic_model = ns.model('General Statistic', {
     'id': fields.Integer(readonly=True, description='Distribution unique identifier'),
     'start_date': fields.String(description='Distribution start date',
@@ -75,6 +114,7 @@ general_statistic_model = ns.model('General Statistic', {
                               example=(datetime.now() + timedelta(hours=2)).strftime('%Y-%m-%d %H:%M')),
     'sent_msgs_count': fields.Integer(discription='Sent messages count within distribution'),
     'not_sent_msgs_count': fields.Integer(discription='Not sent messages count within distribution'),
+    'status_counts': fields.Nested(status_counts_model, description='Messages count by every send status'),
     'was_deleted': fields.Boolean(readonly=True, description='Shows distribution deleted status', example=False)
 })
 
@@ -84,58 +124,213 @@ general_statistic_model_response = ns.model('General Statistic Response', {
 })
 
 
+timeseries_point_model = ns.model('Timeseries Point', {
+    'bucket_start': fields.String(description='Bucket start date', example='2026-10-18 08:00'),
+    'SENT': fields.Integer(description='Successful sending attempts within bucket'),
+    'FAIL': fields.Integer(description='Failed sending attempts within bucket, retries count again'),
+    'fail_rate': fields.Float(description='FAIL / (SENT + FAIL), null for an empty bucket'),
+})
+
+timeseries_model_response = ns.model('Timeseries Statistic Response', {
+    'bucket': fields.String(description='Point width: minute, hour or day'),
+    'distribution_id': fields.Integer(description='Distribution of the series, null for all distributions'),
+    'start': fields.String(description='First bucket start date'),
+    'end': fields.String(description='Date the last bucket ends at'),
+    'points': fields.List(fields.Nested(timeseries_point_model), description='Every bucket, empty ones included'),
+    'message': fields.String(attribute='message'),
+})
+
+
+def general_statistic_to_dict(distr, counts):
+    distr_dict = distribution_schema.dump(distr)
+    distr_dict.update(sent_msgs_count=counts['SENT'], not_sent_msgs_count=counts['total'] - counts['SENT'],
+                      status_counts={status: counts[status] for status in SEND_STATUS_CASES})
+    return distr_dict
+
+
+def statistic_version(statistic):
+    """ Distribution rows and their counts change independently, so both versions make the ETag """
+    return [max((max(distr.version, counts['version']) for distr, counts in statistic), default=0), len(statistic),
+            statistic[-1][0].id if statistic else None]
+
+
 @ns.route('/statistic/')
 class StatisticView(Resource):
     @ns.expect(parser_statistic, validate=False)
     @ns.response(200, model=general_statistic_model_response, description='General distribution statistic')
+    @ns.response(304, 'Not Modified, response ETag is in If-None-Match')
     @ns.response(422, 'Error Message')
     def get(self):
-        """ Get filtered distributions general statistic"""
+        """ Get filtered distributions general statistic. Supports If-None-Match """
         http_args = request.args
         try:
-            distrs = app_statistic.session.query(Distribution).filter_by(**http_args).all()
+            statistic = distribution_statistic(app_statistic.session, **http_args)
         except InvalidRequestError as err:
             return {"message": err.args[0]}
         except Exception:
             return {'message': 'External Error'}
-        result = []
-        for distr in distrs:
-            sent_msgs_count = distr.message.filter(Message.send_status == 'SENT').count()
-            not_sent_msgs_count = distr.message.filter(Message.send_status != 'SENT').count()
-            distr_dict = distribution_schema.dump(distr)
-            distr_dict.update(sent_msgs_count=sent_msgs_count, not_sent_msgs_count=not_sent_msgs_count)
-            result.append(distr_dict)
-        return {"message": "Matched distributions statistic", "distributions": result}
+        return conditional_response(make_etag(statistic_version(statistic)), lambda: {
+            "message": "Matched distributions statistic",
+            "distributions": [general_statistic_to_dict(distr, counts) for distr, counts in statistic]})
 
 
 @ns.route('/statistic/all')
 class StatisticAllView(Resource):
     @ns.response(200, model=general_statistic_model_response, description='General distribution statistic')
+    @ns.response(304, 'Not Modified, response ETag is in If-None-Match')
+    @ns.response(422, 'Error Message')
+    def get(self):
+        """ Get all distributions general statistic. Supports If-None-Match """
+        statistic = distribution_statistic(app_statistic.session)
+        return conditional_response(make_etag(statistic_version(statistic)), lambda: {
+            "message": "All distributions statistic, include deleted",
+            "distributions": [general_statistic_to_dict(distr, counts) for distr, counts in statistic]})
+
+
+def parse_timeseries_window(bucket):
+    """ Bucket aligned (start, end) from request args. Raises ValueError with a client facing message """
+    step = TIMESERIES_BUCKETS[bucket]
+    try:
+        start, end = (datetime.fromisoformat(request.args[arg]) if request.args.get(arg) else None
+                      for arg in ('start', 'end'))
+    except ValueError:
+        raise ValueError('start and end must be dates like "2026-10-18 08:00"')
+    if end is None:
+        end = bucket_floor(datetime.now(), bucket) + step
+    elif bucket_floor(end, bucket) != end:
+        end = bucket_floor(end, bucket) + step
+    start = end - TIMESERIES_DEFAULT_POINTS[bucket] * step if start is None else bucket_floor(start, bucket)
+    if not 0 < (end - start) / step <= TIMESERIES_MAX_POINTS:
+        raise ValueError(f'start must be before end, up to {TIMESERIES_MAX_POINTS} {bucket} buckets at once')
+    return start, end
+
+
+def timeseries_points(rows, bucket, start, end):
+    """ Dense series: rows of non empty buckets and zeros for the others """
+    counts = {row.bucket_start: row for row in rows}
+    points = []
+    bucket_start = start
+    while bucket_start < end:
+        row = counts.get(bucket_start)
+        point = {status: getattr(row, status) if row else 0 for status in TIMESERIES_STATUSES}
+        attempted = point['SENT'] + point['FAIL']
+        points.append({"bucket_start": bucket_start.strftime(Distribution.datetime_format), **point,
+                       "fail_rate": point['FAIL'] / attempted if attempted else None})
+        bucket_start += TIMESERIES_BUCKETS[bucket]
+    return points
+
+
+@ns.route('/statistic/timeseries')
+class StatisticTimeseriesView(Resource):
+    @ns.expect(parser_timeseries, validate=False)
+    @ns.response(200, model=timeseries_model_response, description='SENT and FAIL sending attempts per bucket')
+    @ns.response(304, 'Not Modified, response ETag is in If-None-Match')
     @ns.response(422, 'Error Message')
+    @ns.response(404, 'Not Found')
     def get(self):
-        """ Get all distributions general statistic"""
-        distrs = app_statistic.session.query(Distribution).all()
-        result = []
-        for distr in distrs:
-            sent_msgs_count = distr.message.filter(Message.send_status == 'SENT').count()
-            not_sent_msgs_count = distr.message.filter(Message.send_status != 'SENT').count()
-            distr_dict = distribution_schema.dump(distr)
-            distr_dict.update(sent_msgs_count=sent_msgs_count, not_sent_msgs_count=not_sent_msgs_count)
-            result.append(distr_dict)
-        return {"message": "All distributions statistic, include deleted", "distributions": result}
+        """ Get SENT and FAIL sending attempts per minute, hour or day of one or all distributions. Supports If-None-Match """
+        bucket = request.args.get('bucket', 'hour')
+        if bucket not in TIMESERIES_BUCKETS:
+            return {"message": f"bucket must be one of {', '.join(TIMESERIES_BUCKETS)}"}, 422
+        try:
+            distribution_id = int(request.args['distribution_id']) if request.args.get('distribution_id') else None
+        except ValueError:
+            return {"message": "distribution_id must be integer"}, 422
+        try:
+            start, end = parse_timeseries_window(bucket)
+        except ValueError as err:
+            return {"message": err.args[0]}, 422
+        if distribution_id is not None and \
+                app_statistic.session.query(Distribution.id).filter_by(id=distribution_id).first() is None:
+            return {"message": "Not found"}, 404
+        rows = message_timeseries(app_statistic.session, bucket, start, end, distribution_id)
+        # DEFAULT WINDOW FOLLOWS THE CLOCK, SO IT IS A PART OF THE VERSION
+        version = [max((row.version for row in rows), default=0), start, end]
+        return conditional_response(make_etag(version), lambda: {
+            "message": f"Sending attempts per {bucket}",
+            "bucket": bucket, "distribution_id": distribution_id,
+            "start": start.strftime(Distribution.datetime_format), "end": end.strftime(Distribution.datetime_format),
+            "points": timeseries_points(rows, bucket, start, end)})
+
+
+def stream_messages(query, fmt):
+    """ Write messages as they are fetched by server side cursor, so memory doesn't grow with distribution size """
+    if fmt == 'ndjson':
+        for msg in query.yield_per(EXPORT_FETCH_SIZE):
+            yield json.dumps(message_dump.dump_one(msg)) + '\n'
+    else:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        export_row = itemgetter(*[message_dump.keys.index(field) for field in EXPORT_FIELDS])
+        for msg in query.yield_per(EXPORT_FETCH_SIZE):
+            writer.writerow(export_row(msg))
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+
+def messages_page_query(pk, after_id):
+    return app_statistic.session.query(*message_dump.columns(Message, 'version')) \
+        .filter(Message.distribution_id == pk, Message.id > after_id) \
+        .order_by(Message.id)
+
+
+def load_detailed_statistic(pk, limit, after_id):
+    """ Distribution with one page of its messages or None """
+    distr = app_statistic.session.query(Distribution).filter_by(id=pk).first()
+    if distr is None:
+        return None
+    return distr, messages_page_query(pk, after_id).limit(limit).all()
+
+
+def detailed_statistic_version(loaded):
+    distr, msgs = loaded
+    return [distr.version, *collection_version(msgs)]
+
+
+def dump_detailed_statistic(loaded, limit):
+    """ The cached part of GET /statistic/<pk> """
+    distr, msgs = loaded
+    sent_msgs = [msg for msg in msgs if msg.send_status == 'SENT']
+    not_sent_msgs = [msg for msg in msgs if msg.send_status != 'SENT']
+    result = distribution_schema.dump(distr)
+    result.update(sent_msgs=message_dump.dump(sent_msgs), not_sent_msgs=message_dump.dump(not_sent_msgs),
+                  next_after_id=msgs[-1].id if len(msgs) == limit else None)
+    return result
 
 
 @ns.route('/statistic/<int:pk>')
 class StatisticIdView(Resource):
+    @ns.expect(parser_detailed_statistic, validate=False)
     @ns.response(200, model=detailed_statistic_model_response, description='Detailed distribution statistic')
+    @ns.response(304, 'Not Modified, response ETag is in If-None-Match')
     @ns.response(422, 'Error Message')
+    @ns.response(404, 'Not Found')
     def get(self, pk):
-        """ Get detailed statistic via distribution id"""
-        distr = app_statistic.session.query(Distribution).filter_by(id=pk).first()
-        sent_msgs = distr.message.filter(Message.send_status == 'SENT').all()
-        sent_msgs_to_dict = messages_schema.dump(sent_msgs)
-        not_sent_msgs = distr.message.filter(Message.send_status != 'SENT').all()
-        not_sent_msgs_to_dict = messages_schema.dump(not_sent_msgs)
-        result = distribution_schema.dump(distr)
-        result.update(sent_msgs=sent_msgs_to_dict, not_sent_msgs=not_sent_msgs_to_dict)
-        return {"message": "Distributions statistic", "distribution": result}
+        """ Get detailed statistic via distribution id, paginated by message id. JSON format supports If-None-Match """
+        limit = request.args.get('limit', DETAILED_STATISTIC_PAGE_SIZE, type=int)
+        after_id = request.args.get('after_id', 0, type=int)
+        fmt = request.args.get('format', 'json')
+        if not 0 < limit <= DETAILED_STATISTIC_MAX_PAGE_SIZE:
+            return {"message": f"limit must be from 1 to {DETAILED_STATISTIC_MAX_PAGE_SIZE}"}, 422
+        if fmt not in ('json', 'ndjson', 'csv'):
+            return {"message": "format must be one of json, ndjson, csv"}, 422
+        if fmt != 'json':
+            distr = app_statistic.session.query(Distribution).filter_by(id=pk).first()
+            if distr is None:
+                return {"message": "Not found"}, 404
+            mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+            headers = {'Content-Disposition': f'attachment; filename=distribution_{pk}_messages.{fmt}'}
+            query = messages_page_query(pk, after_id)
+            return Response(stream_with_context(stream_messages(query, fmt)), mimetype=mimetype, headers=headers)
+        response = conditional_entity('statistic', pk, lambda: load_detailed_statistic(pk, limit, after_id),
+                                      version=detailed_statistic_version,
+                                      dump=lambda loaded: dump_detailed_statistic(loaded, limit),
+                                      wrap=lambda result: {"message": "Distributions statistic", "distribution": result},
+                                      variant=f'{limit}:{after_id}')
+        if response is None:
+            return {"message": "Not found"}, 404
+        return response
@@ -1,2 +1,6 @@
 from db_api.models import *
-from db_api.database import *
\ No newline at end of file
+from db_api.database import *
+from db_api.statistic import *
+from db_api.client_import import *
+from db_api.client_filter import *
+from db_api.leader import *
@@ -0,0 +1,219 @@
+"""
+Distribution client_filter expressions.
+
+    vip                                        plain tag, no "key:value" terms at all (legacy filters)
+    tag:vip AND operator:917 AND tz:Europe/*   key:value terms joined with AND / OR / NOT and parentheses
+    tag:vip operator:917,926                   adjacent terms are ANDed, comma means any of the values
+    tag:"black friday" OR NOT tz:Asia/*        quotes for values with spaces, * matches any characters
+
+Keys: tag, operator (mobile operator code), tz (timezone), number (mobile number).
+A bare word inside an expression is a tag. A filter without any "key:" term of a known key is a legacy tag,
+even with ":" inside (promo:2022), in an expression such tags are quoted: tag:"promo:2022".
+Clients without timezone are in server local time, as for the sender.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from sqlalchemy import and_, or_, func, true
+from threading import Lock
+from typing import Dict, Tuple, Union
+import tzlocal
+import re
+import os
+# CURRENT PROJECT MODULES
+from db_api.models import Client
+
+
+AUDIENCE_SIZE_TTL_SECONDS = int(os.getenv('AUDIENCE_SIZE_TTL_SECONDS', 300))
+AUDIENCE_SIZE_CACHE_LIMIT = 1024
+# CLIENTS WITHOUT TIMEZONE ARE SENT IN SERVER LOCAL TIME
+LOCAL_TIMEZONE = tzlocal.get_localzone_name()
+
+CLIENT_FILTER_FIELDS = {
+    'tag': Client.tag,
+    'operator': Client.mobile_operator_code,
+    'tz': Client.timezone,
+    'number': Client.mobile_number,
+}
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<paren>[()])
+      | (?P<key>\w+):(?:"(?P<quoted>[^"]*)"|(?P<value>[^\s()"]+))
+      | "(?P<quoted_word>[^"]*)"
+      | (?P<word>[^\s()":]+)
+    )''', re.VERBOSE)
+_KEYWORDS = {'AND', 'OR', 'NOT'}
+# A KNOWN KEY AT THE START OF A TERM MAKES A FILTER AN EXPRESSION
+_EXPRESSION_KEY = re.compile(rf'(?:^|[\s(])(?:{"|".join(CLIENT_FILTER_FIELDS)}):', re.IGNORECASE)
+
+
+class ClientFilterError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Term:
+    key: str
+    values: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class BoolOp:
+    op: str
+    operands: Tuple['Node', ...]
+
+
+Node = Union[Term, BoolOp]
+
+
+def _tokenize(expression: str):
+    tokens, position = [], 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None:
+            raise ClientFilterError(f'Unexpected character at position {position}: {expression[position:]!r}')
+        position = match.end()
+        if match.group('paren'):
+            tokens.append(match.group('paren'))
+        elif match.group('key'):
+            key = match.group('key').lower()
+            if key not in CLIENT_FILTER_FIELDS:
+                raise ClientFilterError(f'Unknown key {key!r}, use one of: {", ".join(CLIENT_FILTER_FIELDS)}. '
+                                        f'Quote tags with ":" inside: tag:"{match.group(0).strip()}"')
+            value = match.group('quoted') if match.group('quoted') is not None else match.group('value')
+            tokens.append(Term(key, tuple(value.split(',')) if match.group('value') else (value,)))
+        elif match.group('quoted_word') is not None:
+            tokens.append(Term('tag', (match.group('quoted_word'),)))
+        elif match.group('word').upper() in _KEYWORDS:
+            tokens.append(match.group('word').upper())
+        else:
+            tokens.append(Term('tag', (match.group('word'),)))
+    return tokens
+
+
+class _Parser:
+    """ expr := and_expr (OR and_expr)* ; and_expr := unary (AND? unary)* ; unary := NOT unary | (expr) | term """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self) -> Node:
+        node = self.expr()
+        if self.peek() is not None:
+            raise ClientFilterError(f'Unexpected {self.peek()!r}')
+        return node
+
+    def expr(self) -> Node:
+        operands = [self.and_expr()]
+        while self.peek() == 'OR':
+            self.take()
+            operands.append(self.and_expr())
+        return operands[0] if len(operands) == 1 else BoolOp('OR', tuple(operands))
+
+    def and_expr(self) -> Node:
+        operands = [self.unary()]
+        while self.peek() not in (None, 'OR', ')'):
+            if self.peek() == 'AND':
+                self.take()
+            operands.append(self.unary())
+        return operands[0] if len(operands) == 1 else BoolOp('AND', tuple(operands))
+
+    def unary(self) -> Node:
+        token = self.take()
+        if token == 'NOT':
+            return BoolOp('NOT', (self.unary(),))
+        if token == '(':
+            node = self.expr()
+            if self.take() != ')':
+                raise ClientFilterError('Missing closing parenthesis')
+            return node
+        if isinstance(token, Term):
+            return token
+        raise ClientFilterError('Unexpected end of filter' if token is None else f'Unexpected {token!r}')
+
+
+@lru_cache(maxsize=1024)
+def parse_client_filter(expression: str) -> Node:
+    """ Parse client_filter into a tree of Term/BoolOp. Raises ClientFilterError """
+    if expression is None:
+        raise ClientFilterError('Client filter cannot be null')
+    if not _EXPRESSION_KEY.search(expression):
+        # LEGACY FILTERS ARE A SINGLE TAG, EVEN WITH SPACES, ":" OR WORDS LIKE "OR" INSIDE
+        return Term('tag', (expression,))
+    return _Parser(_tokenize(expression)).parse()
+
+
+def _like_pattern(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('*', '%')
+
+
+def _like_matches(pattern: str, value: str) -> bool:
+    """ Python side of column LIKE _like_pattern(pattern) """
+    return re.fullmatch('.*'.join(re.escape(part) for part in pattern.split('*')), value, re.DOTALL) is not None
+
+
+def client_timezone():
+    return func.coalesce(Client.timezone, LOCAL_TIMEZONE)
+
+
+def _compile_term(term: Term):
+    column = CLIENT_FILTER_FIELDS[term.key]
+    exact = [value for value in term.values if '*' not in value]
+    # EQUALITY AND IN ARE SERVED BY BTREE INDEXES, PATTERNS ONLY BY THE PATTERN_OPS ONES (PREFIX PATTERNS)
+    clauses = [column == exact[0]] if len(exact) == 1 else [column.in_(exact)] if exact else []
+    clauses += [column.like(_like_pattern(value)) for value in term.values if '*' in value]
+    # SAME AS MATCHING client_timezone(), BUT timezone INDEXES STAY USABLE: LOCAL TIMEZONE IS KNOWN HERE
+    if term.key == 'tz' and any(_like_matches(value, LOCAL_TIMEZONE) for value in term.values):
+        clauses.append(column.is_(None))
+    return clauses[0] if len(clauses) == 1 else or_(*clauses)
+
+
+def _compile_node(node: Node):
+    if isinstance(node, Term):
+        return _compile_term(node)
+    operands = [_compile_node(operand) for operand in node.operands]
+    if node.op == 'NOT':
+        # NOT OF A COMPARISON WITH NULL (NO TAG) IS NULL, WHICH WOULD DROP THE CLIENT
+        return operands[0].self_group().is_not(true())
+    return and_(*operands) if node.op == 'AND' else or_(*operands)
+
+
+@lru_cache(maxsize=1024)
+def compile_client_filter(expression: str):
+    """ SQLAlchemy WHERE clause on Client for client_filter. Cached, the clause is immutable and reusable """
+    return _compile_node(parse_client_filter(expression))
+
+
+_audience_sizes: Dict[str, Tuple[int, datetime]] = {}
+_audience_sizes_lock = Lock()
+
+
+def audience_size(session, expression: str, max_age: int = AUDIENCE_SIZE_TTL_SECONDS) -> int:
+    """ Not deleted clients count matched by client_filter (distribution audience), cached for max_age seconds """
+    now = datetime.now()
+    with _audience_sizes_lock:
+        cached = _audience_sizes.get(expression)
+    if cached is not None and now - cached[1] < timedelta(seconds=max_age):
+        return cached[0]
+    size = session.query(func.count(Client.id)) \
+        .filter(compile_client_filter(expression), Client.was_deleted.isnot(True)).scalar()
+    with _audience_sizes_lock:
+        if len(_audience_sizes) >= AUDIENCE_SIZE_CACHE_LIMIT:
+            _audience_sizes.clear()
+        _audience_sizes[expression] = (size, now)
+    return size
+
+
+__all__ = ['ClientFilterError', 'parse_client_filter', 'compile_client_filter', 'audience_size',
+           'client_timezone', 'CLIENT_FILTER_FIELDS', 'LOCAL_TIMEZONE']
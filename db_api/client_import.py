@@ -0,0 +1,129 @@
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from typing import Tuple
+# CURRENT PROJECT MODULES
+from db_api.models import Client, notify_cache
+import csv
+import io
+
+
+CLIENT_IMPORT_COLUMNS = ['mobile_number', 'mobile_operator_code', 'tag', 'timezone', 'was_deleted']
+CLIENT_IMPORT_ON_CONFLICT = ['skip', 'update']
+
+# STAGING TABLE LIVES ONLY UNTIL THE IMPORT TRANSACTION ENDS
+CREATE_STAGING = text("""
+    CREATE TEMP TABLE clients_import (
+        row_no integer NOT NULL,
+        mobile_number varchar(15) NOT NULL,
+        mobile_operator_code varchar(5),
+        tag varchar,
+        timezone varchar(30),
+        was_deleted boolean
+    ) ON COMMIT DROP
+""")
+
+COPY_STAGING = f"COPY clients_import (row_no, {', '.join(CLIENT_IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+
+# FIRST OCCURRENCE OF EVERY MOBILE NUMBER IN THE UPLOAD WINS
+DEDUPLICATED_STAGING = """
+    SELECT DISTINCT ON (mobile_number) mobile_number, mobile_operator_code, tag,
+           coalesce(timezone, 'Europe/Moscow') AS timezone, coalesce(was_deleted, false) AS was_deleted
+    FROM clients_import
+    ORDER BY mobile_number, row_no
+"""
+
+INSERT_NEW = text(f"""
+    INSERT INTO clients ({', '.join(CLIENT_IMPORT_COLUMNS)})
+    SELECT {', '.join('s.' + column for column in CLIENT_IMPORT_COLUMNS)}
+    FROM ({DEDUPLICATED_STAGING}) s
+    ON CONFLICT (mobile_number) DO NOTHING
+""")
+
+# xmax OF A ROW JUST INSERTED IS 0, OF AN UPDATED ONE IS THE UPDATING TRANSACTION
+UPSERT = text(f"""
+    INSERT INTO clients AS c ({', '.join(CLIENT_IMPORT_COLUMNS)})
+    SELECT {', '.join('s.' + column for column in CLIENT_IMPORT_COLUMNS)}
+    FROM ({DEDUPLICATED_STAGING}) s
+    ON CONFLICT (mobile_number) DO UPDATE
+    SET mobile_operator_code = EXCLUDED.mobile_operator_code, tag = EXCLUDED.tag, timezone = EXCLUDED.timezone,
+        was_deleted = EXCLUDED.was_deleted
+    WHERE (c.mobile_operator_code, c.tag, c.timezone, c.was_deleted)
+          IS DISTINCT FROM (EXCLUDED.mobile_operator_code, EXCLUDED.tag, EXCLUDED.timezone, EXCLUDED.was_deleted)
+    RETURNING c.xmax = 0 AS created
+""")
+
+COUNT_STAGING = text("SELECT count(*), count(DISTINCT mobile_number) FROM clients_import")
+
+
+class ClientImport:
+    """
+    Bulk client ingestion: validated rows are COPYed into a temporary staging table,
+    then merged into clients with one INSERT ... SELECT ... ON CONFLICT (mobile_number).
+    on_conflict='skip' keeps existing clients untouched (like POST /client/), 'update' overwrites them.
+    Nothing is visible to other sessions until merge() commits.
+    """
+
+    def __init__(self, session, on_conflict: str = 'skip'):
+        if on_conflict not in CLIENT_IMPORT_ON_CONFLICT:
+            raise ValueError(f'on_conflict must be one of: {", ".join(CLIENT_IMPORT_ON_CONFLICT)}')
+        self.session = session
+        self.on_conflict = on_conflict
+        self.staged = 0
+        self.session.execute(CREATE_STAGING)
+
+    def stage(self, rows) -> int:
+        """ COPY (row_no, data) pairs into the staging table. data is a ClientSchema loaded dict """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        count = 0
+        for row_no, data in rows:
+            writer.writerow([row_no] + [data.get(column) for column in CLIENT_IMPORT_COLUMNS])
+            count += 1
+        if count:
+            buffer.seek(0)
+            cursor = self.session.connection().connection.cursor()
+            try:
+                cursor.copy_expert(COPY_STAGING, buffer)
+            finally:
+                cursor.close()
+            self.staged += count
+        return count
+
+    def merge(self) -> dict:
+        """ Move staged rows into clients and commit. Returns import counters """
+        staged, unique = self.session.execute(COUNT_STAGING).one()
+        # UNIQUE ix_clients_mobile_number DECIDES NEW OR EXISTING, ALSO AGAINST CONCURRENT IMPORTS AND POST /client/
+        if self.on_conflict == 'update':
+            merged = [row.created for row in self.session.execute(UPSERT)]
+            created = sum(merged)
+            updated = len(merged) - created
+        else:
+            created, updated = self.session.execute(INSERT_NEW).rowcount, 0
+        if updated:
+            notify_cache(self.session.connection(), 'client:*')
+        self.session.commit()
+        return {
+            "created": created,
+            "existing": unique - created,
+            "updated": updated,
+            "duplicates": staged - unique,
+        }
+
+
+def create_client(session, data: dict) -> Tuple[Client, bool]:
+    """
+    Create client unless one with the same mobile number exists: INSERT ... ON CONFLICT DO NOTHING, so concurrent
+    requests can't both create it. Returns the new or the existing client and whether it was created, commits
+    """
+    # OMITTED VALUES GET COLUMN DEFAULTS, AS FOR Client(**data)
+    values = {key: value for key, value in data.items() if value is not None}
+    created_id = session.execute(insert(Client).values(**values)
+                                 .on_conflict_do_nothing(index_elements=[Client.mobile_number])
+                                 .returning(Client.id)).scalar()
+    session.commit()
+    if created_id is not None:
+        return session.get(Client, created_id), True
+    return session.query(Client).filter_by(mobile_number=data['mobile_number']).one(), False
+
+
+__all__ = ['ClientImport', 'CLIENT_IMPORT_ON_CONFLICT', 'create_client']
@@ -1,6 +1,9 @@
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
+from distutils.util import strtobool
 import os
+# CURRENT PROJECT MODULES
+from db_api.pool import TimedQueuePool, TimedNullPool, pool_stats
 
 POSTGRES_USER = os.getenv('POSTGRES_USER')
 POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
@@ -8,13 +11,47 @@ POSTGRES_HOST = os.getenv('POSTGRES_HOST')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT')
 POSTGRES_DB = os.getenv('POSTGRES_DB')
 SQLALCHEMY_DATABASE_URL = f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}'
+# queue: POOL OF ONE PROCESS, EVERY GUNICORN WORKER HAS ITS OWN, gunicorn.conf.py SIZES IT BY WORKER THREADS
+# null: NO POOL, A CONNECTION PER SESSION, WHEN PGBOUNCER (TRANSACTION POOLING) STANDS BETWEEN APP AND POSTGRES
+DB_POOL_MODE = os.getenv('DB_POOL_MODE', 'queue')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+# SECONDS A SESSION WAITS FOR A CONNECTION OF A FULL POOL BEFORE sqlalchemy.exc.TimeoutError
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv('DB_POOL_TIMEOUT_SECONDS', 30))
+# PING ON CHECKOUT REPLACES CONNECTIONS CLOSED BY POSTGRES RESTART OR FIREWALL INSTEAD OF FAILING THE REQUEST
+DB_POOL_PRE_PING = bool(strtobool(os.getenv('DB_POOL_PRE_PING', 'True')))
+# REOPEN CONNECTIONS OLDER THAN THIS, -1 KEEPS THEM FOREVER
+DB_POOL_RECYCLE_SECONDS = int(os.getenv('DB_POOL_RECYCLE_SECONDS', 3600))
+# CANCEL STATEMENTS RUNNING LONGER THAN THIS, 0 DISABLES. PGBOUNCER DROPS STARTUP OPTIONS, SET IT ON THE ROLE THERE:
+# ALTER ROLE ... SET statement_timeout = ...
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+
+if DB_POOL_MODE not in ('queue', 'null'):
+    raise ValueError(f'DB_POOL_MODE must be queue or null, got {DB_POOL_MODE}')
+
+pool_args = dict(poolclass=TimedQueuePool, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                 pool_timeout=DB_POOL_TIMEOUT_SECONDS, pool_recycle=DB_POOL_RECYCLE_SECONDS) \
+    if DB_POOL_MODE == 'queue' else dict(poolclass=TimedNullPool)
+connect_args = dict(options=f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}') if DB_STATEMENT_TIMEOUT_MS else {}
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    pool_size=10,
-    max_overflow=20
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args=connect_args,
+    **pool_args
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# ONE SESSION PER THREAD FOR ALL VIEWS AND ADMIN OF A PROCESS, REMOVED ON APP CONTEXT TEARDOWN (create_app)
+db_session = scoped_session(SessionLocal)
+
+
+def dispose_after_fork():
+    """ A forked child must not use connections of the parent: drop them from its pool without closing the sockets """
+    engine.dispose(close=False)
+    pool_stats.reset()
+
 
-__all__ = ['engine', 'SessionLocal']
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=dispose_after_fork)
 
+__all__ = ['engine', 'SessionLocal', 'db_session']
@@ -0,0 +1,58 @@
+from loguru import logger
+from threading import Lock
+
+
+class LeaderLock:
+    """
+    Session level advisory lock (key, 0) held on a dedicated connection as long as the process lives,
+    so one of several processes running the same periodic jobs is the leader. When the leader dies
+    its connection closes, the lock is released and the next acquire() of another process takes it
+    """
+
+    def __init__(self, engine, key: int):
+        self.engine = engine
+        self.key = key
+        self.connection = None
+        self.lock = Lock()
+
+    def acquire(self) -> bool:
+        """ True if this process is the leader, tries to become one when it isn't """
+        with self.lock:
+            try:
+                if self.connection is None:
+                    fairy = self.engine.raw_connection()
+                    # LIVES AS LONG AS THE PROCESS, DON'T KEEP A POOL SLOT FOR IT
+                    fairy.detach()
+                    self.connection = fairy.connection
+                    self.connection.autocommit = True
+                cursor = self.connection.cursor()
+                # RE-ACQUIRING A HELD SESSION LOCK STACKS IT, pg_locks TELLS WHETHER IT IS HELD ALREADY
+                cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = %s AND pid = pg_backend_pid() '
+                               'AND classid = %s AND objid = %s AND granted) OR pg_try_advisory_lock(%s, 0)',
+                               ('advisory', self.key, 0, self.key))
+                return cursor.fetchone()[0]
+            except Exception as err:
+                logger.warning(f'LEADER LOCK {self.key} connection is lost: {err}')
+                self.close_connection()
+                return False
+
+    def close_connection(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def release(self):
+        with self.lock:
+            # BACKEND EXITS AFTER CLOSE ASYNCHRONOUSLY, UNLOCK FIRST SO ANOTHER PROCESS CAN TAKE OVER AT ONCE
+            if self.connection is not None:
+                try:
+                    self.connection.cursor().execute('SELECT pg_advisory_unlock(%s, 0)', (self.key,))
+                except Exception:
+                    pass
+            self.close_connection()
+
+
+__all__ = ['LeaderLock']
@@ -0,0 +1,166 @@
+"""
+Schema migrations (Alembic, see db_api/alembic.ini and db_api/migrations) and index usage check of hot queries.
+
+    python -m db_api.migrate              # upgrade database to the latest revision
+    python -m db_api.migrate --explain    # also EXPLAIN hot queries, exit code 1 if any of them can't use its index
+"""
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import func, inspect, select, text
+import argparse
+import json
+import os
+import sys
+# CURRENT PROJECT MODULES
+from db_api.database import engine, SessionLocal
+
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alembic.ini')
+# FIRST KEY OF TWO-KEY ADVISORY LOCKS, SEE ALSO sender.materialize AND distribution_manage_app
+MIGRATE_LOCK_KEY = 3
+
+# QUERY -> INDEXES IT IS EXPECTED TO USE. PARAMETERS ARE ARBITRARY, ONLY THE PLAN SHAPE MATTERS
+HOT_QUERIES = {
+    'sender audience': (
+        "SELECT id FROM clients WHERE tag = 'tag'",
+        {'ix_clients_tag'},
+    ),
+    'client filter operator': (
+        "SELECT id FROM clients WHERE mobile_operator_code IN ('917', '926')",
+        {'ix_clients_operator_code'},
+    ),
+    'client filter timezone prefix': (
+        "SELECT id FROM clients WHERE timezone LIKE 'Europe/%'",
+        {'ix_clients_timezone_pattern'},
+    ),
+    'audience snapshot top-up': (
+        "SELECT id FROM clients WHERE tag = 'tag' AND updated_at > LOCALTIMESTAMP - interval '1 minute'",
+        {'ix_clients_updated_at', 'ix_clients_tag'},
+    ),
+    'client create deduplication': (
+        "SELECT id FROM clients WHERE mobile_number = '79000000000' LIMIT 1",
+        {'ix_clients_mobile_number'},
+    ),
+    'sender message lookup': (
+        "SELECT id FROM messages WHERE distribution_id = 1 AND client_id = 1",
+        # ON ALMOST EMPTY TABLES ANY INDEX LEADING WITH distribution_id MAY WIN
+        {'uq_messages_distribution_client', 'ix_messages_distribution_status'},
+    ),
+    'sender claim': (
+        "SELECT id FROM messages WHERE distribution_id = 1 AND id > 0 "
+        "AND (send_status = 'NOT_SENT' OR (send_status = 'FAIL' AND next_attempt_at <= now())) "
+        "ORDER BY id LIMIT 1000",
+        {'ix_messages_distribution_unsent'},
+    ),
+    'statistic per status': (
+        "SELECT send_status, count(*) FROM messages WHERE distribution_id = 1 GROUP BY send_status",
+        {'ix_messages_distribution_status'},
+    ),
+    'timeseries all distributions': (
+        "SELECT date_trunc('hour', bucket), sum(sent_count) FROM message_timeseries "
+        "WHERE bucket >= LOCALTIMESTAMP - interval '1 day' GROUP BY 1",
+        {'ix_message_timeseries_bucket'},
+    ),
+    'timeseries one distribution': (
+        "SELECT date_trunc('hour', bucket), sum(sent_count) FROM message_timeseries "
+        "WHERE distribution_id = 1 AND bucket >= LOCALTIMESTAMP - interval '1 day' GROUP BY 1",
+        {'message_timeseries_pkey', 'ix_message_timeseries_bucket'},
+    ),
+    'scheduler poll': (
+        "SELECT id FROM distributions WHERE end_date >= now() AND was_deleted IS NOT TRUE",
+        {'ix_distributions_end_date_active'},
+    ),
+}
+
+
+def alembic_config(configure_logger: bool = False) -> Config:
+    config = Config(ALEMBIC_INI)
+    config.attributes['configure_logger'] = configure_logger
+    return config
+
+
+def legacy_revision(connection):
+    """ Revision matching a database created by Base.metadata.create_all before migrations, None if it's empty """
+    inspector = inspect(connection)
+    if inspector.has_table('alembic_version') or not inspector.has_table('distributions'):
+        return None
+    if any(index['name'] == 'ix_clients_mobile_number' and index['unique'] for index in inspector.get_indexes('clients')):
+        return '0010'
+    if inspector.has_table('message_timeseries'):
+        # TRIGGERS COUNTING SEND ATTEMPTS (0009) READ messages.attempts, THOSE COUNTING MESSAGES (0008) DON'T
+        attempt_events = connection.execute(text(
+            "SELECT prosrc LIKE '%attempts%' FROM pg_proc WHERE proname = 'message_timeseries_on_update'")).scalar()
+        return '0009' if attempt_events else '0008'
+    if 'version' in {column['name'] for column in inspector.get_columns('clients')}:
+        return '0007'
+    if inspector.has_table('audience_snapshots'):
+        return '0005'
+    if 'ix_clients_operator_code' in {index['name'] for index in inspector.get_indexes('clients')}:
+        return '0004'
+    if 'ix_messages_distribution_unsent' in {index['name'] for index in inspector.get_indexes('messages')}:
+        return '0003'
+    if inspector.has_table('distribution_stats'):
+        return '0002'
+    return '0001'
+
+
+def upgrade_database(bind=engine, revision: str = 'head', configure_logger: bool = False):
+    """ Bring database schema to revision. Safe to call from several processes starting at once """
+    config = alembic_config(configure_logger)
+    with bind.begin() as connection:
+        connection.execute(select(func.pg_advisory_xact_lock(MIGRATE_LOCK_KEY, 0)))
+        config.attributes['connection'] = connection
+        legacy = legacy_revision(connection)
+        if legacy is not None:
+            command.stamp(config, legacy)
+        command.upgrade(config, revision)
+
+
+def index_names(plan) -> set:
+    """ Names of all indexes used anywhere in EXPLAIN (FORMAT JSON) plan tree """
+    names = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', []):
+        names |= index_names(child)
+    return names
+
+
+def node_types(plan) -> set:
+    """ Node types (Seq Scan, Index Scan, ...) anywhere in EXPLAIN (FORMAT JSON) plan tree """
+    types = {plan['Node Type']}
+    for child in plan.get('Plans', []):
+        types |= node_types(child)
+    return types
+
+
+def explain_hot_query(session, query: str) -> dict:
+    """ Root node of the query plan with sequential scans disabled. The caller rolls the session back """
+    # SMALL TABLES ARE ALWAYS SEQ SCANNED, SO ONLY ASK WHETHER AN INDEX SCAN IS POSSIBLE AT ALL:
+    # A SEQ SCAN LEFT IN THE PLAN MEANS THERE IS NO INDEX FOR IT
+    session.execute(text('SET LOCAL enable_seqscan = off'))
+    plan = session.execute(text(f'EXPLAIN (FORMAT JSON) {query}')).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def explain_hot_queries(session) -> bool:
+    """ EXPLAIN every hot query and check it can use its index (tests/test_hot_queries.py runs the same check) """
+    ok = True
+    for name, (query, expected) in HOT_QUERIES.items():
+        plan = explain_hot_query(session, query)
+        used = index_names(plan)
+        passed = bool(used & expected) and 'Seq Scan' not in node_types(plan)
+        ok = ok and passed
+        print(f'{"ok" if passed else "FAIL":<5} {name:<30} uses {", ".join(sorted(used)) or "no index"}')
+    session.rollback()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Upgrade database schema')
+    parser.add_argument('--revision', default='head')
+    parser.add_argument('--explain', action='store_true', help='check that hot queries use indexes')
+    args = parser.parse_args()
+    upgrade_database(revision=args.revision, configure_logger=True)
+    if args.explain:
+        sys.exit(0 if explain_hot_queries(SessionLocal()) else 1)
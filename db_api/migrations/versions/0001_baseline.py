@@ -0,0 +1,52 @@
+"""baseline: distributions, clients and messages tables
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 08:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'distributions',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('start_date', sa.DateTime(), comment='date when distribution will be started'),
+        sa.Column('text', sa.String(), comment='message text'),
+        sa.Column('client_filter', sa.String(),
+                  comment='get some clients with filtering them by mobile operator code, tag or etc.'),
+        sa.Column('end_date', sa.DateTime(), comment='date when distribution will be ended'),
+        sa.Column('was_deleted', sa.Boolean(), comment='Shows if this row has been removed'),
+    )
+    op.create_table(
+        'clients',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('mobile_number', sa.String(15), comment='client telephone number'),
+        sa.Column('mobile_operator_code', sa.String(5), comment='7XXX9354758 - three number after country code'),
+        sa.Column('tag', sa.String(), comment='free fillable field. Can be nullable'),
+        sa.Column('timezone', sa.String(30), comment='it will be look like "Europe/Moscow"'),
+        sa.Column('was_deleted', sa.Boolean(), comment='Shows if this row has been removed'),
+    )
+    op.create_table(
+        'messages',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('distribution_id', sa.Integer(), sa.ForeignKey('distributions.id'),
+                  comment='distribution id, where message was sended'),
+        sa.Column('client_id', sa.Integer(), sa.ForeignKey('clients.id'), comment='client id whose was send message'),
+        sa.Column('send_date', sa.DateTime(), nullable=True,
+                  comment='date when message was send. If NULL, it mean that message was not send yet'),
+        sa.Column('send_status', sa.String()),
+    )
+
+
+def downgrade():
+    op.drop_table('messages')
+    op.drop_table('clients')
+    op.drop_table('distributions')
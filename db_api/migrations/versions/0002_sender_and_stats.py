@@ -0,0 +1,106 @@
+"""sender retry/lease columns and distribution_stats rollup with its triggers
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 08:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# TRIGGERS AS OF THIS REVISION, LATER REVISIONS REPLACE THEM. MIGRATIONS DON'T IMPORT APPLICATION DDL,
+# IT CHANGES WITH THE CODE WHILE A REVISION MUST ALWAYS DO THE SAME
+DELTA_SELECTS = {
+    'insert': 'SELECT distribution_id, send_status, 1 AS n FROM new_rows',
+    'delete': 'SELECT distribution_id, send_status, -1 AS n FROM old_rows',
+    'update': '''
+        SELECT new_rows.distribution_id, new_rows.send_status, 1 AS n
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE new_rows.send_status IS DISTINCT FROM old_rows.send_status
+           OR new_rows.distribution_id IS DISTINCT FROM old_rows.distribution_id
+        UNION ALL
+        SELECT old_rows.distribution_id, old_rows.send_status, -1 AS n
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE new_rows.send_status IS DISTINCT FROM old_rows.send_status
+           OR new_rows.distribution_id IS DISTINCT FROM old_rows.distribution_id''',
+}
+TRANSITION_TABLES = {
+    'insert': 'REFERENCING NEW TABLE AS new_rows',
+    'delete': 'REFERENCING OLD TABLE AS old_rows',
+    'update': 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+}
+
+
+def distribution_stats_triggers(op_name):
+    return [
+        f'''
+        CREATE OR REPLACE FUNCTION distribution_stats_on_{op_name}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO distribution_stats AS stats (distribution_id, sent_count, not_sent_count, fail_count)
+            SELECT distribution_id, COALESCE(SUM(n) FILTER (WHERE send_status = 'SENT'), 0),
+                   COALESCE(SUM(n) FILTER (WHERE send_status = 'NOT_SENT'), 0),
+                   COALESCE(SUM(n) FILTER (WHERE send_status = 'FAIL'), 0)
+            FROM ({DELTA_SELECTS[op_name]}) delta
+            WHERE distribution_id IS NOT NULL
+            GROUP BY distribution_id
+            ORDER BY distribution_id
+            ON CONFLICT (distribution_id) DO UPDATE SET sent_count = stats.sent_count + EXCLUDED.sent_count,
+                not_sent_count = stats.not_sent_count + EXCLUDED.not_sent_count,
+                fail_count = stats.fail_count + EXCLUDED.fail_count;
+            RETURN NULL;
+        END $$''',
+        f'DROP TRIGGER IF EXISTS distribution_stats_on_{op_name} ON messages',
+        f'''
+        CREATE TRIGGER distribution_stats_on_{op_name} AFTER {op_name.upper()} ON messages
+        {TRANSITION_TABLES[op_name]} FOR EACH STATEMENT EXECUTE FUNCTION distribution_stats_on_{op_name}()''',
+    ]
+
+
+def upgrade():
+    op.add_column('messages', sa.Column('attempts', sa.Integer(), comment='how many times sending was attempted'))
+    op.add_column('messages', sa.Column('last_attempt_at', sa.DateTime(), nullable=True,
+                                        comment='date of the last sending attempt'))
+    op.add_column('messages', sa.Column('next_attempt_at', sa.DateTime(), nullable=True,
+                                        comment='date when failed message will be retried'))
+    op.add_column('messages', sa.Column('lease_owner', sa.String(), nullable=True,
+                                        comment='distribution maker worker which claimed message'))
+    op.add_column('messages', sa.Column('lease_expires_at', sa.DateTime(), nullable=True,
+                                        comment='claim is void after this date'))
+    # BEFORE RETRIES WERE SCHEDULED EVERY FAIL WAS RESENT ON THE NEXT TICK: KEEP THEM DUE, NOT TERMINAL.
+    # attempts STAYS NULL (0), THE SENDER NEVER COUNTED THEM
+    op.execute("UPDATE messages SET next_attempt_at = LOCALTIMESTAMP WHERE send_status = 'FAIL'")
+    op.create_table(
+        'distribution_stats',
+        sa.Column('distribution_id', sa.Integer(), sa.ForeignKey('distributions.id'), primary_key=True),
+        sa.Column('sent_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('not_sent_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('fail_count', sa.Integer(), nullable=False, server_default='0'),
+    )
+    # ROLLUP OF MESSAGES WRITTEN BEFORE THE TRIGGERS EXISTED
+    op.execute("""
+        INSERT INTO distribution_stats (distribution_id, sent_count, not_sent_count, fail_count)
+        SELECT distribution_id,
+               count(*) FILTER (WHERE send_status = 'SENT'),
+               count(*) FILTER (WHERE send_status = 'NOT_SENT'),
+               count(*) FILTER (WHERE send_status = 'FAIL')
+        FROM messages
+        WHERE distribution_id IS NOT NULL
+        GROUP BY distribution_id
+    """)
+    for op_name in DELTA_SELECTS:
+        for statement in distribution_stats_triggers(op_name):
+            op.execute(statement)
+
+
+def downgrade():
+    for op_name in ('insert', 'update', 'delete'):
+        op.execute(f'DROP TRIGGER IF EXISTS distribution_stats_on_{op_name} ON messages')
+        op.execute(f'DROP FUNCTION IF EXISTS distribution_stats_on_{op_name}()')
+    op.drop_table('distribution_stats')
+    for column in ('lease_expires_at', 'lease_owner', 'next_attempt_at', 'last_attempt_at', 'attempts'):
+        op.drop_column('messages', column)
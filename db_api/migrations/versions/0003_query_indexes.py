@@ -0,0 +1,45 @@
+"""indexes for hot queries and unique message per client in a distribution
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 08:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # KEEP ONE MESSAGE PER (DISTRIBUTION, CLIENT): SENT ONE IF ANY, OTHERWISE THE OLDEST
+    op.execute("""
+        DELETE FROM messages m
+        USING (
+            SELECT id, row_number() OVER (PARTITION BY distribution_id, client_id
+                                          ORDER BY send_status = 'SENT' DESC, id) AS rn
+            FROM messages
+            WHERE distribution_id IS NOT NULL AND client_id IS NOT NULL
+        ) duplicate
+        WHERE m.id = duplicate.id AND duplicate.rn > 1
+    """)
+    op.create_unique_constraint('uq_messages_distribution_client', 'messages', ['distribution_id', 'client_id'])
+    op.create_index('ix_messages_distribution_status', 'messages', ['distribution_id', 'send_status'])
+    op.create_index('ix_messages_distribution_unsent', 'messages', ['distribution_id', 'id'],
+                    postgresql_where=sa.text("send_status IN ('NOT_SENT', 'FAIL')"))
+    op.create_index('ix_clients_tag', 'clients', ['tag'])
+    op.create_index('ix_clients_mobile_number', 'clients', ['mobile_number'])
+    op.create_index('ix_distributions_end_date_active', 'distributions', ['end_date'],
+                    postgresql_where=sa.text('was_deleted IS NOT TRUE'))
+
+
+def downgrade():
+    op.drop_index('ix_distributions_end_date_active', 'distributions')
+    op.drop_index('ix_clients_mobile_number', 'clients')
+    op.drop_index('ix_clients_tag', 'clients')
+    op.drop_index('ix_messages_distribution_unsent', 'messages')
+    op.drop_index('ix_messages_distribution_status', 'messages')
+    op.drop_constraint('uq_messages_distribution_client', 'messages', type_='unique')
@@ -0,0 +1,24 @@
+"""indexes for client filter expressions: operator code and timezone prefix
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 09:00:00
+"""
+from alembic import op
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_clients_operator_code', 'clients', ['mobile_operator_code'])
+    op.create_index('ix_clients_timezone_pattern', 'clients', ['timezone'],
+                    postgresql_ops={'timezone': 'varchar_pattern_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_clients_timezone_pattern', 'clients')
+    op.drop_index('ix_clients_operator_code', 'clients')
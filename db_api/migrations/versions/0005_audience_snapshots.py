@@ -0,0 +1,54 @@
+"""clients.updated_at with its trigger and audience_snapshots watermarks
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 10:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+CLIENTS_UPDATED_AT_TRIGGER = [
+    '''
+    CREATE OR REPLACE FUNCTION clients_touch_updated_at() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.updated_at = LOCALTIMESTAMP;
+        RETURN NEW;
+    END $$''',
+    'DROP TRIGGER IF EXISTS clients_touch_updated_at ON clients',
+    '''
+    CREATE TRIGGER clients_touch_updated_at BEFORE UPDATE ON clients
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION clients_touch_updated_at()''',
+]
+
+
+def upgrade():
+    # EXISTING CLIENTS GET MIGRATION TIME, SO RUNNING DISTRIBUTIONS RECHECK THEM ONCE
+    op.add_column('clients', sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                       server_default=sa.text('LOCALTIMESTAMP'),
+                                       comment='date of the last change, database clock'))
+    op.create_index('ix_clients_updated_at', 'clients', ['updated_at'])
+    for statement in CLIENTS_UPDATED_AT_TRIGGER:
+        op.execute(statement)
+    op.create_table(
+        'audience_snapshots',
+        sa.Column('distribution_id', sa.Integer(), sa.ForeignKey('distributions.id'), primary_key=True),
+        sa.Column('timezone', sa.String(30), primary_key=True),
+        sa.Column('client_filter', sa.String(),
+                  comment='client_filter the snapshot was made with, other one needs a full snapshot'),
+        sa.Column('snapshot_at', sa.DateTime(), nullable=False,
+                  comment='clients changed after this date are not materialized yet'),
+    )
+
+
+def downgrade():
+    op.drop_table('audience_snapshots')
+    op.execute('DROP TRIGGER IF EXISTS clients_touch_updated_at ON clients')
+    op.execute('DROP FUNCTION IF EXISTS clients_touch_updated_at()')
+    op.drop_index('ix_clients_updated_at', 'clients')
+    op.drop_column('clients', 'updated_at')
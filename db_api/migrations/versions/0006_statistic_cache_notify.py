@@ -0,0 +1,62 @@
+"""distribution_stats triggers also NOTIFY cache invalidation of touched distributions
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 11:00:00
+"""
+from alembic import op
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+DELTA_SELECTS = {
+    'insert': 'SELECT distribution_id, send_status, 1 AS n FROM new_rows',
+    'delete': 'SELECT distribution_id, send_status, -1 AS n FROM old_rows',
+    'update': '''
+        SELECT new_rows.distribution_id, new_rows.send_status, 1 AS n
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE new_rows.send_status IS DISTINCT FROM old_rows.send_status
+           OR new_rows.distribution_id IS DISTINCT FROM old_rows.distribution_id
+        UNION ALL
+        SELECT old_rows.distribution_id, old_rows.send_status, -1 AS n
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE new_rows.send_status IS DISTINCT FROM old_rows.send_status
+           OR new_rows.distribution_id IS DISTINCT FROM old_rows.distribution_id''',
+}
+
+
+def distribution_stats_function(op_name, notify):
+    """ Trigger function as of this revision (notify) or of the previous one, triggers themselves don't change """
+    notify_sql = f'''
+            PERFORM pg_notify('cache_invalidate', 'statistic:' || distribution_id)
+            FROM (SELECT DISTINCT distribution_id FROM ({DELTA_SELECTS[op_name]}) delta) touched
+            WHERE distribution_id IS NOT NULL;''' if notify else ''
+    return f'''
+        CREATE OR REPLACE FUNCTION distribution_stats_on_{op_name}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO distribution_stats AS stats (distribution_id, sent_count, not_sent_count, fail_count)
+            SELECT distribution_id, COALESCE(SUM(n) FILTER (WHERE send_status = 'SENT'), 0),
+                   COALESCE(SUM(n) FILTER (WHERE send_status = 'NOT_SENT'), 0),
+                   COALESCE(SUM(n) FILTER (WHERE send_status = 'FAIL'), 0)
+            FROM ({DELTA_SELECTS[op_name]}) delta
+            WHERE distribution_id IS NOT NULL
+            GROUP BY distribution_id
+            ORDER BY distribution_id
+            ON CONFLICT (distribution_id) DO UPDATE SET sent_count = stats.sent_count + EXCLUDED.sent_count,
+                not_sent_count = stats.not_sent_count + EXCLUDED.not_sent_count,
+                fail_count = stats.fail_count + EXCLUDED.fail_count;{notify_sql}
+            RETURN NULL;
+        END $$'''
+
+
+def upgrade():
+    for op_name in DELTA_SELECTS:
+        op.execute(distribution_stats_function(op_name, notify=True))
+
+
+def downgrade():
+    for op_name in DELTA_SELECTS:
+        op.execute(distribution_stats_function(op_name, notify=False))
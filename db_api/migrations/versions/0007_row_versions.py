@@ -0,0 +1,52 @@
+"""row versions for ETags: row_version_seq, version columns and touch_row_version triggers
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+# TABLES EXISTING AT THIS REVISION, LATER TABLES ARE CREATED WITH THEIR VERSION COLUMN
+VERSIONED_TABLES = ['distributions', 'clients', 'messages', 'distribution_stats']
+ROW_VERSION_FUNCTION = '''
+    CREATE OR REPLACE FUNCTION touch_row_version() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.version = nextval('row_version_seq');
+        RETURN NEW;
+    END $$'''
+
+
+def row_version_trigger(table):
+    return [
+        f'DROP TRIGGER IF EXISTS {table}_touch_version ON {table}',
+        f'''
+        CREATE TRIGGER {table}_touch_version BEFORE UPDATE ON {table}
+        FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION touch_row_version()''',
+    ]
+
+
+def upgrade():
+    op.execute('CREATE SEQUENCE IF NOT EXISTS row_version_seq')
+    op.execute(ROW_VERSION_FUNCTION)
+    for table in VERSIONED_TABLES:
+        # CONSTANT DEFAULT DOESN'T REWRITE BIG TABLES, EXISTING ROWS START AT VERSION 0
+        op.add_column(table, sa.Column('version', sa.BigInteger(), nullable=False, server_default='0',
+                                       comment='row version, renewed by touch_row_version trigger on every change'))
+        op.alter_column(table, 'version', server_default=sa.text("nextval('row_version_seq')"))
+        for statement in row_version_trigger(table):
+            op.execute(statement)
+
+
+def downgrade():
+    for table in VERSIONED_TABLES:
+        op.execute(f'DROP TRIGGER IF EXISTS {table}_touch_version ON {table}')
+        op.drop_column(table, 'version')
+    op.execute('DROP FUNCTION IF EXISTS touch_row_version()')
+    op.execute('DROP SEQUENCE IF EXISTS row_version_seq')
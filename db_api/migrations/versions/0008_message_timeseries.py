@@ -0,0 +1,98 @@
+"""message_timeseries rollup of SENT/FAIL messages per distribution and minute, with its triggers
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 13:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+# A MESSAGE COUNTS IN THE MINUTE OF ITS SEND_DATE, A FAILED ONE IN THE MINUTE OF ITS LAST ATTEMPT
+EVENT_MINUTE = "date_trunc('minute', COALESCE({rows}.send_date, {rows}.last_attempt_at))"
+NEW_MINUTE, OLD_MINUTE = EVENT_MINUTE.format(rows='new_rows'), EVENT_MINUTE.format(rows='old_rows')
+CHANGED = f'''(new_rows.distribution_id, new_rows.send_status, {NEW_MINUTE})
+              IS DISTINCT FROM (old_rows.distribution_id, old_rows.send_status, {OLD_MINUTE})'''
+DELTA_SELECTS = {
+    'insert': f'SELECT distribution_id, send_status, {NEW_MINUTE} AS bucket, 1 AS n FROM new_rows',
+    'delete': f'SELECT distribution_id, send_status, {OLD_MINUTE} AS bucket, -1 AS n FROM old_rows',
+    'update': f'''
+        SELECT new_rows.distribution_id, new_rows.send_status, {NEW_MINUTE} AS bucket, 1 AS n
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE {CHANGED}
+        UNION ALL
+        SELECT old_rows.distribution_id, old_rows.send_status, {OLD_MINUTE} AS bucket, -1 AS n
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE {CHANGED}''',
+}
+TRANSITION_TABLES = {
+    'insert': 'REFERENCING NEW TABLE AS new_rows',
+    'delete': 'REFERENCING OLD TABLE AS old_rows',
+    'update': 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+}
+MESSAGES_MINUTE = EVENT_MINUTE.format(rows='messages')
+ROLLUP = f'''
+    SELECT distribution_id, {MESSAGES_MINUTE} AS bucket,
+           count(*) FILTER (WHERE send_status = 'SENT') AS sent_count,
+           count(*) FILTER (WHERE send_status = 'FAIL') AS fail_count
+    FROM messages
+    WHERE distribution_id IS NOT NULL AND {MESSAGES_MINUTE} IS NOT NULL AND send_status IN ('SENT', 'FAIL')
+    GROUP BY 1, 2'''
+
+
+def message_timeseries_triggers(op_name):
+    return [
+        f'''
+        CREATE OR REPLACE FUNCTION message_timeseries_on_{op_name}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO message_timeseries AS ts (distribution_id, bucket, sent_count, fail_count)
+            SELECT distribution_id, bucket, COALESCE(SUM(n) FILTER (WHERE send_status = 'SENT'), 0),
+                   COALESCE(SUM(n) FILTER (WHERE send_status = 'FAIL'), 0)
+            FROM ({DELTA_SELECTS[op_name]}) delta
+            WHERE distribution_id IS NOT NULL AND bucket IS NOT NULL AND send_status IN ('SENT', 'FAIL')
+            GROUP BY distribution_id, bucket
+            ORDER BY distribution_id, bucket
+            ON CONFLICT (distribution_id, bucket) DO UPDATE SET sent_count = ts.sent_count + EXCLUDED.sent_count,
+                fail_count = ts.fail_count + EXCLUDED.fail_count;
+            RETURN NULL;
+        END $$''',
+        f'DROP TRIGGER IF EXISTS message_timeseries_on_{op_name} ON messages',
+        f'''
+        CREATE TRIGGER message_timeseries_on_{op_name} AFTER {op_name.upper()} ON messages
+        {TRANSITION_TABLES[op_name]} FOR EACH STATEMENT EXECUTE FUNCTION message_timeseries_on_{op_name}()''',
+    ]
+
+
+def upgrade():
+    op.create_table(
+        'message_timeseries',
+        sa.Column('distribution_id', sa.Integer(), sa.ForeignKey('distributions.id'), primary_key=True),
+        sa.Column('bucket', sa.DateTime(), primary_key=True, comment='start of the minute'),
+        sa.Column('sent_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('fail_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('version', sa.BigInteger(), nullable=False, server_default=sa.text("nextval('row_version_seq')"),
+                  comment='row version, renewed by touch_row_version trigger on every change'),
+    )
+    op.create_index('ix_message_timeseries_bucket', 'message_timeseries', ['bucket'])
+    # ROLLUP OF MESSAGES WRITTEN BEFORE THE TRIGGERS EXISTED, MESSAGES ARE LOCKED SO NONE IS COUNTED TWICE OR MISSED
+    op.execute('LOCK TABLE messages IN SHARE MODE')
+    op.execute(f'INSERT INTO message_timeseries (distribution_id, bucket, sent_count, fail_count) {ROLLUP}')
+    for op_name in DELTA_SELECTS:
+        for statement in message_timeseries_triggers(op_name):
+            op.execute(statement)
+    op.execute('DROP TRIGGER IF EXISTS message_timeseries_touch_version ON message_timeseries')
+    op.execute('''
+        CREATE TRIGGER message_timeseries_touch_version BEFORE UPDATE ON message_timeseries
+        FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION touch_row_version()''')
+
+
+def downgrade():
+    for op_name in ('insert', 'update', 'delete'):
+        op.execute(f'DROP TRIGGER IF EXISTS message_timeseries_on_{op_name} ON messages')
+        op.execute(f'DROP FUNCTION IF EXISTS message_timeseries_on_{op_name}()')
+    op.drop_table('message_timeseries')
@@ -0,0 +1,139 @@
+"""message_timeseries counts every sending attempt in its own minute, so retries don't move closed minutes
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 18:00:00
+"""
+from alembic import op
+
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+TRANSITION_TABLES = {
+    'insert': 'REFERENCING NEW TABLE AS new_rows',
+    'delete': 'REFERENCING OLD TABLE AS old_rows',
+    'update': 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+}
+
+# AN ATTEMPT IS ONE SENT OR FAIL EVENT IN THE MINUTE OF THE MESSAGE'S LAST ATTEMPT WHEN IT WAS MADE
+EVENT_MINUTE = "date_trunc('minute', COALESCE({rows}.last_attempt_at, {rows}.send_date))"
+SENT_EVENTS = "({rows}.send_status IS NOT DISTINCT FROM 'SENT')::int"
+FAIL_EVENTS = f'''GREATEST(COALESCE({{rows}}.attempts, 0) - {SENT_EVENTS},
+                           ({{rows}}.send_status IS NOT DISTINCT FROM 'FAIL')::int)'''
+
+
+def events(rows, sign=''):
+    return f'{sign}{SENT_EVENTS.format(rows=rows)} AS sent, {sign}{FAIL_EVENTS.format(rows=rows)} AS fail'
+
+
+NEW_MINUTE, OLD_MINUTE = EVENT_MINUTE.format(rows='new_rows'), EVENT_MINUTE.format(rows='old_rows')
+SAME_DISTRIBUTION = 'new_rows.distribution_id IS NOT DISTINCT FROM old_rows.distribution_id'
+OTHER_DISTRIBUTION = 'new_rows.distribution_id IS DISTINCT FROM old_rows.distribution_id'
+DELTA_SELECTS = {
+    'insert': f'SELECT distribution_id, {NEW_MINUTE} AS bucket, {events("new_rows")} FROM new_rows',
+    'delete': f'SELECT distribution_id, {OLD_MINUTE} AS bucket, {events("old_rows", "-")} FROM old_rows',
+    'update': f'''
+        SELECT new_rows.distribution_id, COALESCE({NEW_MINUTE}, {OLD_MINUTE}) AS bucket,
+               {SENT_EVENTS.format(rows='new_rows')} - {SENT_EVENTS.format(rows='old_rows')} AS sent,
+               {FAIL_EVENTS.format(rows='new_rows')} - {FAIL_EVENTS.format(rows='old_rows')} AS fail
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE {SAME_DISTRIBUTION}
+          AND (new_rows.send_status, new_rows.attempts) IS DISTINCT FROM (old_rows.send_status, old_rows.attempts)
+        UNION ALL
+        SELECT new_rows.distribution_id, {NEW_MINUTE} AS bucket, {events("new_rows")}
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE {OTHER_DISTRIBUTION}
+        UNION ALL
+        SELECT old_rows.distribution_id, {OLD_MINUTE} AS bucket, {events("old_rows", "-")}
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE {OTHER_DISTRIBUTION}''',
+}
+MESSAGES_MINUTE = EVENT_MINUTE.format(rows='messages')
+MESSAGES_SENT, MESSAGES_FAIL = SENT_EVENTS.format(rows='messages'), FAIL_EVENTS.format(rows='messages')
+ROLLUP = f'''
+    SELECT distribution_id, {MESSAGES_MINUTE} AS bucket, SUM({MESSAGES_SENT}) AS sent_count,
+           SUM({MESSAGES_FAIL}) AS fail_count
+    FROM messages
+    WHERE distribution_id IS NOT NULL AND {MESSAGES_MINUTE} IS NOT NULL
+    GROUP BY 1, 2
+    HAVING SUM({MESSAGES_SENT}) + SUM({MESSAGES_FAIL}) > 0'''
+
+# 0008: A MESSAGE COUNTS ONCE, IN THE MINUTE OF ITS SEND_DATE, A FAILED ONE IN THE MINUTE OF ITS LAST ATTEMPT
+STATE_MINUTE = "date_trunc('minute', COALESCE({rows}.send_date, {rows}.last_attempt_at))"
+NEW_STATE_MINUTE, OLD_STATE_MINUTE = STATE_MINUTE.format(rows='new_rows'), STATE_MINUTE.format(rows='old_rows')
+STATE_CHANGED = f'''(new_rows.distribution_id, new_rows.send_status, {NEW_STATE_MINUTE})
+              IS DISTINCT FROM (old_rows.distribution_id, old_rows.send_status, {OLD_STATE_MINUTE})'''
+STATE_DELTA_SELECTS = {
+    'insert': f'SELECT distribution_id, send_status, {NEW_STATE_MINUTE} AS bucket, 1 AS n FROM new_rows',
+    'delete': f'SELECT distribution_id, send_status, {OLD_STATE_MINUTE} AS bucket, -1 AS n FROM old_rows',
+    'update': f'''
+        SELECT new_rows.distribution_id, new_rows.send_status, {NEW_STATE_MINUTE} AS bucket, 1 AS n
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE {STATE_CHANGED}
+        UNION ALL
+        SELECT old_rows.distribution_id, old_rows.send_status, {OLD_STATE_MINUTE} AS bucket, -1 AS n
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE {STATE_CHANGED}''',
+}
+MESSAGES_STATE_MINUTE = STATE_MINUTE.format(rows='messages')
+STATE_ROLLUP = f'''
+    SELECT distribution_id, {MESSAGES_STATE_MINUTE} AS bucket,
+           count(*) FILTER (WHERE send_status = 'SENT') AS sent_count,
+           count(*) FILTER (WHERE send_status = 'FAIL') AS fail_count
+    FROM messages
+    WHERE distribution_id IS NOT NULL AND {MESSAGES_STATE_MINUTE} IS NOT NULL AND send_status IN ('SENT', 'FAIL')
+    GROUP BY 1, 2'''
+
+
+def message_timeseries_function(op_name):
+    return f'''
+        CREATE OR REPLACE FUNCTION message_timeseries_on_{op_name}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO message_timeseries AS ts (distribution_id, bucket, sent_count, fail_count)
+            SELECT distribution_id, bucket, SUM(sent), SUM(fail)
+            FROM ({DELTA_SELECTS[op_name]}) delta
+            WHERE distribution_id IS NOT NULL AND bucket IS NOT NULL
+            GROUP BY distribution_id, bucket
+            HAVING SUM(sent) <> 0 OR SUM(fail) <> 0
+            ORDER BY distribution_id, bucket
+            ON CONFLICT (distribution_id, bucket) DO UPDATE
+            SET sent_count = ts.sent_count + EXCLUDED.sent_count, fail_count = ts.fail_count + EXCLUDED.fail_count;
+            RETURN NULL;
+        END $$'''
+
+
+def message_timeseries_state_function(op_name):
+    return f'''
+        CREATE OR REPLACE FUNCTION message_timeseries_on_{op_name}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO message_timeseries AS ts (distribution_id, bucket, sent_count, fail_count)
+            SELECT distribution_id, bucket, COALESCE(SUM(n) FILTER (WHERE send_status = 'SENT'), 0),
+                   COALESCE(SUM(n) FILTER (WHERE send_status = 'FAIL'), 0)
+            FROM ({STATE_DELTA_SELECTS[op_name]}) delta
+            WHERE distribution_id IS NOT NULL AND bucket IS NOT NULL AND send_status IN ('SENT', 'FAIL')
+            GROUP BY distribution_id, bucket
+            ORDER BY distribution_id, bucket
+            ON CONFLICT (distribution_id, bucket) DO UPDATE SET sent_count = ts.sent_count + EXCLUDED.sent_count,
+                fail_count = ts.fail_count + EXCLUDED.fail_count;
+            RETURN NULL;
+        END $$'''
+
+
+def rebuild(function, rollup):
+    # MESSAGES ARE LOCKED SO NO CHANGE IS COUNTED BY THE OLD FUNCTIONS AND THE NEW ROLLUP BOTH, OR BY NEITHER
+    op.execute('LOCK TABLE messages IN SHARE MODE')
+    for op_name in DELTA_SELECTS:
+        op.execute(function(op_name))
+    op.execute('DELETE FROM message_timeseries')
+    op.execute(f'INSERT INTO message_timeseries (distribution_id, bucket, sent_count, fail_count) {rollup}')
+
+
+def upgrade():
+    rebuild(message_timeseries_function, ROLLUP)
+
+
+def downgrade():
+    rebuild(message_timeseries_state_function, STATE_ROLLUP)
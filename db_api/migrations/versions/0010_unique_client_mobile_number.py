@@ -0,0 +1,46 @@
+"""one client per mobile number: ix_clients_mobile_number made unique, upgrade refuses while duplicates exist
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 19:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+# SHOWN IN THE ERROR, THE REST ARE FOUND WITH THE SAME QUERY
+DUPLICATES_SHOWN = 20
+DUPLICATE_NUMBERS = sa.text('''
+    SELECT mobile_number, array_agg(id ORDER BY id) AS ids,
+           array_agg(was_deleted IS TRUE ORDER BY id) AS deleted, count(*) OVER () AS total
+    FROM clients
+    WHERE mobile_number IS NOT NULL
+    GROUP BY mobile_number
+    HAVING count(*) > 1
+    ORDER BY mobile_number
+    LIMIT :limit''')
+
+
+def upgrade():
+    # NO CLIENT IS CREATED BETWEEN THE CHECK AND BUILDING THE UNIQUE INDEX
+    op.execute('LOCK TABLE clients IN SHARE ROW EXCLUSIVE MODE')
+    # WHICH DUPLICATE KEEPS ITS DATA AND MESSAGES IS A DECISION OF THE OPERATOR, NOT OF THE MIGRATION
+    duplicates = op.get_bind().execute(DUPLICATE_NUMBERS, {"limit": DUPLICATES_SHOWN}).all()
+    if duplicates:
+        lines = '\n'.join(f'  {row.mobile_number}: client ids {row.ids}, was_deleted {row.deleted}'
+                          for row in duplicates)
+        raise RuntimeError(
+            f'{duplicates[0].total} mobile numbers belong to several clients, merge them into one client '
+            f'(move messages to it, delete the others) and upgrade again:\n{lines}')
+    op.drop_index('ix_clients_mobile_number', 'clients')
+    op.create_index('ix_clients_mobile_number', 'clients', ['mobile_number'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_clients_mobile_number', 'clients')
+    op.create_index('ix_clients_mobile_number', 'clients', ['mobile_number'])
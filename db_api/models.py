@@ -1,5 +1,6 @@
-from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, DateTime, Boolean, String, ForeignKey
+from sqlalchemy.orm import declarative_base, relationship, Session
+from sqlalchemy import Column, Integer, BigInteger, DateTime, Boolean, String, ForeignKey, Index, UniqueConstraint, \
+    Sequence, DDL, event, text
 from datetime import datetime, timedelta
 import tzlocal
 import pytz
@@ -9,6 +10,18 @@ from dataclasses import dataclass
 Base = declarative_base()
 
 
+SEND_STATUS_CASES = ['SENT', 'NOT_SENT', 'FAIL']
+
+# ONE COUNTER SHARED BY ALL VERSIONED TABLES: A CHANGED ROW ALWAYS GETS THE GREATEST VERSION,
+# SO MAX(version) OF A COLLECTION CHANGES WHENEVER ANY OF ITS ROWS DOES (ETAGS, SEE extension.etag)
+ROW_VERSION_SEQ = Sequence('row_version_seq', metadata=Base.metadata)
+
+
+def version_column():
+    return Column(BigInteger, nullable=False, server_default=ROW_VERSION_SEQ.next_value(),
+                  comment='row version, renewed by touch_row_version trigger on every change')
+
+
 @dataclass
 class ModelsConfig:
     datetime_format = '%Y-%m-%d %H:%M'
@@ -16,14 +29,20 @@ class ModelsConfig:
 
 class Distribution(Base, ModelsConfig):
     __tablename__ = 'distributions'
+    __table_args__ = (
+        # DISTRIBUTION MAKER SCHEDULER POLL: NOT DELETED AND NOT FINISHED YET
+        Index('ix_distributions_end_date_active', 'end_date', postgresql_where=text('was_deleted IS NOT TRUE')),
+    )
 
     id = Column(Integer, primary_key=True)
     start_date = Column(DateTime, default=datetime.now(), comment='date when distribution will be started')
     text = Column(String, comment='message text')
+    # PLAIN TAG OR EXPRESSION LIKE "tag:vip AND operator:917 AND tz:Europe/*", SEE db_api.client_filter
     client_filter = Column(String, comment='get some clients with filtering them by mobile operator code, tag or etc.')
     end_date = Column(DateTime, default=datetime.now() + timedelta(hours=1),
                       comment='date when distribution will be ended')
     was_deleted = Column(Boolean, default=False, comment='Shows if this row has been removed')
+    version = version_column()
     # back_populates look to Client class "message" attribute, not to __tablename__
     message = relationship("Message", back_populates="distribution", lazy="dynamic")
 
@@ -39,6 +58,17 @@ class Distribution(Base, ModelsConfig):
 
 class Client(Base, ModelsConfig):
     __tablename__ = 'clients'
+    __table_args__ = (
+        # DISTRIBUTION AUDIENCE
+        Index('ix_clients_tag', 'tag'),
+        # ONE CLIENT PER MOBILE NUMBER: CLIENT CREATE AND IMPORT INSERT ... ON CONFLICT (mobile_number)
+        Index('ix_clients_mobile_number', 'mobile_number', unique=True),
+        # CLIENT FILTER TERMS: operator:917 AND tz:Europe/* (PATTERN OPS SERVE PREFIX LIKE AND EQUALITY)
+        Index('ix_clients_operator_code', 'mobile_operator_code'),
+        Index('ix_clients_timezone_pattern', 'timezone', postgresql_ops={'timezone': 'varchar_pattern_ops'}),
+        # AUDIENCE SNAPSHOT TOP-UP: CLIENTS CREATED OR CHANGED SINCE THE LAST SNAPSHOT
+        Index('ix_clients_updated_at', 'updated_at'),
+    )
 
     id = Column(Integer, primary_key=True)
     # need constrainting length before added into db
@@ -52,6 +82,10 @@ class Client(Base, ModelsConfig):
     # Table with values are there: https://en.wikipedia.org/wiki/List_of_tz_database_time_zones
     timezone = Column(String(30), default="Europe/Moscow", comment='it will be look like "Europe/Moscow"')
     was_deleted = Column(Boolean, default=False, comment='Shows if this row has been removed')
+    # SET BY DATABASE ON INSERT AND BY clients_touch_updated_at TRIGGER ON EVERY UPDATE, WHATEVER WRITES THE ROW
+    updated_at = Column(DateTime, nullable=False, server_default=text('LOCALTIMESTAMP'),
+                        comment='date of the last change, database clock')
+    version = version_column()
     # message = relationship('Association', back_populates="client")
     message = relationship('Message', back_populates="client")
 
@@ -63,6 +97,14 @@ class Client(Base, ModelsConfig):
 
 class Message(Base, ModelsConfig):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # ONE MESSAGE PER CLIENT IN A DISTRIBUTION, ALSO SERVES MESSAGES MATERIALIZATION LOOKUP
+        UniqueConstraint('distribution_id', 'client_id', name='uq_messages_distribution_client'),
+        Index('ix_messages_distribution_status', 'distribution_id', 'send_status'),
+        # SENDER CLAIMS UNSENT MESSAGES OF A DISTRIBUTION IN ID ORDER, SENT ONES ARE THE BULK OF THE TABLE
+        Index('ix_messages_distribution_unsent', 'distribution_id', 'id',
+              postgresql_where=text("send_status IN ('NOT_SENT', 'FAIL')")),
+    )
 
     id = Column(Integer, primary_key=True)
     # one-to-many
@@ -76,6 +118,14 @@ class Message(Base, ModelsConfig):
     send_date = Column(DateTime, nullable=True,
                        comment='date when message was send. If NULL, it mean that message was not send yet')
     send_status = Column(String, default='NOT_SENT')
+    # FAIL with next_attempt_at is retried after that date, FAIL without it is terminal
+    attempts = Column(Integer, default=0, comment='how many times sending was attempted')
+    last_attempt_at = Column(DateTime, nullable=True, comment='date of the last sending attempt')
+    next_attempt_at = Column(DateTime, nullable=True, comment='date when failed message will be retried')
+    # set when a distribution maker worker claims the message for sending, other workers skip it until lease expires
+    lease_owner = Column(String, nullable=True, comment='distribution maker worker which claimed message')
+    lease_expires_at = Column(DateTime, nullable=True, comment='claim is void after this date')
+    version = version_column()
 
     def __repr__(self):
         return f'<Message: id: {self.id}, distribution.id: {self.distribution_id}, client.id: {self.client_id}, ' \
@@ -83,4 +133,136 @@ class Message(Base, ModelsConfig):
                f'send_status: {self.send_status}>'
 
 
-__all__ = ["Distribution", "Client", "Message", "Base"]
\ No newline at end of file
+# CLIENTS.UPDATED_AT IS MAINTAINED BY THE DATABASE, SO RAW SQL AND BULK UPDATES CAN'T FORGET IT
+CLIENTS_UPDATED_AT_TRIGGER = [
+    '''
+    CREATE OR REPLACE FUNCTION clients_touch_updated_at() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.updated_at = LOCALTIMESTAMP;
+        RETURN NEW;
+    END $$''',
+    'DROP TRIGGER IF EXISTS clients_touch_updated_at ON clients',
+    '''
+    CREATE TRIGGER clients_touch_updated_at BEFORE UPDATE ON clients
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION clients_touch_updated_at()''',
+]
+
+for _statement in CLIENTS_UPDATED_AT_TRIGGER:
+    event.listen(Client.__table__, 'after_create', DDL(_statement))
+
+
+# VERSIONS ARE RENEWED BY THE DATABASE TOO, SO SENDER BULK UPDATES AND STATS TRIGGERS CAN'T FORGET THEM
+VERSIONED_TABLES = ['distributions', 'clients', 'messages', 'distribution_stats', 'message_timeseries']
+ROW_VERSION_FUNCTION = '''
+    CREATE OR REPLACE FUNCTION touch_row_version() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.version = nextval('row_version_seq');
+        RETURN NEW;
+    END $$'''
+
+
+def row_version_trigger(table: str):
+    return [
+        f'DROP TRIGGER IF EXISTS {table}_touch_version ON {table}',
+        f'''
+        CREATE TRIGGER {table}_touch_version BEFORE UPDATE ON {table}
+        FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION touch_row_version()''',
+    ]
+
+
+class AudienceSnapshot(Base):
+    """ Watermark of messages materialized for a distribution (one row per timezone window, '' for all timezones) """
+    __tablename__ = 'audience_snapshots'
+
+    distribution_id = Column(Integer, ForeignKey('distributions.id'), primary_key=True)
+    timezone = Column(String(30), primary_key=True, default='')
+    client_filter = Column(String, comment='client_filter the snapshot was made with, other one needs a full snapshot')
+    snapshot_at = Column(DateTime, nullable=False, comment='clients changed after this date are not materialized yet')
+
+    def __repr__(self):
+        return f'<AudienceSnapshot: distribution.id: {self.distribution_id}, timezone: "{self.timezone}", ' \
+               f'snapshot_at: {self.snapshot_at}>'
+
+
+class DistributionStats(Base):
+    """ Messages count per send status of a distribution, maintained by triggers on messages (see db_api.statistic) """
+    __tablename__ = 'distribution_stats'
+
+    distribution_id = Column(Integer, ForeignKey('distributions.id'), primary_key=True)
+    sent_count = Column(Integer, nullable=False, default=0, server_default='0')
+    not_sent_count = Column(Integer, nullable=False, default=0, server_default='0')
+    fail_count = Column(Integer, nullable=False, default=0, server_default='0')
+    version = version_column()
+
+    def __repr__(self):
+        return f'<DistributionStats: distribution.id: {self.distribution_id}, sent: {self.sent_count}, ' \
+               f'not_sent: {self.not_sent_count}, fail: {self.fail_count}>'
+
+
+class MessageTimeseries(Base):
+    """
+    SENT and FAIL messages count of a distribution per minute of their send (or last failed attempt) date,
+    maintained by triggers on messages (see db_api.statistic). Hour and day series are sums of its rows
+    """
+    __tablename__ = 'message_timeseries'
+    __table_args__ = (
+        # GLOBAL SERIES: ALL DISTRIBUTIONS IN A DATE RANGE
+        Index('ix_message_timeseries_bucket', 'bucket'),
+    )
+
+    distribution_id = Column(Integer, ForeignKey('distributions.id'), primary_key=True)
+    bucket = Column(DateTime, primary_key=True, comment='start of the minute')
+    sent_count = Column(Integer, nullable=False, default=0, server_default='0')
+    fail_count = Column(Integer, nullable=False, default=0, server_default='0')
+    version = version_column()
+
+    def __repr__(self):
+        return f'<MessageTimeseries: distribution.id: {self.distribution_id}, bucket: {self.bucket}, ' \
+               f'sent: {self.sent_count}, fail: {self.fail_count}>'
+
+
+for _table in VERSIONED_TABLES:
+    for _statement in [ROW_VERSION_FUNCTION] + row_version_trigger(_table):
+        event.listen(Base.metadata.tables[_table], 'after_create', DDL(_statement))
+
+
+# NOTIFY IS DELIVERED ON COMMIT, SO LISTENERS (DISTRIBUTION MAKER SCHEDULER) ONLY SEE COMMITTED CHANGES
+DISTRIBUTION_NOTIFY_CHANNEL = 'distribution_changed'
+# PAYLOAD IS "ENTITY:ID" OR "ENTITY:*", READ BY EVERY API PROCESS TO DROP ITS CACHED RESPONSES (extension.cache)
+CACHE_NOTIFY_CHANNEL = 'cache_invalidate'
+
+
+def notify_cache(connection, *items: str):
+    for item in items:
+        connection.execute(text('SELECT pg_notify(:channel, :payload)'),
+                           {"channel": CACHE_NOTIFY_CHANNEL, "payload": item})
+
+
+@event.listens_for(Distribution, 'after_insert')
+@event.listens_for(Distribution, 'after_update')
+def notify_distribution_changed(mapper, connection, target):
+    connection.execute(text(f'NOTIFY {DISTRIBUTION_NOTIFY_CHANNEL}'))
+    notify_cache(connection, f'distribution:{target.id}', f'statistic:{target.id}')
+
+
+@event.listens_for(Client, 'after_update')
+@event.listens_for(Client, 'after_delete')
+def notify_client_changed(mapper, connection, target):
+    notify_cache(connection, f'client:{target.id}')
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def notify_bulk_changed(context):
+    """ query.update()/delete() skip per object listeners above, changed ids are unknown here """
+    connection = context.session.connection()
+    if context.mapper.class_ is Distribution:
+        connection.execute(text(f'NOTIFY {DISTRIBUTION_NOTIFY_CHANNEL}'))
+        notify_cache(connection, 'distribution:*', 'statistic:*')
+    elif context.mapper.class_ is Client:
+        notify_cache(connection, 'client:*')
+
+
+__all__ = ["Distribution", "Client", "Message", "DistributionStats", "MessageTimeseries", "AudienceSnapshot", "Base",
+           "SEND_STATUS_CASES", "DISTRIBUTION_NOTIFY_CHANNEL", "CACHE_NOTIFY_CHANNEL", "CLIENTS_UPDATED_AT_TRIGGER", "notify_cache",
+           "ROW_VERSION_SEQ", "VERSIONED_TABLES", "ROW_VERSION_FUNCTION", "row_version_trigger"]
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+Connection pools timing every checkout, to size DB_POOL_SIZE from data (GET /api/v1/metrics/pool).
+
+Checkout wait is the time a session waits for a connection: near zero while the pool has an idle one,
+a connect when it opens a new one, up to DB_POOL_TIMEOUT_SECONDS when all of them are checked out.
+Counters are per process, every gunicorn worker has its own pool.
+"""
+from collections import deque
+from dataclasses import dataclass, field
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+from threading import Lock
+from typing import Deque
+import time
+
+
+# CHECKOUTS WAITING LONGER THAN THIS DIDN'T FIND AN IDLE CONNECTION
+POOL_WAIT_THRESHOLD_MS = 1.0
+POOL_WAIT_SAMPLES = 1000
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    waits: int = 0
+    timeouts: int = 0
+    wait_ms_total: float = 0.0
+    wait_ms_max: float = 0.0
+    peak_checked_out: int = 0
+    samples: Deque[float] = field(default_factory=lambda: deque(maxlen=POOL_WAIT_SAMPLES))
+    lock: Lock = field(default_factory=Lock, repr=False)
+
+    def record(self, wait_ms: float, checked_out: int, timed_out: bool = False):
+        with self.lock:
+            self.checkouts += not timed_out
+            self.timeouts += timed_out
+            self.waits += wait_ms >= POOL_WAIT_THRESHOLD_MS
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+            self.samples.append(wait_ms)
+
+    def reset(self):
+        with self.lock:
+            self.checkouts = self.waits = self.timeouts = self.peak_checked_out = 0
+            self.wait_ms_total = self.wait_ms_max = 0.0
+            self.samples.clear()
+
+    def percentile(self, q: float) -> float:
+        """ Checkout wait percentile of the last POOL_WAIT_SAMPLES checkouts """
+        with self.lock:
+            samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
+
+
+pool_stats = PoolStats()
+
+
+class TimedPoolMixin:
+    """ Records wait time of every connection checkout in pool_stats """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record((time.perf_counter() - started) * 1000, self.checked_out(), timed_out=True)
+            raise
+        pool_stats.record((time.perf_counter() - started) * 1000, self.checked_out())
+        return connection
+
+    def checked_out(self) -> int:
+        return 0
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    def checked_out(self) -> int:
+        return self.checkedout()
+
+
+class TimedNullPool(TimedPoolMixin, NullPool):
+    """ A new connection per checkout, for PgBouncer which pools connections itself """
+
+
+def pool_metrics(engine) -> dict:
+    pool = engine.pool
+    metrics = {"pool": type(pool).__name__, "checkouts": pool_stats.checkouts, "waits": pool_stats.waits,
+               "timeouts": pool_stats.timeouts,
+               "wait_ms_avg": pool_stats.wait_ms_total / max(pool_stats.checkouts + pool_stats.timeouts, 1),
+               "wait_ms_p50": pool_stats.percentile(0.5), "wait_ms_p99": pool_stats.percentile(0.99),
+               "wait_ms_max": pool_stats.wait_ms_max, "peak_checked_out": pool_stats.peak_checked_out}
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        metrics.update(size=pool.size(), max_overflow=pool._max_overflow, checked_out=pool.checkedout(),
+                       idle=pool.checkedin(), saturation=pool.checkedout() / capacity if capacity else 0.0,
+                       peak_saturation=pool_stats.peak_checked_out / capacity if capacity else 0.0)
+    return metrics
+
+
+__all__ = ['PoolStats', 'pool_stats', 'TimedQueuePool', 'TimedNullPool', 'pool_metrics']
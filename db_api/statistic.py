@@ -0,0 +1,229 @@
+from sqlalchemy import DDL, event, func, text
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+# CURRENT PROJECT MODULES
+from db_api.models import Distribution, DistributionStats, Message, MessageTimeseries, SEND_STATUS_CASES, \
+    CACHE_NOTIFY_CHANNEL
+
+
+def status_count_column(status: str) -> str:
+    return f'{status.lower()}_count'
+
+
+# DISTRIBUTION_STATS IS KEPT UP TO DATE BY STATEMENT LEVEL TRIGGERS ON MESSAGES:
+# EVERY INSERT/UPDATE/DELETE STATEMENT APPLIES ONE AGGREGATED DELTA PER DISTRIBUTION IT TOUCHED,
+# SO BULK STATEMENTS OF THE DISTRIBUTION MAKER COST ONE UPSERT PER DISTRIBUTION, NOT PER MESSAGE.
+# UPDATES WHICH DON'T CHANGE SEND_STATUS (E.G. LEASES) DON'T TOUCH DISTRIBUTION_STATS AT ALL.
+# ROWS ARE UPSERTED IN DISTRIBUTION ID ORDER SO CONCURRENT WORKERS LOCK THEM IN THE SAME ORDER.
+# CACHED STATISTIC OF EVERY TOUCHED DISTRIBUTION IS INVALIDATED BY NOTIFY (DEDUPLICATED BY POSTGRES PER TRANSACTION).
+_DELTA_SELECTS = {
+    'insert': 'SELECT distribution_id, send_status, 1 AS n FROM new_rows',
+    'delete': 'SELECT distribution_id, send_status, -1 AS n FROM old_rows',
+    'update': '''
+        SELECT new_rows.distribution_id, new_rows.send_status, 1 AS n
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE new_rows.send_status IS DISTINCT FROM old_rows.send_status
+           OR new_rows.distribution_id IS DISTINCT FROM old_rows.distribution_id
+        UNION ALL
+        SELECT old_rows.distribution_id, old_rows.send_status, -1 AS n
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE new_rows.send_status IS DISTINCT FROM old_rows.send_status
+           OR new_rows.distribution_id IS DISTINCT FROM old_rows.distribution_id''',
+}
+_TRANSITION_TABLES = {
+    'insert': 'REFERENCING NEW TABLE AS new_rows',
+    'delete': 'REFERENCING OLD TABLE AS old_rows',
+    'update': 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+}
+
+
+def _trigger_ddl(op: str) -> List[str]:
+    columns = [status_count_column(status) for status in SEND_STATUS_CASES]
+    sums = ',\n'.join(f"COALESCE(SUM(n) FILTER (WHERE send_status = '{status}'), 0)" for status in SEND_STATUS_CASES)
+    updates = ', '.join(f'{column} = stats.{column} + EXCLUDED.{column}' for column in columns)
+    return [
+        f'''
+        CREATE OR REPLACE FUNCTION distribution_stats_on_{op}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO distribution_stats AS stats (distribution_id, {', '.join(columns)})
+            SELECT distribution_id, {sums}
+            FROM ({_DELTA_SELECTS[op]}) delta
+            WHERE distribution_id IS NOT NULL
+            GROUP BY distribution_id
+            ORDER BY distribution_id
+            ON CONFLICT (distribution_id) DO UPDATE SET {updates};
+            PERFORM pg_notify('{CACHE_NOTIFY_CHANNEL}', 'statistic:' || distribution_id)
+            FROM (SELECT DISTINCT distribution_id FROM ({_DELTA_SELECTS[op]}) delta) touched
+            WHERE distribution_id IS NOT NULL;
+            RETURN NULL;
+        END $$''',
+        f'DROP TRIGGER IF EXISTS distribution_stats_on_{op} ON messages',
+        f'''
+        CREATE TRIGGER distribution_stats_on_{op} AFTER {op.upper()} ON messages
+        {_TRANSITION_TABLES[op]} FOR EACH STATEMENT EXECUTE FUNCTION distribution_stats_on_{op}()''',
+    ]
+
+
+DISTRIBUTION_STATS_TRIGGERS = [statement for op in _DELTA_SELECTS for statement in _trigger_ddl(op)]
+
+for _statement in DISTRIBUTION_STATS_TRIGGERS:
+    event.listen(Message.__table__, 'after_create', DDL(_statement))
+
+
+def install_distribution_stats_triggers(connection):
+    for statement in DISTRIBUTION_STATS_TRIGGERS:
+        connection.execute(text(statement))
+
+
+# MESSAGE_TIMESERIES COUNTS SEND ATTEMPTS, NOT MESSAGE STATES: AN ATTEMPT IS ONE SENT OR FAIL EVENT IN THE MINUTE
+# IT WAS MADE IN (last_attempt_at), A RETRY ADDS ITS OWN EVENT AND NEVER MOVES EARLIER ONES, SO CLOSED MINUTES
+# DON'T CHANGE AND THEIR FAIL RATE IS STABLE. A MESSAGE STANDS FOR 1 SENT EVENT IF IT IS SENT AND attempts - 1
+# FAILED ONES (attempts IF IT ISN'T SENT, AT LEAST 1 IF IT IS FAILED). STATEMENT LEVEL TRIGGERS ADD THE CHANGE
+# OF THESE COUNTS TO THE MINUTE OF THE ROW'S LAST ATTEMPT, ONE AGGREGATED DELTA PER (DISTRIBUTION, MINUTE).
+# ONLY MANUAL EDITS AND DELETES OF ATTEMPTED MESSAGES TAKE EVENTS BACK. NOT ATTEMPTED MESSAGES AREN'T COUNTED.
+TIMESERIES_STATUSES = ['SENT', 'FAIL']
+TIMESERIES_BUCKETS = {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+
+
+def _event_minute(rows: str) -> str:
+    return f"date_trunc('minute', COALESCE({rows}.last_attempt_at, {rows}.send_date))"
+
+
+def _sent_events(rows: str) -> str:
+    return f"({rows}.send_status IS NOT DISTINCT FROM 'SENT')::int"
+
+
+def _fail_events(rows: str) -> str:
+    failed = f"({rows}.send_status IS NOT DISTINCT FROM 'FAIL')::int"
+    return f'GREATEST(COALESCE({rows}.attempts, 0) - {_sent_events(rows)}, {failed})'
+
+
+def _events(rows: str, sign: str = '') -> str:
+    return f'{sign}{_sent_events(rows)} AS sent, {sign}{_fail_events(rows)} AS fail'
+
+
+_TIMESERIES_DELTA_SELECTS = {
+    'insert': f'SELECT distribution_id, {_event_minute("new_rows")} AS bucket, {_events("new_rows")} FROM new_rows',
+    'delete': f'SELECT distribution_id, {_event_minute("old_rows")} AS bucket, {_events("old_rows", "-")} FROM old_rows',
+    # EVENTS ADDED BY AN ATTEMPT GO TO ITS MINUTE, A MESSAGE MOVED TO ANOTHER DISTRIBUTION TAKES ALL ITS EVENTS ALONG
+    'update': f'''
+        SELECT new_rows.distribution_id, COALESCE({_event_minute("new_rows")}, {_event_minute("old_rows")}) AS bucket,
+               {_sent_events("new_rows")} - {_sent_events("old_rows")} AS sent,
+               {_fail_events("new_rows")} - {_fail_events("old_rows")} AS fail
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE new_rows.distribution_id IS NOT DISTINCT FROM old_rows.distribution_id
+          AND (new_rows.send_status, new_rows.attempts) IS DISTINCT FROM (old_rows.send_status, old_rows.attempts)
+        UNION ALL
+        SELECT new_rows.distribution_id, {_event_minute("new_rows")} AS bucket, {_events("new_rows")}
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE new_rows.distribution_id IS DISTINCT FROM old_rows.distribution_id
+        UNION ALL
+        SELECT old_rows.distribution_id, {_event_minute("old_rows")} AS bucket, {_events("old_rows", "-")}
+        FROM new_rows JOIN old_rows USING (id)
+        WHERE new_rows.distribution_id IS DISTINCT FROM old_rows.distribution_id''',
+}
+
+
+def _timeseries_trigger_ddl(op: str) -> List[str]:
+    return [
+        f'''
+        CREATE OR REPLACE FUNCTION message_timeseries_on_{op}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO message_timeseries AS ts (distribution_id, bucket, sent_count, fail_count)
+            SELECT distribution_id, bucket, SUM(sent), SUM(fail)
+            FROM ({_TIMESERIES_DELTA_SELECTS[op]}) delta
+            WHERE distribution_id IS NOT NULL AND bucket IS NOT NULL
+            GROUP BY distribution_id, bucket
+            HAVING SUM(sent) <> 0 OR SUM(fail) <> 0
+            ORDER BY distribution_id, bucket
+            ON CONFLICT (distribution_id, bucket) DO UPDATE
+            SET sent_count = ts.sent_count + EXCLUDED.sent_count, fail_count = ts.fail_count + EXCLUDED.fail_count;
+            RETURN NULL;
+        END $$''',
+        f'DROP TRIGGER IF EXISTS message_timeseries_on_{op} ON messages',
+        f'''
+        CREATE TRIGGER message_timeseries_on_{op} AFTER {op.upper()} ON messages
+        {_TRANSITION_TABLES[op]} FOR EACH STATEMENT EXECUTE FUNCTION message_timeseries_on_{op}()''',
+    ]
+
+
+MESSAGE_TIMESERIES_TRIGGERS = [statement for op in _TIMESERIES_DELTA_SELECTS for statement in _timeseries_trigger_ddl(op)]
+
+for _statement in MESSAGE_TIMESERIES_TRIGGERS:
+    event.listen(Message.__table__, 'after_create', DDL(_statement))
+
+# THE WHOLE ROLLUP AGGREGATED FROM MESSAGES, FOR BACKFILL AND REBUILD. A MESSAGE KEEPS ONLY ITS LAST ATTEMPT DATE,
+# SO HERE ALL ITS FAILED ATTEMPTS FALL INTO THAT MINUTE: TOTALS PER DISTRIBUTION ARE EXACT, EARLIER MINUTES ARE NOT
+MESSAGE_TIMESERIES_ROLLUP = f'''
+    SELECT distribution_id, {_event_minute("messages")} AS bucket,
+           SUM({_sent_events("messages")}) AS sent_count, SUM({_fail_events("messages")}) AS fail_count
+    FROM messages
+    WHERE distribution_id IS NOT NULL AND {_event_minute("messages")} IS NOT NULL
+    GROUP BY 1, 2
+    HAVING SUM({_sent_events("messages")}) + SUM({_fail_events("messages")}) > 0'''
+
+
+def install_message_timeseries_triggers(connection):
+    for statement in MESSAGE_TIMESERIES_TRIGGERS:
+        connection.execute(text(statement))
+
+
+def bucket_floor(date: datetime, bucket: str) -> datetime:
+    """ Start of the minute, hour or day the date is in, as date_trunc() """
+    date = date.replace(second=0, microsecond=0)
+    if bucket in ('hour', 'day'):
+        date = date.replace(minute=0)
+    return date.replace(hour=0) if bucket == 'day' else date
+
+
+def message_timeseries(session, bucket: str, start: datetime, end: datetime,
+                       distribution_id: Optional[int] = None) -> List:
+    """
+    Rows (bucket_start, SENT, FAIL attempts, version) of non empty buckets from start (bucket aligned) to end (exclusive),
+    summed from message_timeseries minutes of one distribution or of all of them.
+    version is the greatest rollup row version in a bucket, rollup rows are never deleted
+    """
+    bucket_start = func.date_trunc(bucket, MessageTimeseries.bucket).label('bucket_start')
+    query = session.query(bucket_start,
+                          *[func.sum(getattr(MessageTimeseries, status_count_column(status))).label(status)
+                            for status in TIMESERIES_STATUSES],
+                          func.max(MessageTimeseries.version).label('version')) \
+        .filter(MessageTimeseries.bucket >= start, MessageTimeseries.bucket < end)
+    if distribution_id is not None:
+        query = query.filter(MessageTimeseries.distribution_id == distribution_id)
+    return query.group_by(bucket_start).order_by(bucket_start).all()
+
+
+def live_distribution_stats(session) -> Dict[int, Dict[str, int]]:
+    """ Messages count per status of every distribution, aggregated from messages table """
+    status_counts = [func.count().filter(Message.send_status == status).label(status) for status in SEND_STATUS_CASES]
+    rows = session.query(Message.distribution_id, *status_counts) \
+        .filter(Message.distribution_id.isnot(None)) \
+        .group_by(Message.distribution_id) \
+        .all()
+    return {row.distribution_id: {status: getattr(row, status) for status in SEND_STATUS_CASES} for row in rows}
+
+
+def stats_to_counts(stats: DistributionStats) -> Dict[str, int]:
+    counts = {status: getattr(stats, status_count_column(status)) if stats else 0 for status in SEND_STATUS_CASES}
+    counts['total'] = sum(counts.values())
+    return counts
+
+
+def distribution_statistic(session, **filters) -> List[Tuple[Distribution, Dict[str, int]]]:
+    """
+    Distributions matching filters (filter_by kwargs) with their message count per send status.
+    Counts are read from distribution_stats rollup, so the cost doesn't depend on messages count.
+    counts['version'] is the rollup row version (0 without messages), it changes with any of the counts
+    """
+    rows = session.query(Distribution, DistributionStats) \
+        .filter_by(**filters) \
+        .outerjoin(DistributionStats, DistributionStats.distribution_id == Distribution.id) \
+        .order_by(Distribution.id) \
+        .all()
+    return [(distr, dict(stats_to_counts(stats), version=stats.version if stats else 0)) for distr, stats in rows]
+
+
+__all__ = ['distribution_statistic', 'live_distribution_stats', 'install_distribution_stats_triggers',
+           'status_count_column', 'message_timeseries', 'bucket_floor', 'install_message_timeseries_triggers',
+           'TIMESERIES_STATUSES', 'TIMESERIES_BUCKETS', 'MESSAGE_TIMESERIES_ROLLUP']
@@ -0,0 +1,81 @@
+"""
+Reconciliation of distribution_stats and message_timeseries rollups with messages table.
+
+    python -m db_api.stats_reconcile verify    # compare rollups with live counts, exit code 1 on mismatch
+    python -m db_api.stats_reconcile rebuild   # (re)install triggers and rebuild rollups from scratch, then verify
+
+Rebuild locks messages against writes while it runs, so stop the distribution maker for large tables.
+"""
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+import argparse
+import sys
+# CURRENT PROJECT MODULES
+from db_api import SessionLocal, DistributionStats, MessageTimeseries, SEND_STATUS_CASES, TIMESERIES_STATUSES
+from db_api import install_distribution_stats_triggers, live_distribution_stats, status_count_column
+from db_api import install_message_timeseries_triggers, MESSAGE_TIMESERIES_ROLLUP
+
+
+def rebuild(session):
+    session.execute(text('LOCK TABLE messages IN SHARE MODE'))
+    install_distribution_stats_triggers(session.connection())
+    session.query(DistributionStats).delete(synchronize_session=False)
+    live = live_distribution_stats(session)
+    if live:
+        session.execute(insert(DistributionStats), [
+            {"distribution_id": distribution_id,
+             **{status_count_column(status): counts[status] for status in SEND_STATUS_CASES}}
+            for distribution_id, counts in live.items()
+        ])
+    install_message_timeseries_triggers(session.connection())
+    session.query(MessageTimeseries).delete(synchronize_session=False)
+    buckets = session.execute(text(f'INSERT INTO message_timeseries (distribution_id, bucket, sent_count, fail_count) '
+                                   f'{MESSAGE_TIMESERIES_ROLLUP}')).rowcount
+    session.commit()
+    print(f'distribution_stats rebuilt for {len(live)} distributions, message_timeseries for {buckets} minutes')
+
+
+def verify(session) -> bool:
+    live = live_distribution_stats(session)
+    rollup = {
+        stats.distribution_id: {status: getattr(stats, status_count_column(status)) for status in SEND_STATUS_CASES}
+        for stats in session.query(DistributionStats).all()
+    }
+    empty = {status: 0 for status in SEND_STATUS_CASES}
+    mismatched = [distribution_id for distribution_id in sorted(live.keys() | rollup.keys())
+                  if live.get(distribution_id, empty) != rollup.get(distribution_id, empty)]
+    for distribution_id in mismatched:
+        print(f'distribution {distribution_id}: rollup {rollup.get(distribution_id, empty)}, '
+              f'live {live.get(distribution_id, empty)}')
+    print(f'{len(mismatched)} mismatched distributions out of {len(live)}')
+    timeseries_ok = verify_timeseries(session)
+    return not mismatched and timeseries_ok
+
+
+def verify_timeseries(session) -> bool:
+    """ Compare totals per distribution: messages keep only their last attempt, not the minutes of earlier ones """
+    columns = [status_count_column(status) for status in TIMESERIES_STATUSES]
+    totals = ', '.join(f'SUM({column}) AS {column}' for column in columns)
+    live = {row.distribution_id: tuple(getattr(row, column) for column in columns)
+            for row in session.execute(text(f'SELECT distribution_id, {totals} '
+                                            f'FROM ({MESSAGE_TIMESERIES_ROLLUP}) live GROUP BY 1'))}
+    # DISTRIBUTIONS WHOSE MESSAGES ALL MOVED AWAY KEEP THEIR ROWS WITH ZERO COUNTS
+    rollup = {row.distribution_id: tuple(getattr(row, column) for column in columns)
+              for row in session.execute(text(f'SELECT distribution_id, {totals} FROM message_timeseries GROUP BY 1'))
+              if any(getattr(row, column) for column in columns)}
+    mismatched = sorted(key for key in live.keys() | rollup.keys() if live.get(key) != rollup.get(key))
+    for distribution_id in mismatched:
+        print(f'distribution {distribution_id} timeseries: rollup {rollup.get(distribution_id)}, '
+              f'live {live.get(distribution_id)}')
+    print(f'{len(mismatched)} mismatched timeseries out of {len(live)}')
+    return not mismatched
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Verify or rebuild distribution_stats and message_timeseries rollups')
+    parser.add_argument('command', choices=['verify', 'rebuild'])
+    args = parser.parse_args()
+    session = SessionLocal()
+    if args.command == 'rebuild':
+        rebuild(session)
+    sys.exit(0 if verify(session) else 1)
@@ -1,54 +1,123 @@
-from sqlalchemy.orm import scoped_session
 from datetime import datetime
-import requests as req
-import time
 from loguru import logger
 from pathlib import Path
+import signal
+import sys
 import os
 # CURRENT PROJECT IMPORTS
-from db_api import SessionLocal
-from db_api import Distribution, Client, Message
+from db_api import db_session, engine
+from db_api import Distribution
+from db_api import audience_size, ClientFilterError
+from sender import Dispatcher, SendJob, WriteBackBuffer, DistributionScheduler, DistributionListener
+from sender import CircuitBreaker, WORKER_ID, BatchLease, iter_claimed_batches, is_retryable, next_attempt_at
+from sender import snapshot_audience, latest_client_change, next_claim_at, claim_batch_size
+
+# HOW OFTEN ACTIVE DISTRIBUTIONS ARE RESCANNED FOR NEW CLIENTS AND FAILED MESSAGES
+SEND_TICK_SECONDS = float(os.getenv('SEND_TICK_SECONDS', 30))
+# UPPER BOUND OF IDLE SLEEP IN CASE A NOTIFICATION IS MISSED
+SCHEDULER_MAX_SLEEP_SECONDS = float(os.getenv('SCHEDULER_MAX_SLEEP_SECONDS', 3600))
 
 
 def main():
     logger.add('./logs/run.log', format="{time: %Y-%m-%d %H:%M:%S} - {level} - {message}", level="INFO")
     TOKEN = os.getenv('JWT_TOKEN')
-    db_session = scoped_session(SessionLocal)
-    send_status_cases = ['SENT', 'NOT_SENT', 'FAIL']
-    s = req.session()
-    s.headers.update({"ContentType": "application/json", "Authorization": TOKEN})
-    while True:
-        distrs = db_session.query(Distribution).filter(Distribution.end_date >= datetime.now()).all()
-        if distrs:
-            for distr in distrs:
-                clients = db_session.query(Client).filter_by(tag=distr.client_filter).all()
-                for client in clients:
-                    msg = db_session.query(Message).filter_by(distribution_id=distr.id, client_id=client.id).first()
-                    if msg is None:
-                        msg = Message(distribution_id=distr.id, client_id=client.id)
-                        db_session.add(msg)
-                        db_session.flush()
-                    elif msg.send_status == 'SENT':
-                        continue
-                    payload = {
-                        "id": msg.id,
-                        "phone": client.mobile_number,
-                        "text": distr.text
-                    }
-                    r = s.post(url=f'https://probe.fbrq.cloud/v1/send/{msg.id}', json=payload)
-                    if r.status_code == 200:
-                        msg.send_status = "SENT"
-                        msg.send_date = datetime.now()
-                        logger.info(f'MESSAGE - {msg} was SENT to CLIENT - {client} within DISTRIBUTION {distr}')
-                        logger.info(f'CLIENT - {client} receive MESSAGE - {msg}')
-                        logger.info(f"DISTRIBUTION'S - {distr} MESSAGE - {msg} was SENT")
-                    else:
-                        msg.send_status = "FAIL"
-                        logger.info(f'MESSAGE - {msg} SENDING IS FAILED')
-                    db_session.commit()
-        print('Up to date', datetime.now().strftime('%Y-%m-%d %H:%M'), flush=True)
-        time.sleep(30)
+    # ONLY FAILURES WORTH RETRYING SAY SOMETHING ABOUT UPSTREAM HEALTH
+    dispatcher = Dispatcher(TOKEN, breaker=CircuitBreaker(is_failure=is_retryable))
+    # A RATE LIMITED BATCH IS SENT SLOWLY: CLAIM NO MORE THAN FITS INTO THE LEASE, RENEWALS COVER THE REST
+    batch_size = claim_batch_size(dispatcher.rate_limit)
+    writeback = WriteBackBuffer(db_session)
+    listener = DistributionListener(engine)
+    scheduler = DistributionScheduler(db_session)
+    scheduler.refresh()
+    clients_changed_at = latest_client_change(db_session)
+    logger.info(f'DISTRIBUTION MAKER WORKER {WORKER_ID} started, claims batches of {batch_size} messages')
+    try:
+        while True:
+            # NEW OR CHANGED CLIENTS MAY JOIN AUDIENCES (OR TIMEZONES) OF ALREADY DRAINED WINDOWS
+            changed_at = latest_client_change(db_session)
+            db_session.commit()
+            if changed_at != clients_changed_at:
+                clients_changed_at = changed_at
+                scheduler.refresh()
+            windows = scheduler.due()
+            for window in windows:
+                if dispatcher.circuit_open:
+                    break
+                distr = db_session.get(Distribution, window.distribution_id)
+                try:
+                    created = snapshot_audience(db_session, distr, window.timezone)
+                except ClientFilterError as err:
+                    # FILTERS SAVED BEFORE VALIDATION EXISTED MAY BE BROKEN, DON'T LET THEM STOP OTHER DISTRIBUTIONS
+                    db_session.rollback()
+                    logger.error(f'DISTRIBUTION {distr} is SKIPPED, invalid client filter: {err}')
+                    scheduler.sleep(window)
+                    continue
+                db_session.commit()
+                if created:
+                    logger.info(f'{created} MESSAGES were CREATED within DISTRIBUTION {distr}, '
+                                f'audience {audience_size(db_session, distr.client_filter)} clients')
+                # ONLY MAIN THREAD TOUCHES DB SESSION, DISPATCHER THREADS DO HTTP ONLY
+                for batch in iter_claimed_batches(db_session, distr, window.timezone, batch_size=batch_size):
+                    lease = BatchLease(db_session, batch)
+                    # JOBS ARE SUBMITTED LAZILY, ONES WHOSE LEASE WAS LOST MEANWHILE ARE LEFT TO THE NEW OWNER
+                    jobs = (SendJob(msg_id=row.id, phone=row.mobile_number, text=distr.text, attempt=row.attempts + 1,
+                                    distribution_id=distr.id)
+                            for row in batch if lease.owns(row.id))
+                    for result in dispatcher.send(jobs):
+                        msg_id, phone, attempt = result.job.msg_id, result.job.phone, result.job.attempt
+                        lease.finish(msg_id)
+                        now = datetime.now()
+                        if result.skipped:
+                            writeback.release(msg_id)
+                        elif result.ok:
+                            writeback.add(msg_id, "SENT", now, send_date=now)
+                            logger.info(f'MESSAGE - {msg_id} was SENT to CLIENT - {phone} within DISTRIBUTION {distr}')
+                        else:
+                            retry_at = next_attempt_at(result, attempt, now)
+                            writeback.add(msg_id, "FAIL", now, next_attempt_at=retry_at)
+                            retry = f'RETRY AT {retry_at:%Y-%m-%d %H:%M:%S}' if retry_at else 'NO MORE RETRIES'
+                            logger.info(f'MESSAGE - {msg_id} SENDING IS FAILED (attempt {attempt}): '
+                                        f'{result.error or result.status_code}, {retry}')
+                        lease.keep_alive()
+                    # OUTCOMES ARE WRITTEN WHILE THE BATCH LEASES ARE STILL KEPT ALIVE
+                    writeback.flush()
+                    if lease.lost:
+                        logger.warning(f'{len(lease.lost)} MESSAGES of DISTRIBUTION {distr} were TAKEN OVER by other '
+                                       f'workers, this worker was stalled longer than the lease')
+                    if dispatcher.circuit_open:
+                        logger.warning(f'SEND API is UNHEALTHY, DISTRIBUTION {distr} is PAUSED')
+                        break
+                if dispatcher.circuit_open:
+                    continue
+                # STATUSES MUST BE WRITTEN BEFORE ASKING WHAT IS LEFT TO SEND
+                writeback.flush()
+                wake_at = next_claim_at(db_session, distr, window.timezone)
+                db_session.commit()
+                if wake_at is None or wake_at > datetime.now():
+                    scheduler.sleep(window, wake_at)
+            if windows:
+                writeback.flush()
+                stats = writeback.stats
+                logger.info(f'WRITE-BACK: {stats.flushes} flushes, {stats.rows_flushed} rows, '
+                            f'{stats.avg_rows_per_flush:.0f} rows/flush, last {stats.last_flush_ms:.1f} ms, '
+                            f'max {stats.max_flush_ms:.1f} ms, buffered {len(writeback)}, '
+                            f'leases lost {stats.leases_lost}')
+            print('Up to date', datetime.now().strftime('%Y-%m-%d %H:%M'), flush=True)
+            # SLEEP UNTIL NEXT WINDOW STARTS OR ENDS, NEXT TICK OF ACTIVE ONES OR A DISTRIBUTION CHANGE.
+            # DRAINED ACTIVE WINDOWS ONLY NEED THE CHEAP CLIENT CHANGE CHECK ON EVERY TICK
+            timeout = SEND_TICK_SECONDS if scheduler.active else SCHEDULER_MAX_SLEEP_SECONDS
+            wakeup = scheduler.next_wakeup()
+            if wakeup is not None:
+                timeout = max(0.0, min(timeout, (wakeup - datetime.now()).total_seconds()))
+            if listener.wait(timeout):
+                scheduler.refresh()
+    finally:
+        writeback.close()
+        dispatcher.close()
+        listener.close()
 
 
 if __name__ == '__main__':
+    # DOCKER STOPS CONTAINER WITH SIGTERM: EXIT THROUGH FINALLY SO BUFFERED STATUSES ARE FLUSHED
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
     main()
@@ -1,84 +1,117 @@
-from flask import Flask, _app_ctx_stack
-from sqlalchemy.orm import scoped_session
+from flask import Flask
 import pytz
 import secrets
 from flask_mail import Mail
-from flask_mail import Message as FlaskMessage
 from flask_apscheduler import APScheduler
 from flask_admin import Admin
-import requests as req
 import os
 from flask_loguru import Logger
 from distutils.util import strtobool
+from loguru import logger
 # CURRENT PROJECT MODULES
-from db_api import Base, SessionLocal, engine
+from db_api import db_session, engine
+from db_api import LeaderLock
+from db_api.migrate import upgrade_database
 from db_api import Distribution, Client, Message
 from class_based_views import doc_blueprint
+from extension import entity_cache
 from admin import DistributionView, ClientView, MessageView
-
-# CREATE FLASK APP
-app = Flask(__name__)
-app.session = scoped_session(SessionLocal, scopefunc=_app_ctx_stack)
-
-# SETUP LOGGER
-log = Logger()
-
-log.init_app(app, config={
-    "LOG_PATH": "./logs",
-    "LOG_NAME": "run.log",
-    "LOG_FORMAT": '{time: %Y-%m-%d %H:%M:%S} - {level} - {message}',
-    "LOG_SERIALIZE": False
-})
-
-# CREATE SWAGGER DOCS
-app.register_blueprint(doc_blueprint)
-
-# set optional bootswatch theme
-# app.config['FLASK_ADMIN_SWATCH'] = 'cosmo'
-
-# CREATE ADMIN DASHBOARD
-admin = Admin(app, name='Distribution Manage', template_mode='bootstrap4')
-
-# Add administrative views here
-admin.add_view(DistributionView(Distribution, app.session))
-admin.add_view(ClientView(Client, app.session))
-admin.add_view(MessageView(Message, app.session))
-
-# APP CONFIG
-app.config['RESTX_MASK_SWAGGER'] = False
-app.config['SECRET_KEY'] = secrets.token_hex(16)
-app.config['DEBUG'] = bool(strtobool(os.getenv('DEBUG')))
-
-# FLASK-MAIL CONFIG
-app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
-app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
-app.config['MAIL_SERVER'] = 'smtp.mail.ru' if '@mail.ru' in app.config['MAIL_USERNAME'] else 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 25 if '@mail.ru' in app.config['MAIL_USERNAME'] else 587
-app.config['MAIL_USE_TLS'] = True
-
-# CREATE MAIL INSTANCE
-mail = Mail(app)
-
-# CREATE SCHEDULER INSTANCE
-scheduler = APScheduler()
-
-# CREATE TABLES
-Base.metadata.create_all(bind=engine)
-
-
-def send_email():
-    r = req.get(url='http://127.0.0.1:5000/api/v1/statistic/all')
-    with app.app_context():
-        subject = 'Distribution Statistic'
-        sender = app.config['MAIL_USERNAME']
-        recipients = [os.getenv('RECIPIENT_MAIL')]
-        msg = FlaskMessage(subject=subject, sender=sender, recipients=recipients)
-        msg.body = r.text
-        mail.send(msg)
+from mailing import mail_outbox, statistic_report_message
+
+# FIRST KEY OF TWO-KEY ADVISORY LOCKS, SEE ALSO db_api.migrate
+SCHEDULER_LEADER_LOCK_KEY = 4
+STATISTIC_REPORT_INTERVAL_HOURS = float(os.getenv('STATISTIC_REPORT_INTERVAL_HOURS', 24))
+
+
+def create_app() -> Flask:
+    """ API and admin dashboard app. Database schema is expected to be migrated already (upgrade_database) """
+    # CREATE FLASK APP
+    app = Flask(__name__)
+    # SESSION REGISTRY SHARED WITH API VIEWS
+    app.session = db_session
+
+    # SETUP LOGGER
+    log = Logger()
+
+    log.init_app(app, config={
+        "LOG_PATH": "./logs",
+        "LOG_NAME": "run.log",
+        "LOG_FORMAT": '{time: %Y-%m-%d %H:%M:%S} - {level} - {message}',
+        "LOG_SERIALIZE": False
+    })
+
+    # CREATE SWAGGER DOCS
+    app.register_blueprint(doc_blueprint)
+
+    # set optional bootswatch theme
+    # app.config['FLASK_ADMIN_SWATCH'] = 'cosmo'
+
+    # CREATE ADMIN DASHBOARD
+    admin = Admin(app, name='Distribution Manage', template_mode='bootstrap4')
+
+    # Add administrative views here
+    admin.add_view(DistributionView(Distribution, app.session))
+    admin.add_view(ClientView(Client, app.session))
+    admin.add_view(MessageView(Message, app.session))
+
+    # APP CONFIG
+    app.config['RESTX_MASK_SWAGGER'] = False
+    # ALL WORKERS MUST SIGN SESSION COOKIES WITH THE SAME KEY, gunicorn.conf.py SHARES ONE IF IT ISN'T SET
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY') or secrets.token_hex(16)
+    app.config['DEBUG'] = bool(strtobool(os.getenv('DEBUG')))
+
+    # FLASK-MAIL CONFIG
+    app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
+    app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
+    # SERVER IS GUESSED FROM MAIL_USERNAME UNLESS SET, E.G. MAIL_SERVER=localhost MAIL_PORT=8025 MAIL_USE_TLS=False
+    # FOR A LOCAL SMTP STUB: python -m aiosmtpd -n -l localhost:8025
+    app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER') or \
+        ('smtp.mail.ru' if '@mail.ru' in app.config['MAIL_USERNAME'] else 'smtp.gmail.com')
+    app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT') or (25 if '@mail.ru' in app.config['MAIL_USERNAME'] else 587))
+    app.config['MAIL_USE_TLS'] = bool(strtobool(os.getenv('MAIL_USE_TLS') or 'True'))
+
+    # CREATE MAIL INSTANCE, MAILS ARE SENT BY BACKGROUND OUTBOX WORKER
+    app.mail = Mail(app)
+    mail_outbox.init_app(app)
+
+    # A SESSION LEFT OPEN HOLDS ITS POOLED CONNECTION (IDLE IN TRANSACTION) UNTIL THE NEXT REQUEST OF ITS THREAD
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        db_session.remove()
+
+    # DROP CACHED RESPONSES CHANGED BY OTHER PROCESSES (DISTRIBUTION MAKER, OTHER WORKERS)
+    entity_cache.listen(engine)
+    return app
+
+
+def send_email(app: Flask, leader: LeaderLock):
+    """ Queue the daily statistic report, it is built from the database and sent by the mail outbox worker """
+    # EVERY SCHEDULER PROCESS RUNS THE JOB, ONLY THE ONE HOLDING THE LEADER LOCK SENDS
+    if not leader.acquire():
+        logger.info('STATISTIC REPORT is SKIPPED, another scheduler holds the leader lock')
+        return
+    recipients = [address.strip() for address in os.getenv('RECIPIENT_MAIL', '').split(',') if address.strip()]
+    mail_outbox.submit('statistic report',
+                       lambda: statistic_report_message(app.config['MAIL_USERNAME'], recipients))
+
+
+def start_scheduler(app: Flask) -> APScheduler:
+    """ Background scheduler of periodic jobs, run it in one process (report_scheduler_app.py), not in API workers """
+    leader = LeaderLock(engine, SCHEDULER_LEADER_LOCK_KEY)
+    leader.acquire()
+    scheduler = APScheduler()
+    scheduler.init_app(app)
+    scheduler.add_job(id='Scheduled Task', func=send_email, args=(app, leader), trigger="interval",
+                      hours=STATISTIC_REPORT_INTERVAL_HOURS)
+    scheduler.start()
+    return scheduler
 
 
 if __name__ == "__main__":
+    # DEVELOPMENT SERVER, PRODUCTION IS SERVED BY GUNICORN: gunicorn -c gunicorn.conf.py wsgi:app
+    # CREATE OR MIGRATE TABLES
+    upgrade_database()
+    app = create_app()
     if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
-        scheduler.add_job(id='Scheduled Task', func=send_email, trigger="interval", hours=24)
-        scheduler.start()
+        start_scheduler(app)
     app.run(host='0.0.0.0', port=5000)
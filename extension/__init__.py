@@ -1,2 +1,6 @@
 from extension.decors import *
-from extension.funcs import *
\ No newline at end of file
+from extension.funcs import *
+from extension.pagination import *
+from extension.bulk import *
+from extension.cache import *
+from extension.etag import *
\ No newline at end of file
@@ -0,0 +1,66 @@
+from dataclasses import dataclass, field
+from distutils.util import strtobool
+from marshmallow import ValidationError
+from typing import Dict, List, Optional, Tuple
+# CURRENT PROJECT MODULES
+from extension.pagination import LIST_ARGS
+
+
+BULK_MAX_IDS = 100000
+# QUERY ARGS CONSUMED BY BULK ENDPOINTS, ALL OTHER ARGS ARE MODEL FILTERS AS IN LIST ENDPOINTS
+BULK_ARGS = ('ids', 'dry_run')
+
+
+@dataclass
+class BulkArgs:
+    filters: Dict = field(default_factory=dict)
+    ids: Optional[List[int]] = None
+    dry_run: bool = False
+
+    def apply(self, query, model):
+        """ Rows matched by filters and ids """
+        query = query.filter_by(**self.filters)
+        return query if self.ids is None else query.filter(model.id.in_(self.ids))
+
+
+def parse_bulk_args(http_args, json_data: Optional[Dict]) -> BulkArgs:
+    """
+    Model filters from query args and ids from JSON body "ids" or comma separated "ids" query arg.
+    Raises ValueError with a client facing message, also when neither is given: bulk change of a whole table
+    must be asked for explicitly with a filter
+    """
+    filters = {k: v for k, v in http_args.items() if k not in BULK_ARGS + LIST_ARGS}
+    ids = json_data.get('ids') if isinstance(json_data, dict) else None
+    if ids is None and http_args.get('ids'):
+        ids = http_args['ids'].split(',')
+    try:
+        bulk_args = BulkArgs(filters=filters, ids=None if ids is None else [int(id) for id in ids],
+                             dry_run=bool(strtobool(http_args.get('dry_run', 'false'))))
+    except (TypeError, ValueError):
+        raise ValueError('ids must be a list of integers, dry_run must be boolean')
+    if bulk_args.ids is None and not bulk_args.filters:
+        raise ValueError('Provide ids or filter query args')
+    if bulk_args.ids is not None and len(bulk_args.ids) > BULK_MAX_IDS:
+        raise ValueError(f'Up to {BULK_MAX_IDS} ids at once, use a filter for more')
+    return bulk_args
+
+
+def load_bulk_values(values, schema, updatable: Tuple[str, ...]) -> Dict:
+    """ Deserialize and validate values with schema fields, only updatable ones are accepted. Raises ValidationError """
+    if not isinstance(values, dict) or not values:
+        raise ValidationError({'values': ['Provide an object of attributes to set']})
+    errors = {key: [f'Unknown or not updatable field, use: {", ".join(updatable)}']
+              for key in values if key not in updatable}
+    data = {}
+    for key, value in values.items():
+        if key in updatable:
+            try:
+                data[key] = schema.fields[key].deserialize(value)
+            except ValidationError as err:
+                errors[key] = err.messages
+    if errors:
+        raise ValidationError(errors)
+    return data
+
+
+__all__ = ['BulkArgs', 'parse_bulk_args', 'load_bulk_values', 'BULK_ARGS']
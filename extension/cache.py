@@ -0,0 +1,235 @@
+"""
+Read-through cache of single entity GET responses.
+
+Entries are addressed by entity name and id (e.g. "client", 5), one entity id may hold several variants
+(e.g. statistic pages). Invalidation drops every variant of an id or the whole entity.
+Writes of other processes (distribution maker, other app workers) arrive as NOTIFY on CACHE_NOTIFY_CHANNEL
+with "entity:id" or "entity:*" payload, see db_api.models and db_api.statistic.
+
+    CACHE_BACKEND=memory   in-process LRU with TTL (default)
+    CACHE_BACKEND=redis    Redis compatible server at CACHE_URL, shared by all processes (needs redis package)
+    CACHE_BACKEND=none     no caching
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, Optional, Tuple
+from loguru import logger
+import select
+import json
+import time
+import os
+# CURRENT PROJECT MODULES
+from db_api import CACHE_NOTIFY_CHANNEL
+
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_URL = os.getenv('CACHE_URL', 'redis://localhost:6379/0')
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', 30))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+
+# MARKER OF A MISS, CACHED VALUE MAY BE ANYTHING JSON SERIALIZABLE
+MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+
+class LRUCache:
+    """ Thread safe in-process LRU of (entity, id) -> {variant: value}, entries expire ttl seconds after set """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: 'OrderedDict[Tuple[str, Any], Dict[str, Tuple[float, Any]]]' = OrderedDict()
+        self.lock = Lock()
+        self.stats = CacheStats()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, entity: str, id, variant: str = ''):
+        with self.lock:
+            variants = self.entries.get((entity, id))
+            expires_at, value = variants.get(variant, (0.0, MISSING)) if variants else (0.0, MISSING)
+            if value is not MISSING and expires_at <= self.clock():
+                del variants[variant]
+                self.stats.expirations += 1
+                value = MISSING
+            if value is MISSING:
+                self.stats.misses += 1
+                return MISSING
+            self.entries.move_to_end((entity, id))
+            self.stats.hits += 1
+            return value
+
+    def set(self, entity: str, id, value, variant: str = ''):
+        with self.lock:
+            self.entries.setdefault((entity, id), {})[variant] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end((entity, id))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self, entity: str, id=None):
+        """ Drop all variants of entity id, or of every id of entity if id is None """
+        with self.lock:
+            keys = [key for key in self.entries if key[0] == entity] if id is None else [(entity, id)]
+            for key in keys:
+                if self.entries.pop(key, None) is not None:
+                    self.stats.invalidations += 1
+
+
+class RedisCache:
+    """ Same interface over a Redis hash per (entity, id), so every app process and the maker share entries """
+
+    def __init__(self, url: str = CACHE_URL, ttl: float = CACHE_TTL_SECONDS):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_BACKEND=redis needs "redis" package installed')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    def __len__(self):
+        return self.client.dbsize()
+
+    @staticmethod
+    def _key(entity: str, id) -> str:
+        return f'cache:{entity}:{id}'
+
+    def get(self, entity: str, id, variant: str = ''):
+        raw = self.client.hget(self._key(entity, id), variant)
+        if raw is None:
+            self.stats.misses += 1
+            return MISSING
+        self.stats.hits += 1
+        return json.loads(raw)
+
+    def set(self, entity: str, id, value, variant: str = ''):
+        key = self._key(entity, id)
+        with self.client.pipeline() as pipe:
+            pipe.hset(key, variant, json.dumps(value, default=str))
+            pipe.expire(key, max(1, int(self.ttl)))
+            pipe.execute()
+
+    def invalidate(self, entity: str, id=None):
+        keys = list(self.client.scan_iter(match=self._key(entity, '*'))) if id is None else [self._key(entity, id)]
+        if keys:
+            self.stats.invalidations += self.client.delete(*keys)
+
+
+class NullCache:
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def __len__(self):
+        return 0
+
+    def get(self, entity: str, id, variant: str = ''):
+        self.stats.misses += 1
+        return MISSING
+
+    def set(self, entity: str, id, value, variant: str = ''):
+        pass
+
+    def invalidate(self, entity: str, id=None):
+        pass
+
+
+def make_cache(backend: str = CACHE_BACKEND):
+    if backend == 'redis':
+        return RedisCache()
+    if backend == 'none':
+        return NullCache()
+    return LRUCache()
+
+
+class EntityCache:
+    """ Read-through facade used by views, plus invalidation by NOTIFY from other processes """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else make_cache()
+        self.listener: Optional[Thread] = None
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.backend.stats
+
+    def lookup(self, entity: str, id, variant: str = ''):
+        """ Cached value or None """
+        value = self.backend.get(entity, id, variant)
+        return None if value is MISSING else value
+
+    def store(self, entity: str, id, value, variant: str = ''):
+        if value is not None:
+            self.backend.set(entity, id, value, variant)
+
+    def invalidate(self, entity: str, id=None):
+        self.backend.invalidate(entity, id)
+
+    def apply_notification(self, payload: str):
+        """ Payload is "entity:id" or "entity:*", several of them may be separated by commas """
+        for item in payload.split(','):
+            entity, _, id = item.partition(':')
+            if id == '*':
+                self.invalidate(entity)
+            elif id.isdigit():
+                self.invalidate(entity, int(id))
+
+    def metrics(self) -> Dict:
+        return {**asdict(self.stats), "hit_ratio": round(self.stats.hit_ratio, 4), "entries": len(self.backend),
+                "backend": type(self.backend).__name__}
+
+    def listen(self, engine, channel: str = CACHE_NOTIFY_CHANNEL):
+        """ Start a daemon thread applying invalidation notifications of other processes """
+        if self.listener is None:
+            self.listener = Thread(target=self._listen, args=(engine, channel), name='cache-invalidation', daemon=True)
+            self.listener.start()
+
+    def _listen(self, engine, channel: str):
+        while True:
+            connection = None
+            try:
+                fairy = engine.raw_connection()
+                # LIVES AS LONG AS THE PROCESS, DON'T KEEP A POOL SLOT FOR IT
+                fairy.detach()
+                connection = fairy.connection
+                connection.autocommit = True
+                connection.cursor().execute(f'LISTEN {channel}')
+                # NOTIFICATIONS SENT WHILE NOT LISTENING ARE LOST, START FROM A CLEAN CACHE
+                for entity in ('client', 'distribution', 'statistic'):
+                    self.invalidate(entity)
+                while True:
+                    select.select([connection], [], [], 60)
+                    connection.poll()
+                    while connection.notifies:
+                        self.apply_notification(connection.notifies.pop(0).payload)
+            except Exception as err:
+                logger.warning(f'CACHE INVALIDATION LISTENER reconnects after error: {err}')
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                time.sleep(1)
+
+
+entity_cache = EntityCache()
+
+
+__all__ = ['EntityCache', 'LRUCache', 'RedisCache', 'NullCache', 'CacheStats', 'entity_cache', 'make_cache']
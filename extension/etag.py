@@ -0,0 +1,59 @@
+"""
+Conditional GET with strong ETags derived from row versions (see db_api.models.ROW_VERSION_SEQ).
+
+An ETag hashes the request URL (query args select the representation) with versions of the rows
+the response is built from, so it is known before anything is serialized: a request whose If-None-Match
+holds it gets 304 and the marshmallow dump is never run.
+"""
+from flask import request, Response
+from werkzeug.http import quote_etag
+from typing import Any, Callable
+import hashlib
+import json
+# CURRENT PROJECT MODULES
+from extension.cache import entity_cache
+
+
+def make_etag(*versions) -> str:
+    """ Unquoted ETag of the current request URL and data versions """
+    return hashlib.sha1(json.dumps([request.full_path, *versions], default=str).encode()).hexdigest()
+
+
+def collection_version(rows, *extra) -> list:
+    """ Version of a page of rows: max row version catches changes, rows count and last id catch inserts and deletes """
+    return [max((row.version for row in rows), default=0), len(rows), rows[-1].id if rows else None, *extra]
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status=304, headers={'ETag': quote_etag(etag)})
+
+
+def conditional_response(etag: str, build: Callable[[], Any]):
+    """ 304 if client already holds etag, otherwise build() (only called then) as 200 body with ETag header """
+    if request.if_none_match.contains_weak(etag):
+        return not_modified_response(etag)
+    return build(), 200, {'ETag': quote_etag(etag)}
+
+
+def conditional_entity(entity: str, id, load: Callable, version: Callable, dump: Callable, wrap: Callable,
+                       variant: str = ''):
+    """
+    Conditional read-through GET of one entity, None if it's not found.
+    load() -> object or None, version(object) -> its version, dump(object) -> JSON body part, wrap(body) -> response.
+    Bodies are cached with the version they were dumped at, so neither a cache hit nor a 304 runs dump()
+    """
+    cached = entity_cache.lookup(entity, id, variant)
+    if cached is None:
+        loaded = load()
+        if loaded is None:
+            return None
+        row_version = version(loaded)
+        if request.if_none_match.contains_weak(make_etag(row_version)):
+            return not_modified_response(make_etag(row_version))
+        cached = [row_version, dump(loaded)]
+        entity_cache.store(entity, id, cached, variant)
+    row_version, body = cached
+    return conditional_response(make_etag(row_version), lambda: wrap(body))
+
+
+__all__ = ['make_etag', 'collection_version', 'conditional_response', 'conditional_entity']
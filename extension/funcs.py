@@ -1,50 +1,88 @@
-from typing import Union, Dict, Iterable, List
+from functools import lru_cache
+from operator import attrgetter
+from typing import Union, Callable, Dict, Iterable, List, Tuple
 from db_api import Base
-from sqlalchemy import inspect
-from multimethod import multimethod as singledispatch
+from sqlalchemy import inspect, or_
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import object_session
 
 
-# MULTIMETHOD AS SINGLEDISPATCH
-# cause singledispatch doesn't support some classes from typing module such as Iterable or List
+# TYPE CHECKS ARE DONE ONCE PER CALL, COLUMN ATTRIBUTES ONCE PER MODEL CLASS (NOT PER ROW AS WITH inspect())
 
-@singledispatch
-def object_as_dict(query_object) -> Union[List, Dict, Exception]:
-    return NotImplementedError(f'Invalid type {type(query_object)}. Only Receives Model Class object or Model Class objects within iterable')
+@lru_cache(maxsize=None)
+def column_keys(model) -> Tuple[str, ...]:
+    """ Column attribute names of a model class, in mapper order """
+    return tuple(attr.key for attr in inspect(model).column_attrs)
 
 
-@object_as_dict.register
-def _(query_object: Base) -> Dict:
-    return {c.key: getattr(query_object, c.key) for c in inspect(query_object).mapper.column_attrs}
+@lru_cache(maxsize=None)
+def column_accessor(model) -> Tuple[Tuple[str, ...], Callable]:
+    """ Column names of a model class and a function returning tuple of their values of an instance """
+    keys = column_keys(model)
+    getter = attrgetter(*keys)
+    return keys, getter if len(keys) > 1 else lambda obj: (getter(obj),)
 
 
-@object_as_dict.register
-def _(query_object: Iterable[Base]) -> List:
-    result = []
-    for item in query_object:
-        result.append({c.key: getattr(item, c.key) for c in inspect(item).mapper.column_attrs})
-    return result
+def _object_as_dict(query_object) -> Dict:
+    if isinstance(query_object, Row):
+        return query_object._asdict()
+    keys, getter = column_accessor(type(query_object))
+    return dict(zip(keys, getter(query_object)))
 
 
-@singledispatch
-def dynamic_update(query_object, attrs) -> Union[Iterable, Base, Exception]:
+def object_as_dict(query_object) -> Union[List, Dict, Exception]:
+    """ Dict of model object columns, list of them for an iterable. Rows of column queries are also accepted """
+    if isinstance(query_object, (Base, Row)):
+        return _object_as_dict(query_object)
+    if isinstance(query_object, Iterable):
+        return [_object_as_dict(item) for item in query_object]
     return NotImplementedError(f'Invalid type {type(query_object)}. Only Receives Model Class object or Model Class objects within iterable')
 
 
-@dynamic_update.register
-def _(query_object: Base, attrs: Dict) -> Base:
-    for k, v in attrs.items():
-        if hasattr(query_object, k):
-            setattr(query_object, k, v)
-    return query_object
+def changed_rows(model, values: Dict):
+    """ WHERE clause of rows where any of values differs, rows already having them are left alone """
+    return or_(*[getattr(model, k).is_distinct_from(v) for k, v in values.items()])
 
 
-@dynamic_update.register
-def _(query_object: Iterable[Base], attrs: Dict) -> Iterable[Base]:
-    for obj in query_object:
+def bulk_update(query, attrs: Dict, synchronize_session='fetch', dry_run: bool = False) -> int:
+    """
+    One UPDATE of the rows matched by query of a model, setting attrs which are model columns.
+    Returns changed rows count, dry_run only counts rows which would change.
+    Loaded objects of the session are updated in place, ORM listeners get after_bulk_update (see db_api.models)
+    """
+    model = query.column_descriptions[0]['entity']
+    values = {k: v for k, v in attrs.items() if k in column_keys(model)}
+    if not values:
+        return 0
+    query = query.filter(changed_rows(model, values))
+    if dry_run:
+        return query.order_by(None).count()
+    return query.update(values, synchronize_session=synchronize_session)
+
+
+def dynamic_update(query_object, attrs) -> Union[Iterable, Base, Exception]:
+    """
+    Set attrs on a model object or on every object of an iterable.
+    Persistent objects of one model are updated with a single bulk UPDATE (column attrs only), others one by one
+    """
+    if isinstance(query_object, Base):
         for k, v in attrs.items():
-            if hasattr(obj, k):
-                setattr(obj, k, v)
-    return query_object
+            if hasattr(query_object, k):
+                setattr(query_object, k, v)
+        return query_object
+    if not isinstance(query_object, Iterable):
+        return NotImplementedError(f'Invalid type {type(query_object)}. Only Receives Model Class object or Model Class objects within iterable')
+    objects = list(query_object)
+    models = {type(obj) for obj in objects}
+    session = object_session(objects[0]) if len(models) == 1 else None
+    if session is not None and all(inspect(obj).persistent for obj in objects):
+        model = models.pop()
+        bulk_update(session.query(model).filter(model.id.in_([obj.id for obj in objects])), attrs)
+        # NOT COLUMNS (E.G. RELATIONSHIPS) CAN'T BE IN UPDATE STATEMENT
+        attrs = {k: v for k, v in attrs.items() if k not in column_keys(model)}
+    for obj in objects:
+        dynamic_update(obj, attrs)
+    return objects
 
 
-__all__ = ['object_as_dict', 'dynamic_update']
\ No newline at end of file
+__all__ = ['object_as_dict', 'dynamic_update', 'bulk_update', 'changed_rows', 'column_keys']
@@ -0,0 +1,73 @@
+from dataclasses import dataclass
+from distutils.util import strtobool
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+# CURRENT PROJECT MODULES
+from json_validator import FastDump
+
+
+LIST_PAGE_SIZE = 1000
+LIST_MAX_PAGE_SIZE = 10000
+# QUERY ARGS CONSUMED BY PAGINATION, ALL OTHER ARGS ARE MODEL FILTERS
+LIST_ARGS = ('limit', 'after_id', 'fields', 'with_total')
+# PROJECTIONS ARE NORMALIZED (SORTED, NO DUPLICATES), SO THEIR NUMBER IS BOUND BY FIELD SUBSETS OF LIST SCHEMAS
+LIST_PROJECTION_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=LIST_PROJECTION_CACHE_SIZE)
+def projected_schema(schema_cls, fields: Optional[Tuple[str, ...]]):
+    return schema_cls(many=True, only=fields) if fields else schema_cls(many=True)
+
+
+@lru_cache(maxsize=LIST_PROJECTION_CACHE_SIZE)
+def projected_dumper(schema_cls, fields: Optional[Tuple[str, ...]]) -> FastDump:
+    # FastDump OF AN EVICTED SCHEMA IS EVICTED WITH IT, fast_dump() WOULD KEEP IT FOREVER
+    return FastDump(projected_schema(schema_cls, fields))
+
+
+@dataclass
+class ListArgs:
+    limit: int = LIST_PAGE_SIZE
+    after_id: int = 0
+    fields: Optional[Tuple[str, ...]] = None
+    with_total: bool = False
+
+    def dumper(self, schema_cls) -> FastDump:
+        """ Column-only query and dump of requested fields, see json_validator.fast """
+        return projected_dumper(schema_cls, self.fields)
+
+
+def parse_list_args(http_args, schema_cls) -> Tuple[Dict, ListArgs]:
+    """ Split query args into model filters and pagination args. Raises ValueError with a client facing message """
+    filters = {k: v for k, v in http_args.items() if k not in LIST_ARGS}
+    try:
+        list_args = ListArgs(
+            limit=int(http_args.get('limit', LIST_PAGE_SIZE)),
+            after_id=int(http_args.get('after_id', 0)),
+            with_total=bool(strtobool(http_args.get('with_total', 'false'))),
+        )
+    except ValueError:
+        raise ValueError('limit and after_id must be integers, with_total must be boolean')
+    if not 0 < list_args.limit <= LIST_MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be from 1 to {LIST_MAX_PAGE_SIZE}')
+    if http_args.get('fields'):
+        # ONE CACHE KEY PER SET OF FIELDS, WHATEVER THEIR ORDER OR REPETITION IN THE QUERY STRING
+        fields = tuple(sorted({field.strip() for field in http_args['fields'].split(',') if field.strip()}))
+        unknown = set(fields) - set(schema_cls._declared_fields)
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+        list_args.fields = fields
+    return filters, list_args
+
+
+def paginate(query, model, list_args: ListArgs) -> Tuple[list, Dict]:
+    """ Fetch one keyset page (id > after_id) of query. Returns rows and page info for the response """
+    page_info = {}
+    if list_args.with_total:
+        page_info['total'] = query.order_by(None).count()
+    rows = query.filter(model.id > list_args.after_id).order_by(model.id).limit(list_args.limit).all()
+    page_info['next_after_id'] = rows[-1].id if len(rows) == list_args.limit else None
+    return rows, page_info
+
+
+__all__ = ['ListArgs', 'parse_list_args', 'paginate', 'LIST_ARGS']
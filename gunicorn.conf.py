@@ -0,0 +1,38 @@
+"""
+Gunicorn settings of the API and admin dashboard: gunicorn -c gunicorn.conf.py wsgi:app
+
+Every worker is a process with its own engine pool, read-through cache and invalidation listener.
+Periodic jobs don't run in workers, see report_scheduler_app.py.
+"""
+import multiprocessing
+import secrets
+import os
+
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# gthread WORKERS: THREADS OF A WORKER SERVE REQUESTS CONCURRENTLY WHILE OTHERS WAIT FOR THE DATABASE
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# THE APP IS IMPORTED BY EVERY WORKER AFTER FORK, SO ITS THREADS AND CONNECTIONS ARE NOT SHARED
+preload_app = False
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+
+# ENGINE POOL PER WORKER: ONE CONNECTION PER THREAD, WORKERS * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# MUST STAY BELOW POSTGRES max_connections. ENVIRONMENT OF THE MASTER IS INHERITED BY WORKERS
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
+os.environ.setdefault('DB_MAX_OVERFLOW', '2')
+# SESSION COOKIES (ADMIN FLASH MESSAGES) MUST BE VALID IN EVERY WORKER
+if not os.getenv('SECRET_KEY'):
+    os.environ['SECRET_KEY'] = secrets.token_hex(16)
+
+
+def on_starting(server):
+    """ Migrate once in the master before workers are forked """
+    from db_api import engine
+    from db_api.migrate import upgrade_database
+    upgrade_database()
+    # CLOSE CONNECTIONS OF THE MASTER, WORKERS DROP INHERITED ONES AFTER FORK ANYWAY (db_api.database)
+    engine.dispose()
@@ -1 +1,2 @@
-from json_validator.schemas import *
\ No newline at end of file
+from json_validator.schemas import *
+from json_validator.fast import *
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""
+Fast dump path of read endpoints, producing the same dicts as schema.dump (so byte-identical JSON).
+
+Instead of loading ORM entities and dumping them field by field, the query selects one column per dumped key
+in the order the schema emits them, with DateTime fields already formatted by PostgreSQL to_char()
+for the whole result set. A row then becomes its dict with a single dict(zip()).
+"""
+from functools import lru_cache
+from marshmallow import fields
+from sqlalchemy import func
+import re
+
+
+# STRFTIME DIRECTIVES USED BY SCHEMAS -> to_char() PATTERNS
+TO_CHAR_DIRECTIVES = {'%Y': 'YYYY', '%m': 'MM', '%d': 'DD', '%H': 'HH24', '%M': 'MI', '%S': 'SS', '%%': '%'}
+# FIELDS WHOSE DUMP OF A DATABASE VALUE OF THEIR COLUMN TYPE IS THE VALUE ITSELF
+PASS_THROUGH_FIELDS = (fields.Integer, fields.String, fields.Boolean)
+
+
+def to_char_pattern(datetime_format: str) -> str:
+    """ to_char() pattern formatting timestamps like datetime.strftime(datetime_format) """
+    parts = []
+    for part in re.split(r'(%.)', datetime_format):
+        if part.startswith('%'):
+            if part not in TO_CHAR_DIRECTIVES:
+                raise ValueError(f'Unsupported datetime format directive {part!r} in {datetime_format!r}')
+            parts.append(TO_CHAR_DIRECTIVES[part])
+        elif part:
+            # QUOTED TEXT IS LITERAL FOR to_char()
+            parts.append(f'"{part}"')
+    return ''.join(parts)
+
+
+class FastDump:
+    """ Column-only query and dump of rows for a (possibly projected) schema instance """
+
+    def __init__(self, schema):
+        # SCHEMA KEYS ORDER ISN'T FIXED ACROSS PROCESSES, SO IT'S TAKEN FROM THE INSTANCE ITSELF
+        self.keys = tuple(schema.dump_fields)
+        self.attributes = {}
+        self.formats = {}
+        for key, field in schema.dump_fields.items():
+            self.attributes[key] = field.attribute or key
+            if isinstance(field, fields.DateTime):
+                self.formats[key] = to_char_pattern(field.format or schema.opts.datetimeformat or '')
+            elif not isinstance(field, PASS_THROUGH_FIELDS):
+                raise TypeError(f'{type(field).__name__} field {key!r} has no fast dump')
+
+    def columns(self, model, *extra: str) -> list:
+        """ One column per dumped key in key order, then extra model attributes (cursor, version) not dumped """
+        columns = []
+        for key in self.keys:
+            column = getattr(model, self.attributes[key])
+            columns.append(func.to_char(column, self.formats[key]).label(key) if key in self.formats else column.label(key))
+        return columns + [getattr(model, name) for name in extra if name not in self.keys]
+
+    def dump(self, rows) -> list:
+        keys = self.keys
+        # ZIP STOPS AT THE LAST KEY, EXTRA COLUMNS ARE DROPPED
+        return [dict(zip(keys, row)) for row in rows]
+
+    def dump_one(self, row) -> dict:
+        return dict(zip(self.keys, row))
+
+
+@lru_cache(maxsize=None)
+def fast_dump(schema) -> FastDump:
+    """ FastDump of a long lived (module level) schema instance, projections use extension.pagination cache """
+    return FastDump(schema)
+
+
+__all__ = ['FastDump', 'fast_dump', 'to_char_pattern']
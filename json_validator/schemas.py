@@ -1,7 +1,9 @@
-from marshmallow import Schema, fields, ValidationError, pre_load, validates_schema
+from marshmallow import Schema, fields, ValidationError, pre_load, validates, validates_schema
 from functools import partial
 from datetime import datetime, timedelta
 import tzlocal
+# CURRENT PROJECT MODULES
+from db_api.client_filter import parse_client_filter, ClientFilterError
 
 
 RequiredStr = partial(fields.Str, required=True)
@@ -35,6 +37,13 @@ class DistributionSchema(BaseSchema):
     end_date = fields.DateTime(validate=validate_datetime, format='%Y-%m-%d %H:%M')
     was_deleted = fields.Bool()
 
+    @validates('client_filter')
+    def validate_client_filter(self, value):
+        try:
+            parse_client_filter(value)
+        except ClientFilterError as err:
+            raise ValidationError(f'invalid client_filter: {err}')
+
     @pre_load
     def create_start_date(self, data, **kwargs):
         if not data.get('start_date'):
@@ -83,7 +92,9 @@ class ClientSchema(BaseSchema):
     def create_mobile_operator_code(self, data, many, **kwargs):
         if many:
             for el in data:
-                if not el.get('mobile_operator_code'):
+                # MISSING NUMBER IS REPORTED BY FIELD VALIDATION
+                if isinstance(el, dict) and isinstance(el.get('mobile_number'), str) \
+                        and not el.get('mobile_operator_code'):
                     el['mobile_operator_code'] = el['mobile_number'][1:4]
         else:
             if not data.get('mobile_operator_code'):
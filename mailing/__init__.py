@@ -0,0 +1,2 @@
+from mailing.report import *
+from mailing.outbox import *
@@ -0,0 +1,165 @@
+"""
+Background mail outbox: jobs are queued by the caller (scheduler, request handler) and built and sent
+by one worker thread, so neither report queries nor a slow SMTP server hold the caller.
+
+A job is a callable building a flask_mail Message, it is built once and sent with retries:
+connection errors, timeouts and 4xx SMTP replies are retried with exponential backoff, 5xx replies are not.
+The queue lives in process memory, jobs still queued when the process exits are lost.
+"""
+from dataclasses import dataclass
+from flask_mail import Message as FlaskMessage, sanitize_address, sanitize_addresses
+from loguru import logger
+from threading import Event, Lock, Thread
+from typing import Callable, Optional
+import queue
+import random
+import smtplib
+import time
+import os
+
+
+MAIL_TIMEOUT_SECONDS = float(os.getenv('MAIL_TIMEOUT_SECONDS', 30))
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', 6))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv('MAIL_RETRY_BASE_SECONDS', 60))
+MAIL_RETRY_MAX_SECONDS = float(os.getenv('MAIL_RETRY_MAX_SECONDS', 3600))
+
+
+@dataclass
+class MailJob:
+    name: str
+    build: Callable[[], FlaskMessage]
+    attempt: int = 0
+    message: Optional[FlaskMessage] = None
+
+
+@dataclass
+class OutboxStats:
+    queued: int = 0
+    sent: int = 0
+    retries: int = 0
+    failed: int = 0
+    last_error: Optional[str] = None
+
+
+def is_retryable_mail_error(error: Exception) -> bool:
+    """ Temporary SMTP replies (4xx) and network failures may pass, permanent replies (5xx) won't """
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    # SMTPException IS AN OSError TOO, THE REST OF THEM ARE PROTOCOL MISUSE
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def mail_backoff_delay(attempt: int, base: float = MAIL_RETRY_BASE_SECONDS, cap: float = MAIL_RETRY_MAX_SECONDS) -> float:
+    """ Exponential delay after failed attempt number `attempt`, with jitter on its upper half """
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class MailOutbox:
+    """ Queue of mail jobs with one lazily started worker thread per process. Call init_app(app) before submit() """
+
+    def __init__(self, timeout: float = MAIL_TIMEOUT_SECONDS, max_attempts: int = MAIL_MAX_ATTEMPTS,
+                 retry_base: float = MAIL_RETRY_BASE_SECONDS, retry_max: float = MAIL_RETRY_MAX_SECONDS):
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.app = None
+        self.stats = OutboxStats()
+        self.lock = Lock()
+        self.stopping = Event()
+        self.jobs = queue.Queue()
+        self.worker: Optional[Thread] = None
+        self.pid = None
+
+    def init_app(self, app):
+        """ app provides flask_mail settings (app.extensions['mail']) and the app context jobs run in """
+        self.app = app
+
+    def submit(self, name: str, build: Callable[[], FlaskMessage]):
+        """ Queue a job and return at once """
+        self.ensure_worker()
+        self.stats.queued += 1
+        self.jobs.put(MailJob(name=name, build=build))
+
+    def ensure_worker(self):
+        with self.lock:
+            # A FORKED CHILD INHERITS THE QUEUE BUT NOT THE THREAD
+            if self.pid != os.getpid():
+                self.jobs, self.worker, self.pid = queue.Queue(), None, os.getpid()
+            if self.worker is None or not self.worker.is_alive():
+                self.stopping.clear()
+                self.worker = Thread(target=self.run, name='mail-outbox', daemon=True)
+                self.worker.start()
+
+    def close(self, timeout: Optional[float] = None):
+        """ Send queued jobs without waiting for retries, then stop the worker """
+        if self.worker is None or not self.worker.is_alive():
+            return
+        self.stopping.set()
+        self.jobs.put(None)
+        self.worker.join(timeout)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            with self.app.app_context():
+                self.process(job)
+
+    def process(self, job: MailJob):
+        while True:
+            job.attempt += 1
+            try:
+                if job.message is None:
+                    job.message = job.build()
+                self.deliver(job.message)
+            except Exception as error:
+                self.stats.last_error = f'{job.name}: {error!r}'
+                # A FAILED BUILD (E.G. DATABASE IS DOWN) IS RETRIED AS WELL
+                retry = job.attempt < self.max_attempts and (job.message is None or is_retryable_mail_error(error))
+                if not retry or self.stopping.is_set():
+                    self.stats.failed += 1
+                    logger.error(f'MAIL {job.name} failed at attempt {job.attempt}: {error!r}')
+                    return
+                delay = mail_backoff_delay(job.attempt, self.retry_base, self.retry_max)
+                self.stats.retries += 1
+                logger.warning(f'MAIL {job.name} attempt {job.attempt} failed: {error!r}, retry in {delay:.0f}s')
+                if self.stopping.wait(delay):
+                    self.stats.failed += 1
+                    return
+            else:
+                self.stats.sent += 1
+                logger.info(f'MAIL {job.name} sent to {", ".join(job.message.send_to)} at attempt {job.attempt}')
+                return
+
+    def deliver(self, message: FlaskMessage):
+        """ flask_mail Connection without timeout could hang the worker on a stalled server, so smtplib is used """
+        state = self.app.extensions['mail']
+        if state.suppress:
+            return
+        smtp_class = smtplib.SMTP_SSL if state.use_ssl else smtplib.SMTP
+        if message.date is None:
+            message.date = time.time()
+        with smtp_class(state.server, state.port, timeout=self.timeout) as smtp:
+            if state.use_tls:
+                smtp.starttls()
+            if state.username and state.password:
+                smtp.login(state.username, state.password)
+            smtp.sendmail(sanitize_address(message.sender), list(sanitize_addresses(message.send_to)),
+                          message.as_bytes(), message.mail_options, message.rcpt_options)
+
+    def metrics(self) -> dict:
+        return {"pending": self.jobs.qsize(), "queued": self.stats.queued, "sent": self.stats.sent,
+                "retries": self.stats.retries, "failed": self.stats.failed, "last_error": self.stats.last_error}
+
+
+mail_outbox = MailOutbox()
+
+
+__all__ = ['MailOutbox', 'MailJob', 'OutboxStats', 'mail_outbox', 'is_retryable_mail_error', 'mail_backoff_delay']
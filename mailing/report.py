@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+from datetime import datetime
+from flask_mail import Message as FlaskMessage
+from typing import Dict, List, Tuple
+import csv
+import io
+# CURRENT PROJECT MODULES
+from db_api import Distribution, SessionLocal, SEND_STATUS_CASES
+from db_api import distribution_statistic
+
+
+REPORT_CSV_FIELDS = ['id', 'start_date', 'end_date', 'client_filter', 'was_deleted', *SEND_STATUS_CASES, 'total']
+
+
+@dataclass
+class StatisticReport:
+    subject: str
+    body: str
+    attachment_name: str
+    attachment: str
+
+
+def report_csv(statistic: List[Tuple[Distribution, Dict[str, int]]]) -> str:
+    """ One row per distribution with its message count per send status """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(REPORT_CSV_FIELDS)
+    for distr, counts in statistic:
+        writer.writerow([distr.id, distr.start_date.strftime(distr.datetime_format) if distr.start_date else '',
+                         distr.end_date.strftime(distr.datetime_format) if distr.end_date else '',
+                         distr.client_filter, distr.was_deleted, *[counts[status] for status in SEND_STATUS_CASES],
+                         counts['total']])
+    return buffer.getvalue()
+
+
+def report_summary(statistic: List[Tuple[Distribution, Dict[str, int]]], now: datetime) -> str:
+    """ Totals over all distributions, details are in the CSV attachment """
+    totals = {status: sum(counts[status] for _, counts in statistic) for status in SEND_STATUS_CASES}
+    total = sum(totals.values())
+    active = [distr for distr, _ in statistic
+              if not distr.was_deleted and distr.start_date and distr.end_date and distr.start_date <= now < distr.end_date]
+    lines = [
+        f'Distribution statistic at {now.strftime(Distribution.datetime_format)}',
+        '',
+        f'Distributions: {len(statistic)} (active {len(active)}, '
+        f'deleted {sum(1 for distr, _ in statistic if distr.was_deleted)})',
+        f'Messages: {total}',
+        *[f'  {status}: {count}' for status, count in totals.items()],
+    ]
+    attempted = totals['SENT'] + totals['FAIL']
+    if attempted:
+        lines.append(f'Fail rate: {totals["FAIL"] / attempted:.2%}')
+    lines += ['', 'Messages count of every distribution is in the attached CSV.']
+    return '\n'.join(lines) + '\n'
+
+
+def build_statistic_report(session, now: datetime = None) -> StatisticReport:
+    """ Daily report from one query of distributions joined with their distribution_stats rollup """
+    now = now or datetime.now()
+    statistic = distribution_statistic(session)
+    return StatisticReport(subject=f'Distribution Statistic {now.strftime("%Y-%m-%d")}',
+                           body=report_summary(statistic, now),
+                           attachment_name=f'distribution_statistic_{now.strftime("%Y%m%d")}.csv',
+                           attachment=report_csv(statistic))
+
+
+def statistic_report_message(sender: str, recipients: List[str]) -> FlaskMessage:
+    """ Build the daily report with its own session, to be run by a mail outbox job """
+    session = SessionLocal()
+    try:
+        report = build_statistic_report(session)
+    finally:
+        session.close()
+    msg = FlaskMessage(subject=report.subject, sender=sender, recipients=recipients, body=report.body)
+    msg.attach(report.attachment_name, 'text/csv', report.attachment)
+    return msg
+
+
+__all__ = ['StatisticReport', 'build_statistic_report', 'report_csv', 'report_summary', 'statistic_report_message']
@@ -0,0 +1,29 @@
+from loguru import logger
+import signal
+import time
+import sys
+# CURRENT PROJECT MODULES
+from distribution_manage_app import create_app, start_scheduler
+from mailing import mail_outbox
+from mailing.outbox import MAIL_TIMEOUT_SECONDS
+
+
+def main():
+    logger.add('./logs/run.log', format="{time: %Y-%m-%d %H:%M:%S} - {level} - {message}", level="INFO")
+    app = create_app()
+    # SEVERAL SCHEDULER PROCESSES MAY RUN, THE LEADER LOCK LETS ONLY ONE OF THEM SEND REPORTS
+    scheduler = start_scheduler(app)
+    logger.info('REPORT SCHEDULER started')
+    try:
+        while True:
+            time.sleep(3600)
+    finally:
+        scheduler.shutdown(wait=False)
+        # A REPORT BEING SENT IS FINISHED, ITS RETRIES ARE NOT WAITED FOR
+        mail_outbox.close(timeout=MAIL_TIMEOUT_SECONDS)
+
+
+if __name__ == '__main__':
+    # DOCKER STOPS CONTAINER WITH SIGTERM: EXIT THROUGH FINALLY SO THE MAIL OUTBOX IS CLOSED
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    main()
@@ -0,0 +1,6 @@
+from sender.throttle import *
+from sender.dispatch import *
+from sender.materialize import *
+from sender.writeback import *
+from sender.scheduler import *
+from sender.retry import *
@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, Iterable, Iterator, Optional
+import requests as req
+from requests.adapters import HTTPAdapter
+import os
+# CURRENT PROJECT MODULES
+from sender.throttle import SEND_RATE_LIMIT, SEND_RATE_LIMIT_PER_DISTRIBUTION
+from sender.throttle import TokenBucket, CircuitBreaker, CircuitOpenError
+
+
+SEND_API_URL = os.getenv('SEND_API_URL', 'https://probe.fbrq.cloud/v1/send/')
+SEND_CONCURRENCY = int(os.getenv('SEND_CONCURRENCY', 16))
+SEND_TIMEOUT = float(os.getenv('SEND_TIMEOUT', 10))
+
+
+@dataclass
+class SendJob:
+    msg_id: int
+    phone: str
+    text: str
+    attempt: int = 1
+    distribution_id: Optional[int] = None
+
+
+@dataclass
+class SendResult:
+    job: SendJob
+    status_code: Optional[int] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code == 200
+
+    @property
+    def skipped(self) -> bool:
+        """ Not sent at all because the circuit breaker is open """
+        return isinstance(self.error, CircuitOpenError)
+
+
+class Dispatcher:
+    """
+    Posts messages to the send API from a bounded pool of threads.
+    All threads share one session whose per-host connection pool is sized to the pool of threads,
+    so every in-flight request reuses a keep-alive connection. Threads only do HTTP: results are handed back
+    to the caller, which stays the only one touching the database session.
+    """
+
+    def __init__(self, token: str, url: str = SEND_API_URL, concurrency: int = SEND_CONCURRENCY,
+                 timeout: float = SEND_TIMEOUT, rate_limit: float = SEND_RATE_LIMIT,
+                 distribution_rate_limit: float = SEND_RATE_LIMIT_PER_DISTRIBUTION,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.url = url if url.endswith('/') else url + '/'
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.rate_limiter = TokenBucket(rate_limit) if rate_limit > 0 else None
+        self.distribution_rate_limit = distribution_rate_limit
+        self.distribution_rate_limiters: Dict[int, TokenBucket] = {}
+        self.distribution_rate_limiters_lock = Lock()
+        self.breaker = breaker
+        self.session = req.session()
+        self.session.headers.update({"ContentType": "application/json", "Authorization": token})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='dispatcher')
+
+    @property
+    def rate_limit(self) -> float:
+        """ Messages per second a single distribution is sent at, 0 if unlimited """
+        limits = [self.distribution_rate_limit] if self.distribution_rate_limit > 0 else []
+        if self.rate_limiter is not None:
+            limits.append(self.rate_limiter.rate)
+        return min(limits) if limits else 0
+
+    @property
+    def circuit_open(self) -> bool:
+        return self.breaker is not None and self.breaker.is_open
+
+    def _distribution_rate_limiter(self, distribution_id: Optional[int]) -> Optional[TokenBucket]:
+        if self.distribution_rate_limit <= 0 or distribution_id is None:
+            return None
+        with self.distribution_rate_limiters_lock:
+            if distribution_id not in self.distribution_rate_limiters:
+                # A FULL BUCKET IS THE SAME AS A NEW ONE: DROP THEM, SO ENDED AND DRAINED DISTRIBUTIONS DON'T PILE UP
+                for idle_id in [id for id, bucket in self.distribution_rate_limiters.items() if bucket.full]:
+                    del self.distribution_rate_limiters[idle_id]
+                self.distribution_rate_limiters[distribution_id] = TokenBucket(self.distribution_rate_limit)
+            return self.distribution_rate_limiters[distribution_id]
+
+    def _post(self, job: SendJob) -> SendResult:
+        if self.breaker is not None and not self.breaker.allow():
+            return SendResult(job, error=CircuitOpenError('send API circuit is open'))
+        distribution_rate_limiter = self._distribution_rate_limiter(job.distribution_id)
+        if distribution_rate_limiter is not None:
+            distribution_rate_limiter.acquire()
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        result = self._do_post(job)
+        if self.breaker is not None:
+            self.breaker.record(result)
+        return result
+
+    def _do_post(self, job: SendJob) -> SendResult:
+        payload = {
+            "id": job.msg_id,
+            "phone": job.phone,
+            "text": job.text
+        }
+        try:
+            r = self.session.post(url=f'{self.url}{job.msg_id}', json=payload, timeout=self.timeout)
+        except req.RequestException as err:
+            return SendResult(job, error=err)
+        return SendResult(job, status_code=r.status_code)
+
+    def send(self, jobs: Iterable[SendJob]) -> Iterator[SendResult]:
+        """ Send jobs concurrently and yield results in completion order, keeping at most 2 * concurrency in flight """
+        pending = set()
+        for job in jobs:
+            pending.add(self.executor.submit(self._post, job))
+            if len(pending) >= 2 * self.concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+
+__all__ = ['Dispatcher', 'SendJob', 'SendResult']
@@ -0,0 +1,193 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, case, exists, func, insert, literal, or_, select, update
+from typing import Iterable, Iterator, List, Optional
+import time
+import socket
+import os
+# CURRENT PROJECT MODULES
+from db_api import Distribution, Client, Message, AudienceSnapshot
+from db_api import compile_client_filter, client_timezone
+
+
+SEND_BATCH_SIZE = int(os.getenv('SEND_BATCH_SIZE', 1000))
+# LEASES OF A BATCH BEING SENT ARE RENEWED EVERY THIRD OF IT (BatchLease), A WORKER STALLED LONGER THAN THIS
+# (OR KILLED) LOSES ITS MESSAGES TO OTHER WORKERS
+SEND_LEASE_SECONDS = int(os.getenv('SEND_LEASE_SECONDS', 300))
+WORKER_ID = os.getenv('WORKER_ID') or f'{socket.gethostname()}-{os.getpid()}'
+# FIRST KEY OF TWO-KEY ADVISORY LOCKS, SECOND ONE IS DISTRIBUTION ID
+MATERIALIZE_LOCK_KEY = 1
+# TOP-UP ALSO RECHECKS CLIENTS CHANGED SHORTLY BEFORE THE PREVIOUS SNAPSHOT: THEIR TRANSACTIONS MAY HAVE
+# COMMITTED AFTER IT. CLIENT WRITES TAKING LONGER THAN THIS TO COMMIT CAN BE MISSED UNTIL THE NEXT FULL SNAPSHOT
+AUDIENCE_TOPUP_OVERLAP_SECONDS = int(os.getenv('AUDIENCE_TOPUP_OVERLAP_SECONDS', 60))
+
+
+def audience_clause(distr: Distribution, timezone: Optional[str] = None):
+    """ WHERE clause selecting the clients a distribution is sent to, optionally only ones living in timezone """
+    # SOFT DELETED CLIENTS (E.G. CHURNED NUMBERS) DON'T GET NEW MESSAGES
+    clause = and_(compile_client_filter(distr.client_filter), Client.was_deleted.isnot(True))
+    if timezone is not None:
+        clause = and_(clause, client_timezone() == timezone)
+    return clause
+
+
+def materialize_messages(session, distr: Distribution, timezone: Optional[str] = None,
+                         updated_after: Optional[datetime] = None) -> int:
+    """
+    Create missing messages for the distribution audience with one INSERT ... SELECT,
+    only for clients changed after updated_after if given.
+    Concurrent workers are serialized per distribution by an advisory lock held until commit,
+    so the NOT EXISTS check never races with another worker's insert.
+    """
+    session.execute(select(func.pg_advisory_xact_lock(MATERIALIZE_LOCK_KEY, distr.id)))
+    audience = select(literal(distr.id), Client.id).where(
+        audience_clause(distr, timezone),
+        ~exists().where(and_(Message.distribution_id == distr.id, Message.client_id == Client.id))
+    )
+    if updated_after is not None:
+        audience = audience.where(Client.updated_at > updated_after)
+    result = session.execute(insert(Message).from_select(['distribution_id', 'client_id'], audience))
+    return result.rowcount
+
+
+def snapshot_audience(session, distr: Distribution, timezone: Optional[str] = None) -> int:
+    """
+    Materialize the distribution audience once, afterwards only top it up with clients created or changed
+    since the previous snapshot (audience_snapshots watermark). Changed client_filter means a full snapshot again.
+    Returns the number of created messages, the caller commits.
+    """
+    session.execute(select(func.pg_advisory_xact_lock(MATERIALIZE_LOCK_KEY, distr.id)))
+    snapshot = session.get(AudienceSnapshot, (distr.id, timezone or ''))
+    # SAME CLOCK AS CLIENTS.UPDATED_AT, TAKEN BEFORE THE AUDIENCE IS READ
+    started_at = session.execute(select(func.localtimestamp())).scalar()
+    if snapshot is None:
+        snapshot = AudienceSnapshot(distribution_id=distr.id, timezone=timezone or '')
+        session.add(snapshot)
+    full = snapshot.snapshot_at is None or snapshot.client_filter != distr.client_filter
+    updated_after = None if full else snapshot.snapshot_at - timedelta(seconds=AUDIENCE_TOPUP_OVERLAP_SECONDS)
+    created = materialize_messages(session, distr, timezone, updated_after=updated_after)
+    snapshot.client_filter = distr.client_filter
+    snapshot.snapshot_at = started_at
+    return created
+
+
+def latest_client_change(session) -> Optional[datetime]:
+    """ updated_at of the most recently created or changed client, one index lookup """
+    return session.execute(select(func.max(Client.updated_at))).scalar()
+
+
+def next_claim_at(session, distr: Distribution, timezone: Optional[str] = None) -> Optional[datetime]:
+    """
+    When the next message of the distribution becomes claimable: unsent ones right away (or when their lease
+    expires), failed ones at next_attempt_at. None if nothing is left to send until the audience changes.
+    """
+    now = datetime.now()
+    ready_at = func.greatest(
+        case((Message.send_status == 'FAIL', Message.next_attempt_at), else_=literal(datetime.min)),
+        func.coalesce(Message.lease_expires_at, literal(datetime.min)),
+    )
+    moment = session.execute(
+        select(func.min(ready_at))
+        .join(Client, Message.client_id == Client.id)
+        .where(Message.distribution_id == distr.id,
+               or_(Message.send_status == 'NOT_SENT',
+                   and_(Message.send_status == 'FAIL', Message.next_attempt_at.isnot(None))),
+               audience_clause(distr, timezone))
+    ).scalar()
+    return None if moment is None else max(moment, now)
+
+
+def claim_unsent_batch(session, distr: Distribution, timezone: Optional[str] = None, after_id: int = 0,
+                       worker_id: str = WORKER_ID, batch_size: int = SEND_BATCH_SIZE,
+                       lease_seconds: int = SEND_LEASE_SECONDS) -> List:
+    """
+    Lease up to batch_size messages with id > after_id, either never sent or failed and due for retry,
+    to worker_id and return their (id, mobile_number, attempts).
+    Rows locked or leased by other workers are skipped (FOR UPDATE SKIP LOCKED), expired leases are taken over.
+    The lease is committed before returning, so it is visible to other workers while the batch is being sent.
+    """
+    now = datetime.now()
+    candidates = select(Message.id) \
+        .join(Client, Message.client_id == Client.id) \
+        .where(Message.distribution_id == distr.id, Message.id > after_id,
+               or_(Message.send_status == 'NOT_SENT',
+                   and_(Message.send_status == 'FAIL', Message.next_attempt_at <= now)),
+               or_(Message.lease_expires_at.is_(None), Message.lease_expires_at < now),
+               audience_clause(distr, timezone)) \
+        .order_by(Message.id) \
+        .limit(batch_size) \
+        .with_for_update(skip_locked=True, of=Message)
+    stmt = update(Message.__table__) \
+        .where(Message.id.in_(candidates.scalar_subquery()), Message.client_id == Client.id) \
+        .values(lease_owner=worker_id, lease_expires_at=now + timedelta(seconds=lease_seconds)) \
+        .returning(Message.id, Client.mobile_number, func.coalesce(Message.attempts, 0).label('attempts'))
+    batch = sorted(session.execute(stmt).all(), key=lambda row: row.id)
+    session.commit()
+    return batch
+
+
+def renew_leases(session, msg_ids: Iterable[int], worker_id: str = WORKER_ID,
+                 lease_seconds: int = SEND_LEASE_SECONDS) -> set:
+    """ Extend leases of messages still owned by worker_id, returns their ids. Commits, like claim_unsent_batch """
+    stmt = update(Message.__table__) \
+        .where(Message.id.in_(list(msg_ids)), Message.lease_owner == worker_id) \
+        .values(lease_expires_at=datetime.now() + timedelta(seconds=lease_seconds)) \
+        .returning(Message.id)
+    renewed = set(session.execute(stmt).scalars())
+    session.commit()
+    return renewed
+
+
+class BatchLease:
+    """
+    Keeps leases of a claimed batch alive while it is being sent: keep_alive() renews them every third
+    of lease_seconds. Messages not sent yet whose lease was taken over by another worker (this one stalled
+    past expiry) are lost: they must not be sent by this worker
+    """
+
+    def __init__(self, session, batch: List, worker_id: str = WORKER_ID, lease_seconds: int = SEND_LEASE_SECONDS):
+        self.session = session
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.msg_ids = [row.id for row in batch]
+        self.done = set()
+        self.lost = set()
+        self.renewed_at = time.monotonic()
+
+    def owns(self, msg_id: int) -> bool:
+        return msg_id not in self.lost
+
+    def finish(self, msg_id: int):
+        """ Message got its outcome, its lease is released by write-back """
+        self.done.add(msg_id)
+
+    def keep_alive(self):
+        if time.monotonic() - self.renewed_at < self.lease_seconds / 3:
+            return
+        # SENT MESSAGES WAITING FOR WRITE-BACK ARE RENEWED TOO, THEIR OUTCOME IS WRITTEN ONLY WHILE THE LEASE IS HELD
+        renewed = renew_leases(self.session, self.msg_ids, self.worker_id, self.lease_seconds)
+        self.renewed_at = time.monotonic()
+        self.lost |= {msg_id for msg_id in self.msg_ids if msg_id not in renewed and msg_id not in self.done}
+
+
+def claim_batch_size(rate_limit: float = 0, batch_size: int = SEND_BATCH_SIZE,
+                     lease_seconds: int = SEND_LEASE_SECONDS) -> int:
+    """ Largest batch a rate limited worker sends within half of the lease, rate_limit 0 means unlimited """
+    if rate_limit <= 0:
+        return batch_size
+    return max(1, min(batch_size, int(rate_limit * lease_seconds / 2)))
+
+
+def iter_claimed_batches(session, distr: Distribution, timezone: Optional[str] = None, **kwargs) -> Iterator[List]:
+    """ Claim and yield batches of messages to send until there is nothing left for this worker """
+    last_id = 0
+    while True:
+        batch = claim_unsent_batch(session, distr, timezone, after_id=last_id, **kwargs)
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+
+__all__ = ['WORKER_ID', 'audience_clause', 'materialize_messages', 'snapshot_audience', 'latest_client_change',
+           'next_claim_at', 'claim_unsent_batch', 'claim_batch_size', 'renew_leases', 'BatchLease',
+           'iter_claimed_batches']
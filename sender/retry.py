@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+from typing import Optional
+import requests as req
+import random
+import os
+# CURRENT PROJECT MODULES
+from sender.dispatch import SendResult
+
+
+SEND_MAX_ATTEMPTS = int(os.getenv('SEND_MAX_ATTEMPTS', 8))
+SEND_RETRY_BASE_SECONDS = float(os.getenv('SEND_RETRY_BASE_SECONDS', 30))
+SEND_RETRY_MAX_SECONDS = float(os.getenv('SEND_RETRY_MAX_SECONDS', 3600))
+
+# TIMEOUTS, THROTTLING AND SERVER SIDE ERRORS MAY PASS, OTHER 4XX MEAN THE REQUEST ITSELF IS WRONG
+RETRYABLE_STATUS_CODES = {408, 425, 429}
+RETRYABLE_ERRORS = (req.ConnectionError, req.Timeout)
+
+
+def is_retryable(result: SendResult) -> bool:
+    if result.error is not None:
+        return isinstance(result.error, RETRYABLE_ERRORS)
+    return result.status_code in RETRYABLE_STATUS_CODES or result.status_code >= 500
+
+
+def backoff_delay(attempt: int) -> float:
+    """ Exponential delay before the attempt following attempt number `attempt`, with jitter on its upper half """
+    delay = min(SEND_RETRY_MAX_SECONDS, SEND_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def next_attempt_at(result: SendResult, attempt: int, now: datetime) -> Optional[datetime]:
+    """ When failed attempt number `attempt` should be retried, None if the failure is terminal """
+    if attempt >= SEND_MAX_ATTEMPTS or not is_retryable(result):
+        return None
+    return now + timedelta(seconds=backoff_delay(attempt))
+
+
+__all__ = ['is_retryable', 'backoff_delay', 'next_attempt_at']
@@ -0,0 +1,146 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from distutils.util import strtobool
+from heapq import heapify, heappop
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+import select
+import pytz
+import os
+# CURRENT PROJECT MODULES
+from db_api import Distribution, DISTRIBUTION_NOTIFY_CHANNEL
+from db_api import LOCAL_TIMEZONE, client_timezone
+from sender.materialize import audience_clause
+
+
+SEND_WINDOW_PER_TIMEZONE = bool(strtobool(os.getenv('SEND_WINDOW_PER_TIMEZONE', 'False')))
+
+
+@dataclass(order=True)
+class SendWindow:
+    """ Time span in server local time during which a distribution (or its clients in one timezone) is sent """
+    start: datetime
+    end: datetime
+    distribution_id: int = field(compare=False)
+    timezone: Optional[str] = field(default=None, compare=False)
+
+
+def localize(dt: datetime, timezone: str) -> datetime:
+    """ Treat naive dt as wall clock time in timezone and return the same moment as naive server local time """
+    try:
+        tz = pytz.timezone(timezone)
+    except pytz.UnknownTimeZoneError:
+        logger.warning(f'UNKNOWN TIMEZONE "{timezone}", SERVER TIMEZONE IS USED INSTEAD')
+        return dt
+    return tz.localize(dt).astimezone(pytz.timezone(LOCAL_TIMEZONE)).replace(tzinfo=None)
+
+
+class DistributionScheduler:
+    """
+    Keeps send windows of live distributions in a heap ordered by start time.
+    The maker sleeps until the earliest pending start (or active end) instead of polling,
+    and calls refresh() when distributions change in the database.
+    With per_timezone every distribution is fanned out into one window per client timezone,
+    start_date and end_date being wall clock time of that timezone.
+    Active windows with nothing left to send are put to sleep() until their next retry
+    or until the next refresh() (distributions or clients changed), so they cost nothing per tick.
+    """
+
+    def __init__(self, session, per_timezone: bool = SEND_WINDOW_PER_TIMEZONE):
+        self.session = session
+        self.per_timezone = per_timezone
+        self.pending: List[SendWindow] = []
+        self.active: List[SendWindow] = []
+        # (DISTRIBUTION ID, TIMEZONE) -> WAKE UP TIME, NONE MEANS UNTIL REFRESH()
+        self.sleeping: Dict[Tuple[int, Optional[str]], Optional[datetime]] = {}
+
+    def _windows(self, distr: Distribution) -> List[SendWindow]:
+        if not self.per_timezone:
+            return [SendWindow(distr.start_date, distr.end_date, distr.id)]
+        timezones = self.session.query(client_timezone()).filter(audience_clause(distr)).distinct()
+        return [SendWindow(localize(distr.start_date, tz), localize(distr.end_date, tz), distr.id, tz)
+                for tz, in timezones]
+
+    def refresh(self):
+        now = datetime.now()
+        # WINDOWS MAY END UP TO +-14 HOURS AWAY FROM SERVER TIME IN PER TIMEZONE MODE
+        horizon = now - timedelta(hours=14) if self.per_timezone else now
+        distrs = self.session.query(Distribution) \
+            .filter(Distribution.end_date >= horizon, Distribution.was_deleted.isnot(True)) \
+            .all()
+        windows = [window for distr in distrs for window in self._windows(distr) if window.end >= now]
+        self.pending = [window for window in windows if window.start > now]
+        self.active = [window for window in windows if window.start <= now]
+        heapify(self.pending)
+        # DISTRIBUTIONS OR THEIR AUDIENCE MAY HAVE CHANGED, EVERY WINDOW IS CHECKED AGAIN
+        self.sleeping = {}
+        self.session.commit()
+        logger.info(f'SCHEDULER refreshed: {len(self.active)} active, {len(self.pending)} pending windows')
+
+    def sleep(self, window: SendWindow, until: Optional[datetime] = None):
+        """ Skip an active window until the given moment, or until refresh() if it's None """
+        self.sleeping[window.distribution_id, window.timezone] = until
+
+    def _awake(self, window: SendWindow, now: datetime) -> bool:
+        key = window.distribution_id, window.timezone
+        if key not in self.sleeping:
+            return True
+        until = self.sleeping[key]
+        if until is not None and until <= now:
+            del self.sleeping[key]
+            return True
+        return False
+
+    def due(self) -> List[SendWindow]:
+        """ Windows that should be sent right now """
+        now = datetime.now()
+        while self.pending and self.pending[0].start <= now:
+            self.active.append(heappop(self.pending))
+        self.active = [window for window in self.active if window.end >= now]
+        return [window for window in self.active if self._awake(window, now)]
+
+    def next_wakeup(self) -> Optional[datetime]:
+        """ Earliest moment the set of due windows changes, None if there is nothing scheduled """
+        moments = [window.end for window in self.active]
+        moments += [until for until in self.sleeping.values() if until is not None]
+        if self.pending:
+            moments.append(self.pending[0].start)
+        return min(moments, default=None)
+
+
+class DistributionListener:
+    """ Dedicated connection LISTENing for distribution changes, used to sleep until something happens """
+
+    def __init__(self, engine, channel: str = DISTRIBUTION_NOTIFY_CHANNEL):
+        self.engine = engine
+        self.channel = channel
+        self.connection = None
+        self._connect()
+
+    def _connect(self):
+        fairy = self.engine.raw_connection()
+        # THE CONNECTION LIVES AS LONG AS THE MAKER, DON'T KEEP A POOL SLOT FOR IT
+        fairy.detach()
+        self.connection = fairy.connection
+        self.connection.autocommit = True
+        self.connection.cursor().execute(f'LISTEN {self.channel}')
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        """ Block up to timeout seconds (forever if None). True if a notification arrived """
+        try:
+            if not self.connection.notifies:
+                select.select([self.connection], [], [], timeout)
+            self.connection.poll()
+        except Exception as err:
+            logger.warning(f'DISTRIBUTION LISTENER connection lost: {err}, reconnecting')
+            self._connect()
+            return True
+        notified = bool(self.connection.notifies)
+        self.connection.notifies.clear()
+        return notified
+
+    def close(self):
+        self.connection.close()
+
+
+__all__ = ['SendWindow', 'DistributionScheduler', 'DistributionListener']
@@ -0,0 +1,106 @@
+from threading import Lock
+from typing import Callable, Optional
+from loguru import logger
+import time
+import os
+
+
+# REQUESTS PER SECOND, 0 DISABLES LIMIT. LIMITS ARE PER MAKER PROCESS: DIVIDE CONTRACT LIMIT BY NUMBER OF WORKERS
+SEND_RATE_LIMIT = float(os.getenv('SEND_RATE_LIMIT', 0))
+SEND_RATE_LIMIT_PER_DISTRIBUTION = float(os.getenv('SEND_RATE_LIMIT_PER_DISTRIBUTION', 0))
+SEND_RATE_BURST = float(os.getenv('SEND_RATE_BURST', 1))
+SEND_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('SEND_CIRCUIT_FAILURE_THRESHOLD', 10))
+SEND_CIRCUIT_RESET_SECONDS = float(os.getenv('SEND_CIRCUIT_RESET_SECONDS', 30))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class TokenBucket:
+    """ Thread safe token bucket: acquire() blocks until a token is available. Refills at rate tokens per second """
+
+    def __init__(self, rate: float, capacity: float = SEND_RATE_BURST, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated_at = clock()
+        self.lock = Lock()
+
+    @property
+    def full(self) -> bool:
+        """ Refilled to capacity, so no different from a new bucket """
+        with self.lock:
+            return self.tokens + (self.clock() - self.updated_at) * self.rate >= self.capacity
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Stops sending after failure_threshold consecutive upstream failures.
+    After reset_seconds a single probe request is let through: success closes the circuit, failure opens it again.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'CLOSED', 'OPEN', 'HALF_OPEN'
+
+    def __init__(self, failure_threshold: int = SEND_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = SEND_CIRCUIT_RESET_SECONDS, is_failure: Optional[Callable] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.is_failure = is_failure or (lambda result: not result.ok)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN and self.clock() - self.opened_at < self.reset_seconds
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self.probing = False
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record(self, result):
+        with self.lock:
+            if self.is_failure(result):
+                self.failures += 1
+                if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                    if self.state != self.OPEN:
+                        logger.warning(f'SEND API CIRCUIT is OPEN after {self.failures} failures')
+                    self.state = self.OPEN
+                    self.opened_at = self.clock()
+                    self.probing = False
+            else:
+                if self.state != self.CLOSED:
+                    logger.warning('SEND API CIRCUIT is CLOSED')
+                self.state = self.CLOSED
+                self.failures = 0
+                self.probing = False
+
+
+__all__ = ['TokenBucket', 'CircuitBreaker', 'CircuitOpenError']
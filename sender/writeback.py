@@ -0,0 +1,131 @@
+from dataclasses import dataclass
+from datetime import datetime
+from sqlalchemy import update, values, column, cast, func, Integer, String, DateTime
+from typing import List, Optional
+from loguru import logger
+import time
+import os
+# CURRENT PROJECT MODULES
+from db_api import Message
+from sender.materialize import WORKER_ID
+
+
+WRITEBACK_MAX_ROWS = int(os.getenv('WRITEBACK_MAX_ROWS', 500))
+WRITEBACK_MAX_DELAY_MS = int(os.getenv('WRITEBACK_MAX_DELAY_MS', 1000))
+
+
+@dataclass
+class WriteBackStats:
+    flushes: int = 0
+    rows_flushed: int = 0
+    last_flush_rows: int = 0
+    last_flush_ms: float = 0.0
+    max_flush_ms: float = 0.0
+    # OUTCOMES DROPPED BECAUSE ANOTHER WORKER TOOK THE LEASE OVER, THAT WORKER SENDS THE MESSAGE AGAIN
+    leases_lost: int = 0
+
+    @property
+    def avg_rows_per_flush(self) -> float:
+        return self.rows_flushed / self.flushes if self.flushes else 0.0
+
+
+class WriteBackBuffer:
+    """
+    Collects send outcomes and writes them back with one UPDATE ... FROM (VALUES ...) per flush.
+    A flush happens when max_rows outcomes are buffered or the oldest one is max_delay_ms old, whichever comes first,
+    and on close().
+
+    Delivery is at-least-once: an outcome is durable only after the flush that contains it commits.
+    If the process dies in between, those messages are still NOT_SENT/FAIL in the database and are sent again.
+    Only rows still leased to worker_id are written, an outcome of a lease taken over by another worker is dropped.
+    """
+
+    def __init__(self, session, max_rows: int = WRITEBACK_MAX_ROWS, max_delay_ms: int = WRITEBACK_MAX_DELAY_MS,
+                 worker_id: str = WORKER_ID):
+        self.session = session
+        self.worker_id = worker_id
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max_delay_ms / 1000
+        self.rows: List[dict] = []
+        self.released: List[int] = []
+        self.oldest_at: Optional[float] = None
+        self.stats = WriteBackStats()
+
+    def __len__(self):
+        return len(self.rows) + len(self.released)
+
+    def add(self, msg_id: int, send_status: str, attempted_at: datetime, send_date: Optional[datetime] = None,
+            next_attempt_at: Optional[datetime] = None):
+        if not len(self):
+            self.oldest_at = time.monotonic()
+        self.rows.append({"msg_id": msg_id, "send_status": send_status, "send_date": send_date,
+                          "attempted_at": attempted_at, "next_attempt_at": next_attempt_at})
+        self.maybe_flush()
+
+    def release(self, msg_id: int):
+        """ Give the message lease back without recording an attempt, e.g. when it was not sent at all """
+        if not len(self):
+            self.oldest_at = time.monotonic()
+        self.released.append(msg_id)
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if len(self) >= self.max_rows or (len(self) and time.monotonic() - self.oldest_at >= self.max_delay):
+            self.flush()
+
+    def _outcome_update(self):
+        outcome = values(
+            column('msg_id', Integer), column('send_status', String), column('send_date', DateTime),
+            column('attempted_at', DateTime), column('next_attempt_at', DateTime), name='outcome'
+        ).data([(row['msg_id'], row['send_status'], row['send_date'], row['attempted_at'], row['next_attempt_at'])
+                for row in self.rows])
+        # FAILED ATTEMPTS KEEP PREVIOUS SEND_DATE, AS BEFORE. LEASE IS RELEASED, RETRIES ARE GATED BY NEXT_ATTEMPT_AT
+        return update(Message.__table__) \
+            .where(Message.id == outcome.c.msg_id, Message.lease_owner == self.worker_id) \
+            .values(send_status=outcome.c.send_status,
+                    send_date=func.coalesce(cast(outcome.c.send_date, DateTime), Message.send_date),
+                    attempts=func.coalesce(Message.attempts, 0) + 1,
+                    last_attempt_at=cast(outcome.c.attempted_at, DateTime),
+                    next_attempt_at=cast(outcome.c.next_attempt_at, DateTime),
+                    lease_owner=None, lease_expires_at=None)
+
+    def _release_update(self):
+        return update(Message.__table__) \
+            .where(Message.id.in_(self.released), Message.lease_owner == self.worker_id) \
+            .values(lease_owner=None, lease_expires_at=None)
+
+    def flush(self):
+        if not len(self):
+            return
+        started = time.perf_counter()
+        written = 0
+        try:
+            if self.rows:
+                written += self.session.execute(self._outcome_update()).rowcount
+            if self.released:
+                written += self.session.execute(self._release_update()).rowcount
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats.flushes += 1
+        self.stats.rows_flushed += len(self.rows)
+        self.stats.last_flush_rows = len(self.rows)
+        self.stats.last_flush_ms = elapsed_ms
+        self.stats.max_flush_ms = max(self.stats.max_flush_ms, elapsed_ms)
+        lost = len(self) - written
+        if lost:
+            self.stats.leases_lost += lost
+            logger.warning(f'WRITE-BACK dropped {lost} outcomes, their leases were taken over by other workers')
+        logger.debug(f'WRITE-BACK flushed {len(self.rows)} rows, released {len(self.released)} leases '
+                     f'in {elapsed_ms:.1f} ms')
+        self.rows = []
+        self.released = []
+        self.oldest_at = None
+
+    def close(self):
+        self.flush()
+
+
+__all__ = ['WriteBackBuffer', 'WriteBackStats']
@@ -0,0 +1,46 @@
+"""
+Tests run against a throwaway Postgres database, POSTGRES_* env as for the app. POSTGRES_DB must end with _test:
+its schema is dropped and migrated from scratch.
+
+    createdb fabrique_test && python -m pytest tests
+"""
+from sqlalchemy import text
+import pytest
+import os
+
+os.environ.setdefault('POSTGRES_USER', 'postgres')
+os.environ.setdefault('POSTGRES_PASSWORD', '')
+os.environ.setdefault('POSTGRES_HOST', 'localhost')
+os.environ.setdefault('POSTGRES_PORT', '5432')
+os.environ.setdefault('POSTGRES_DB', 'fabrique_test')
+os.environ.setdefault('DEBUG', 'False')
+os.environ.setdefault('MAIL_USERNAME', 'test@example.com')
+# RESPONSES MUST COME FROM THE DATABASE, NOT FROM A CACHE FILLED BY ANOTHER TEST
+os.environ.setdefault('CACHE_BACKEND', 'none')
+
+
+@pytest.fixture(scope='session')
+def database():
+    from db_api import engine
+    from db_api.migrate import upgrade_database
+    if not engine.url.database.endswith('_test'):
+        pytest.skip(f'POSTGRES_DB={engine.url.database} is not a throwaway database, name it *_test')
+    with engine.begin() as conn:
+        conn.execute(text('DROP SCHEMA public CASCADE'))
+        conn.execute(text('CREATE SCHEMA public'))
+    upgrade_database()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope='session')
+def app(database):
+    from distribution_manage_app import create_app
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,92 @@
+from sqlalchemy import text
+import pytest
+import time
+# CURRENT PROJECT MODULES
+from db_api import Client, SessionLocal, engine, notify_cache
+from extension import entity_cache
+from extension.cache import EntityCache, LRUCache, MISSING
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lru_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = LRUCache(max_entries=10, ttl=30, clock=clock)
+    cache.set('client', 1, 'body')
+    clock.now = 29.9
+    assert cache.get('client', 1) == 'body'
+    clock.now = 30
+    assert cache.get('client', 1) is MISSING
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.expirations) == (1, 1, 1)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2, ttl=30, clock=FakeClock())
+    cache.set('client', 1, 'first')
+    cache.set('client', 2, 'second')
+    cache.get('client', 1)
+    cache.set('client', 3, 'third')
+    assert cache.get('client', 2) is MISSING
+    assert cache.get('client', 1) == 'first' and cache.get('client', 3) == 'third'
+    assert cache.stats.evictions == 1 and len(cache) == 2
+
+
+def test_notification_payload_invalidates_ids_and_entities():
+    cache = EntityCache(LRUCache(clock=FakeClock()))
+    for entity, id in [('client', 5), ('client', 6), ('distribution', 1), ('statistic', 1)]:
+        cache.store(entity, id, 'body')
+    cache.apply_notification('client:5,distribution:*')
+    assert cache.lookup('client', 5) is None and cache.lookup('distribution', 1) is None
+    assert cache.lookup('client', 6) == 'body' and cache.lookup('statistic', 1) == 'body'
+    assert cache.stats.invalidations == 2
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    # TESTS RUN WITH CACHE_BACKEND=none (conftest.py), VIEWS SHARE THIS ONE entity_cache
+    monkeypatch.setattr(entity_cache, 'backend', LRUCache())
+    return entity_cache
+
+
+@pytest.fixture
+def client_id(client):
+    response = client.post('/api/v1/client/', json={'mobile_number': '79170000200', 'mobile_operator_code': '917',
+                                                    'tag': 'cache', 'timezone': 'Europe/Moscow'})
+    yield response.json['client']['id']
+    session = SessionLocal()
+    session.query(Client).filter_by(id=response.json['client']['id']).delete()
+    session.commit()
+    session.close()
+
+
+def test_put_and_delete_invalidate_cached_client(client, client_id, memory_cache):
+    url = f'/api/v1/client/{client_id}'
+    client.get(url)
+    assert client.get(url).json['client']['tag'] == 'cache'
+    assert memory_cache.stats.hits == 1
+    client.put(url, json={'tag': 'cache changed'})
+    assert client.get(url).json['client']['tag'] == 'cache changed'
+    client.delete(url)
+    assert client.get(url).json['client']['was_deleted'] is True
+    assert memory_cache.stats.invalidations == 2
+
+
+def test_cache_invalidate_notify_of_another_process(database):
+    cache = EntityCache(LRUCache())
+    cache.store('widget', 7, 'body')
+    cache.store('widget', 8, 'body')
+    cache.listen(engine)
+    # NOTIFY SENT BEFORE THE LISTENER RUNS LISTEN IS LOST, SO IT IS REPEATED UNTIL APPLIED
+    deadline = time.monotonic() + 10
+    while cache.lookup('widget', 7) is not None and time.monotonic() < deadline:
+        with engine.begin() as connection:
+            notify_cache(connection, 'widget:7')
+        time.sleep(0.1)
+    assert cache.lookup('widget', 7) is None
+    assert cache.lookup('widget', 8) == 'body'
@@ -0,0 +1,46 @@
+from sqlalchemy import insert, select
+import pytest
+# CURRENT PROJECT MODULES
+from db_api import Client, ClientFilterError, LOCAL_TIMEZONE, SessionLocal
+from db_api.client_filter import Term, compile_client_filter, parse_client_filter
+
+
+@pytest.mark.parametrize('expression', ['vip', 'promo:2022', 'black friday OR not', 'vip promo:2022'])
+def test_filter_without_known_key_is_legacy_tag(expression):
+    assert parse_client_filter(expression) == Term('tag', (expression,))
+
+
+def test_tag_with_colon_is_quoted_in_expression():
+    assert parse_client_filter('tag:"promo:2022" AND operator:917').operands[0] == Term('tag', ('promo:2022',))
+    with pytest.raises(ClientFilterError, match='Unknown key'):
+        parse_client_filter('tag:vip AND promo:2022')
+
+
+@pytest.fixture
+def session(database):
+    session = SessionLocal()
+    session.query(Client).delete()
+    # NULL TAG AND TIMEZONE GIVEN EXPLICITLY, ORM WOULD APPLY THE COLUMN DEFAULT
+    session.execute(insert(Client), [
+        dict(mobile_number='79170000001', mobile_operator_code='917', tag='vip', timezone='Asia/Tokyo'),
+        dict(mobile_number='79170000002', mobile_operator_code='917', tag=None, timezone=None),
+        dict(mobile_number='79170000003', mobile_operator_code='926', tag='regular', timezone='Asia/Tokyo'),
+    ])
+    session.commit()
+    yield session
+    session.query(Client).delete()
+    session.commit()
+    session.close()
+
+
+def numbers(session, expression):
+    return sorted(session.execute(select(Client.mobile_number).where(compile_client_filter(expression))).scalars())
+
+
+def test_not_matches_clients_without_value(session):
+    assert numbers(session, 'NOT tag:vip') == ['79170000002', '79170000003']
+
+
+def test_client_without_timezone_is_in_local_timezone(session):
+    assert numbers(session, f'tz:"{LOCAL_TIMEZONE}"') == ['79170000002']
+    assert numbers(session, 'NOT tz:Asia/*') == (['79170000002'] if not LOCAL_TIMEZONE.startswith('Asia/') else [])
@@ -0,0 +1,53 @@
+from sqlalchemy.exc import IntegrityError
+import pytest
+# CURRENT PROJECT MODULES
+from class_based_views.client import load_import_batch
+from db_api import Client, ClientImport, SessionLocal, create_client
+
+
+def test_mixed_batch_runs_schema_validators_of_every_row():
+    batch = [
+        (1, {'mobile_number': 'bad', 'mobile_operator_code': 'x', 'tag': 'bad'}),
+        (2, {'mobile_operator_code': '917', 'tag': 'missing number'}),
+        (3, {'mobile_number': '79170000001', 'mobile_operator_code': '917', 'tag': 'ok'}),
+    ]
+    valid, errors = load_import_batch(batch)
+    assert [row_no for row_no, _ in valid] == [3]
+    assert sorted(error['row'] for error in errors) == [1, 2]
+    assert 'mobile_number' in next(error['errors'] for error in errors if error['row'] == 1)
+
+
+def test_batch_rejects_rows_which_are_not_objects():
+    valid, errors = load_import_batch([(1, ['79170000001']), (2, 'text')])
+    assert valid == []
+    assert [error['row'] for error in errors] == [1, 2]
+
+
+@pytest.fixture
+def session(database):
+    session = SessionLocal()
+    yield session
+    session.rollback()
+    session.query(Client).delete()
+    session.commit()
+    session.close()
+
+
+def test_import_merges_on_unique_mobile_number(session):
+    create_client(session, dict(mobile_number='79170000001', mobile_operator_code='917', tag='old'))
+    rows = [dict(mobile_number='79170000001', tag='new'), dict(mobile_number='79170000002', tag='new'),
+            dict(mobile_number='79170000002', tag='duplicate')]
+    client_import = ClientImport(session, on_conflict='update')
+    client_import.stage((row_no, row) for row_no, row in enumerate(rows))
+    assert client_import.merge() == {"created": 1, "existing": 1, "updated": 1, "duplicates": 1}
+    assert dict(session.query(Client.mobile_number, Client.tag)) == {'79170000001': 'new', '79170000002': 'new'}
+
+
+def test_create_client_keeps_existing_one(session):
+    first, created = create_client(session, dict(mobile_number='79170000003', mobile_operator_code='917', tag='a'))
+    assert created and first.timezone == 'Europe/Moscow'
+    second, created = create_client(session, dict(mobile_number='79170000003', mobile_operator_code='917', tag='b'))
+    assert not created and second.id == first.id and second.tag == 'a'
+    with pytest.raises(IntegrityError):
+        session.add(Client(mobile_number='79170000003', tag='c'))
+        session.commit()
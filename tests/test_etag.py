@@ -0,0 +1,47 @@
+from marshmallow import Schema
+import pytest
+# CURRENT PROJECT MODULES
+from db_api import Client, SessionLocal
+from json_validator import FastDump
+
+
+@pytest.fixture
+def client_id(client):
+    response = client.post('/api/v1/client/', json={'mobile_number': '79170000100', 'mobile_operator_code': '917',
+                                                    'tag': 'etag', 'timezone': 'Europe/Moscow'})
+    assert response.status_code == 200
+    yield response.json['client']['id']
+    session = SessionLocal()
+    session.query(Client).filter_by(id=response.json['client']['id']).delete()
+    session.commit()
+    session.close()
+
+
+@pytest.fixture
+def no_serialization(monkeypatch):
+    def dump(*args, **kwargs):
+        raise AssertionError('response was serialized')
+
+    monkeypatch.setattr(Schema, 'dump', dump)
+    monkeypatch.setattr(FastDump, 'dump', dump)
+    monkeypatch.setattr(FastDump, 'dump_one', dump)
+
+
+@pytest.mark.parametrize('url', ['/api/v1/client/{id}', '/api/v1/client/?tag=etag', '/api/v1/distribution/'])
+def test_not_modified_skips_serialization(client, client_id, url, request):
+    url = url.format(id=client_id)
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers['ETag']
+    request.getfixturevalue('no_serialization')
+    response = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == first.headers['ETag']
+
+
+def test_changed_entity_gets_new_etag(client, client_id):
+    first = client.get(f'/api/v1/client/{client_id}')
+    assert client.put(f'/api/v1/client/{client_id}', json={'tag': 'etag changed'}).status_code == 200
+    response = client.get(f'/api/v1/client/{client_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.json['client']['tag'] == 'etag changed'
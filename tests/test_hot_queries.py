@@ -0,0 +1,17 @@
+import pytest
+# CURRENT PROJECT MODULES
+from db_api import SessionLocal
+from db_api.migrate import HOT_QUERIES, explain_hot_query, index_names, node_types
+
+
+@pytest.mark.parametrize('name', HOT_QUERIES)
+def test_hot_query_uses_its_index(database, name):
+    query, expected = HOT_QUERIES[name]
+    session = SessionLocal()
+    try:
+        plan = explain_hot_query(session, query)
+    finally:
+        session.rollback()
+        session.close()
+    assert 'Seq Scan' not in node_types(plan), f'{name} has no usable index'
+    assert index_names(plan) & expected, f'{name} uses {index_names(plan)} instead of {expected}'
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update
+import pytest
+# CURRENT PROJECT MODULES
+from db_api import Client, Distribution, DistributionStats, Message, MessageTimeseries, SessionLocal
+from sender import BatchLease, WriteBackBuffer, claim_unsent_batch, iter_claimed_batches
+
+MESSAGES = 20
+
+
+@pytest.fixture
+def session(database):
+    session = SessionLocal()
+    yield session
+    session.rollback()
+    for model in (Message, DistributionStats, MessageTimeseries, Distribution, Client):
+        session.query(model).delete()
+    session.commit()
+    session.close()
+
+
+@pytest.fixture
+def distribution_id(session):
+    distribution = Distribution(text='lease', client_filter='lease', start_date=datetime.now(),
+                                end_date=datetime.now() + timedelta(hours=1))
+    session.add(distribution)
+    session.flush()
+    client_ids = session.execute(insert(Client).returning(Client.id), [
+        dict(mobile_number=f'7917{i:07d}', mobile_operator_code='917', tag='lease') for i in range(MESSAGES)
+    ]).scalars().all()
+    session.execute(insert(Message), [dict(distribution_id=distribution.id, client_id=client_id,
+                                           send_status='NOT_SENT') for client_id in client_ids])
+    session.commit()
+    return distribution.id
+
+
+def claim_all(distribution_id, worker_id):
+    session = SessionLocal()
+    try:
+        distr = session.get(Distribution, distribution_id)
+        return [row.id for batch in iter_claimed_batches(session, distr, worker_id=worker_id, batch_size=3)
+                for row in batch]
+    finally:
+        session.close()
+
+
+def test_concurrent_workers_claim_disjoint_batches(distribution_id):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        claimed = list(executor.map(claim_all, [distribution_id] * 4, [f'worker-{i}' for i in range(4)]))
+    ids = [msg_id for worker_ids in claimed for msg_id in worker_ids]
+    assert len(ids) == len(set(ids)) == MESSAGES
+
+
+def expire_leases(session, msg_ids):
+    session.execute(update(Message).where(Message.id.in_(msg_ids))
+                    .values(lease_expires_at=datetime.now() - timedelta(seconds=1)))
+    session.commit()
+
+
+def test_expired_lease_is_taken_over_and_stale_outcome_dropped(session, distribution_id):
+    distr = session.get(Distribution, distribution_id)
+    stale = claim_unsent_batch(session, distr, worker_id='stale', batch_size=5)
+    msg_ids = [row.id for row in stale]
+    assert claim_unsent_batch(session, distr, worker_id='other', batch_size=5)[0].id > msg_ids[-1]
+
+    expire_leases(session, msg_ids)
+    taken = claim_unsent_batch(session, distr, worker_id='new', batch_size=5)
+    assert [row.id for row in taken] == msg_ids
+
+    # THE STALLED OWNER FINDS OUT ON ITS NEXT RENEWAL AND STOPS SENDING THE BATCH
+    lease = BatchLease(session, stale, worker_id='stale')
+    lease.renewed_at -= lease.lease_seconds
+    lease.keep_alive()
+    assert lease.lost == set(msg_ids) and not lease.owns(msg_ids[0])
+
+    now = datetime.now()
+    stale_writeback = WriteBackBuffer(session, worker_id='stale')
+    for msg_id in msg_ids:
+        stale_writeback.add(msg_id, 'FAIL', now, next_attempt_at=now + timedelta(minutes=5))
+    stale_writeback.flush()
+    assert stale_writeback.stats.leases_lost == len(msg_ids)
+
+    writeback = WriteBackBuffer(session, worker_id='new')
+    for msg_id in msg_ids:
+        writeback.add(msg_id, 'SENT', now, send_date=now)
+    writeback.flush()
+    # THE STALE OWNER ALSO CAN'T OVERWRITE AN OUTCOME WRITTEN ALREADY
+    stale_writeback.add(msg_ids[0], 'FAIL', now)
+    stale_writeback.flush()
+    assert writeback.stats.leases_lost == 0 and stale_writeback.stats.leases_lost == len(msg_ids) + 1
+    rows = session.query(Message.send_status, Message.attempts, Message.lease_owner) \
+        .filter(Message.id.in_(msg_ids)).all()
+    assert set(rows) == {('SENT', 1, None)}
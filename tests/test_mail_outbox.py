@@ -0,0 +1,113 @@
+from email import message_from_bytes
+from flask import Flask
+from flask_mail import Mail
+from threading import Lock, Thread
+import socketserver
+import pytest
+# CURRENT PROJECT MODULES
+from db_api import Client, Distribution, DistributionStats, Message, SessionLocal
+from mailing import MailJob, MailOutbox, statistic_report_message
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    """ Just enough SMTP for smtplib.sendmail: accepts every command, DATA replies 451 while fail_data > 0 """
+
+    def reply(self, line: str):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.reply('220 stub')
+        lines = None
+        for raw in self.rfile:
+            line = raw.decode().rstrip('\r\n')
+            if lines is not None:
+                if line != '.':
+                    lines.append(line[1:] if line.startswith('..') else line)
+                    continue
+                with self.server.lock:
+                    failed = self.server.fail_data > 0
+                    self.server.fail_data -= failed
+                    if not failed:
+                        self.server.messages.append('\r\n'.join(lines).encode())
+                self.reply('451 try again later' if failed else '250 queued')
+                lines = None
+            elif line[:4].upper() in ('EHLO', 'HELO'):
+                self.reply('250 stub')
+            elif line[:4].upper() == 'DATA':
+                lines = []
+                self.reply('354 end data with .')
+            elif line[:4].upper() == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), StubSMTPHandler)
+    server.daemon_threads = True
+    server.lock, server.messages, server.fail_data = Lock(), [], 0
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def outbox(smtp_server):
+    app = Flask(__name__)
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=smtp_server.server_address[1], MAIL_USE_TLS=False,
+                      MAIL_USE_SSL=False, MAIL_SUPPRESS_SEND=False)
+    Mail(app)
+    outbox = MailOutbox(timeout=5, max_attempts=3, retry_base=0.01, retry_max=0.01)
+    outbox.init_app(app)
+    return outbox
+
+
+@pytest.fixture
+def distribution_id(database):
+    session = SessionLocal()
+    distribution = Distribution(text='report', client_filter='report')
+    client = Client(mobile_number='79170000010', mobile_operator_code='917', tag='report')
+    session.add_all([distribution, client])
+    session.flush()
+    session.add(Message(distribution_id=distribution.id, client_id=client.id, send_status='SENT'))
+    session.commit()
+    yield distribution.id
+    session.query(Message).delete()
+    session.query(DistributionStats).delete()
+    session.query(Distribution).delete()
+    session.query(Client).delete()
+    session.commit()
+    session.close()
+
+
+def send_report(outbox) -> MailJob:
+    job = MailJob('statistic report', lambda: statistic_report_message('report@example.com', ['to@example.com']))
+    # THE WORKER THREAD RUNS process() THE SAME WAY, HERE IT IS CALLED DIRECTLY TO STAY DETERMINISTIC
+    with outbox.app.app_context():
+        outbox.process(job)
+    return job
+
+
+def test_report_summary_and_csv_are_delivered(outbox, smtp_server, distribution_id):
+    send_report(outbox)
+    assert outbox.stats.sent == 1 and outbox.stats.retries == 0
+    [raw] = smtp_server.messages
+    mail = message_from_bytes(raw)
+    assert mail['Subject'].startswith('Distribution Statistic')
+    body, attachment = [part for part in mail.walk() if not part.is_multipart()]
+    assert 'SENT: 1' in body.get_payload(decode=True).decode()
+    assert attachment.get_filename().startswith('distribution_statistic_')
+    rows = attachment.get_payload(decode=True).decode().splitlines()
+    assert rows[0].startswith('id,start_date') and any(row.startswith(f'{distribution_id},') for row in rows[1:])
+
+
+def test_failed_delivery_is_retried(outbox, smtp_server, distribution_id):
+    smtp_server.fail_data = 1
+    job = send_report(outbox)
+    assert job.attempt == 2
+    assert outbox.stats.sent == 1 and outbox.stats.retries == 1 and outbox.stats.failed == 0
+    assert len(smtp_server.messages) == 1
+    assert '451' in outbox.stats.last_error
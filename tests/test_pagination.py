@@ -0,0 +1,20 @@
+import pytest
+# CURRENT PROJECT MODULES
+from extension.pagination import parse_list_args, projected_dumper, LIST_PROJECTION_CACHE_SIZE
+from json_validator import ClientSchema
+
+
+def test_fields_are_normalized_to_one_projection():
+    _, repeated = parse_list_args({'fields': 'tag,id,id,tag,id'}, ClientSchema)
+    _, ordered = parse_list_args({'fields': 'id, tag'}, ClientSchema)
+    assert repeated.fields == ordered.fields == ('id', 'tag')
+    assert repeated.dumper(ClientSchema) is ordered.dumper(ClientSchema)
+
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(ValueError, match='Unknown fields: nope'):
+        parse_list_args({'fields': 'id,nope'}, ClientSchema)
+
+
+def test_projection_cache_is_bounded():
+    assert projected_dumper.cache_info().maxsize == LIST_PROJECTION_CACHE_SIZE
@@ -0,0 +1,92 @@
+import pytest
+# CURRENT PROJECT MODULES
+from sender import Dispatcher, SendJob, SendResult
+from sender.throttle import CircuitBreaker, TokenBucket
+
+
+class FakeClock:
+    """ Monotonic clock which only moves when something sleeps on it """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_spaces_acquires_at_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=1, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == [0.5, 0.5]
+
+
+def test_token_bucket_burst_and_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1, capacity=3, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == [] and not bucket.full
+    clock.now += 2
+    assert not bucket.full
+    clock.now += 1
+    assert bucket.full
+
+
+def result(ok: bool) -> SendResult:
+    return SendResult(SendJob(msg_id=1, phone='79170000000', text='text'), status_code=200 if ok else 500)
+
+
+def test_circuit_opens_after_threshold_and_probes_after_reset():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30, clock=clock)
+    for _ in range(2):
+        breaker.record(result(False))
+    assert breaker.allow()
+    breaker.record(result(False))
+    assert breaker.is_open and not breaker.allow()
+    clock.now += 30
+    # ONE PROBE AT A TIME, ITS FAILURE OPENS THE CIRCUIT AGAIN FOR reset_seconds
+    assert breaker.allow() and not breaker.allow()
+    breaker.record(result(False))
+    assert breaker.is_open
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    breaker.record(result(True))
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow() and breaker.allow()
+
+
+def test_success_resets_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30, clock=FakeClock())
+    for ok in (False, True, False):
+        breaker.record(result(ok))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = Dispatcher(token='test', url='http://127.0.0.1:9/', concurrency=1, distribution_rate_limit=1)
+    yield dispatcher
+    dispatcher.close()
+
+
+def test_idle_distribution_rate_limiters_are_dropped(dispatcher):
+    clock = FakeClock()
+    busy = dispatcher._distribution_rate_limiter(1)
+    busy.clock, busy.updated_at = clock, clock.now
+    busy.acquire()
+    dispatcher._distribution_rate_limiter(2)
+    dispatcher._distribution_rate_limiter(3)
+    # 2 NEVER SENT ANYTHING, 1 HAS NOT REFILLED YET
+    assert set(dispatcher.distribution_rate_limiters) == {1, 3}
+    clock.now += 1
+    dispatcher._distribution_rate_limiter(4)
+    assert set(dispatcher.distribution_rate_limiters) == {4}
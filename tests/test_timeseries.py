@@ -0,0 +1,51 @@
+from datetime import datetime
+from sqlalchemy import update
+import pytest
+# CURRENT PROJECT MODULES
+from db_api import Client, Distribution, DistributionStats, Message, MessageTimeseries, SessionLocal
+from db_api.stats_reconcile import verify_timeseries
+
+FIRST, SECOND, THIRD = datetime(2026, 10, 18, 8, 0), datetime(2026, 10, 18, 8, 5), datetime(2026, 10, 18, 8, 9)
+
+
+@pytest.fixture
+def session(database):
+    session = SessionLocal()
+    yield session
+    session.query(Message).delete()
+    session.query(MessageTimeseries).delete()
+    session.query(DistributionStats).delete()
+    session.query(Distribution).delete()
+    session.query(Client).delete()
+    session.commit()
+    session.close()
+
+
+def attempt(session, message_id, status, attempted_at):
+    """ Outcome write of the distribution maker (sender.writeback) """
+    session.execute(update(Message).where(Message.id == message_id).values(
+        send_status=status, attempts=Message.attempts + 1, last_attempt_at=attempted_at,
+        send_date=attempted_at if status == 'SENT' else None))
+    session.commit()
+
+
+def minutes(session, distribution_id):
+    return {row.bucket: (row.sent_count, row.fail_count) for row in session.query(MessageTimeseries)
+            .filter_by(distribution_id=distribution_id) if row.sent_count or row.fail_count}
+
+
+def test_retry_does_not_change_closed_minutes(session):
+    distribution = Distribution(text='timeseries', client_filter='timeseries')
+    client = Client(mobile_number='79170000009', mobile_operator_code='917', tag='timeseries')
+    session.add_all([distribution, client])
+    session.flush()
+    message = Message(distribution_id=distribution.id, client_id=client.id, attempts=0)
+    session.add(message)
+    session.commit()
+
+    attempt(session, message.id, 'FAIL', FIRST)
+    assert minutes(session, distribution.id) == {FIRST: (0, 1)}
+    attempt(session, message.id, 'FAIL', SECOND)
+    attempt(session, message.id, 'SENT', THIRD)
+    assert minutes(session, distribution.id) == {FIRST: (0, 1), SECOND: (0, 1), THIRD: (1, 0)}
+    assert verify_timeseries(session)
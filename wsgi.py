@@ -0,0 +1,9 @@
+"""
+WSGI entry point of the API and admin dashboard: gunicorn -c gunicorn.conf.py wsgi:app
+
+Any WSGI server works (e.g. uwsgi --module wsgi:app), as long as the database schema is migrated first
+(python -m db_api.migrate) and periodic jobs run in their own process (report_scheduler_app.py).
+"""
+from distribution_manage_app import create_app
+
+app = create_app()